@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Discovery scaling simulator: hundreds of virtual peers on loopback.
+
+Every virtual host is a real DeviceDiscovery (sweep mode) plus a
+DiscoveryResponseServer sharing one PeerRegistry, the same pairing the GUI and
+the daemon run. Hosts get their own address in 127.77.0.0/16 (all of
+127.0.0.0/8 is routed to ``lo`` on Linux), so requests, responses and pings
+travel between distinct IPs just as they would on a LAN. Broadcast cannot be
+simulated on loopback; the sweep covers exactly the fleet's range instead.
+
+For each fleet size the report has:
+
+* convergence_s: until host 0 sees every other host
+* packets_per_s / packets_per_host_s: UDP datagrams sent, from /proc/net/snmp
+  (so nothing else should be busy on the machine), and receive-buffer drops
+* cpu_ms_per_host_s: CPU milliseconds per host per second in steady state
+* time_to_visible_s: a host joins; until host 0 lists it
+* time_to_expire_s: that host stops; until host 0 drops it
+
+``--interval`` and ``--timeout`` override DISCOVERY_INTERVAL and
+DEVICE_TIMEOUT to compress simulated time; the defaults are the shipped ones.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_discovery.py --fleet 10,100,250,500
+"""
+
+import argparse
+import ipaddress
+import json
+import math
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle import discovery  # noqa: E402
+from shuttle.config import DEVICE_TIMEOUT, DISCOVERY_INTERVAL, DISCOVERY_PORT  # noqa: E402
+from shuttle.discovery import DeviceDiscovery, DiscoveryResponseServer, PeerRegistry  # noqa: E402
+
+FLEET_NETWORK = ipaddress.ip_network('127.77.0.0/16')
+
+
+class VirtualHost:
+    def __init__(self, ip, sweep_cidr, timeout):
+        self.ip = ip
+        self.registry = PeerRegistry(timeout)
+
+        response_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        response_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        response_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        response_sock.bind((ip, DISCOVERY_PORT))
+        discovery_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        discovery_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        discovery_sock.bind((ip, 0))
+
+        self.discovery = DeviceDiscovery(mode='sweep', sweep_cidr=sweep_cidr, registry=self.registry,
+                                         sock=discovery_sock)
+        self.responder = DiscoveryResponseServer(lambda: True, registry=self.registry, sock=response_sock)
+        self._threads = []
+
+    def start(self):
+        for worker in (self.responder, self.discovery):
+            thread = threading.Thread(target=worker.run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def signal_stop(self):
+        self.discovery.stop()
+        self.responder.stop()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join(5)
+
+
+def udp_counters():
+    """System-wide UDP counters from /proc/net/snmp, or None off Linux."""
+    try:
+        with open('/proc/net/snmp') as f:
+            rows = [line.split() for line in f if line.startswith('Udp:')]
+    except OSError:
+        return None
+    return dict(zip(rows[0][1:], map(int, rows[1][1:])))
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def fleet_cidr(size):
+    """Smallest block at the start of FLEET_NETWORK with room for `size` hosts."""
+    prefix = 32 - max(2, math.ceil(math.log2(size + 2)))
+    return ipaddress.ip_network(f"{FLEET_NETWORK.network_address}/{prefix}")
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def run_fleet(size, args):
+    network = fleet_cidr(size + 1) # one spare address for the joining host
+    addresses = [str(ip) for ip in network.hosts()]
+    hosts = [VirtualHost(ip, str(network), args.timeout) for ip in addresses[:size]]
+    observer = hosts[0]
+
+    joined, left = threading.Event(), threading.Event()
+    joiner_ip = addresses[size]
+    observer.registry.subscribe(lambda record: record['ip'] == joiner_ip and joined.set(),
+                                lambda record: None,
+                                lambda record: record['ip'] == joiner_ip and left.set())
+
+    result = {'fleet': size, 'cidr': str(network)}
+    start = time.monotonic()
+    for i, host in enumerate(hosts):
+        host.start()
+        delay = start + args.ramp * (i + 1) / size - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    try:
+        def visible():
+            return sum(ip != observer.ip for ip in observer.registry.ips()) # it also hears its own sweep
+
+        settled = wait_for(lambda: visible() >= size - 1, args.settle)
+        result['convergence_s'] = time.monotonic() - start if settled else None
+        result['visible_at_settle'] = visible()
+
+        counters_before, cpu_before = udp_counters(), cpu_seconds()
+        time.sleep(args.window)
+        counters_after, cpu_after = udp_counters(), cpu_seconds()
+        if counters_before and counters_after:
+            sent = counters_after['OutDatagrams'] - counters_before['OutDatagrams']
+            result['packets_per_s'] = sent / args.window
+            result['packets_per_host_s'] = sent / args.window / size
+            result['rcvbuf_drops'] = counters_after['RcvbufErrors'] - counters_before['RcvbufErrors']
+        result['cpu_ms_per_host_s'] = (cpu_after - cpu_before) / args.window / size * 1000
+
+        joiner = VirtualHost(joiner_ip, str(network), args.timeout)
+        joined_at = time.monotonic()
+        joiner.start()
+        result['time_to_visible_s'] = time.monotonic() - joined_at if joined.wait(args.settle) else None
+
+        joiner.signal_stop()
+        joiner.join() # the responder answers until its 1 s receive timeout fires
+        left_at = time.monotonic()
+        expiry_limit = args.timeout + 3 * args.interval
+        result['time_to_expire_s'] = time.monotonic() - left_at if left.wait(expiry_limit) else None
+    finally:
+        for host in hosts:
+            host.signal_stop()
+        for host in hosts:
+            host.join()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fleet', default='10,100,250,500', help="comma separated fleet sizes")
+    parser.add_argument('--interval', type=float, default=DISCOVERY_INTERVAL, help="discovery round, seconds")
+    parser.add_argument('--timeout', type=float, default=DEVICE_TIMEOUT, help="peer expiry, seconds")
+    parser.add_argument('--ramp', type=float, default=2.0, help="spread host start-up over this many seconds")
+    parser.add_argument('--settle', type=float, default=60.0, help="give up on convergence after this long")
+    parser.add_argument('--window', type=float, default=10.0, help="steady-state measurement window, seconds")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    discovery.DISCOVERY_INTERVAL = args.interval # read on every round of DeviceDiscovery.run
+
+    report = {'python': sys.version.split()[0], 'interval_s': args.interval, 'timeout_s': args.timeout,
+              'results': []}
+    for size in (int(n) for n in args.fleet.split(',')):
+        result = run_fleet(size, args)
+        print(json.dumps(result), file=sys.stderr)
+        report['results'].append(result)
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Load test: many concurrent senders against one receiver.
+
+Each simulated sender is a thread speaking the transfer protocol directly
+(no files are read), so one process can drive dozens of connections. Every
+transfer records, relative to its scheduled arrival time:
+
+* accept: until the TCP connect completes (listen backlog admission)
+* first_byte: until the receiver answers the metadata with ``OK``, i.e. its
+  accept loop has picked the connection up
+* complete: until the receiver closes the connection after the last byte
+
+Latencies are measured from the scheduled arrival, not from when the thread
+got round to it, so a slow receiver shows up as latency instead of a lower
+offered load. With ``--rate 0`` every sender runs closed-loop (next file as
+soon as the previous one finishes); otherwise arrivals are Poisson at
+``--rate`` transfers/s per sender.
+
+Size distributions (``--sizes``):
+    fixed:1M  uniform:1K-10M  lognormal:1M,1.5 (median, sigma)  choice:1K,1M,100M
+
+By default a headless receiver (``python3 -m shuttle receive``) is spawned
+with its save directory on tmpfs; ``--target HOST:PORT`` uses a running one.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_load.py --senders 32 --files 4 --sizes lognormal:1M,1.5
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from bench_throughput import parse_size, storage_root  # noqa: E402
+
+PAYLOAD = memoryview(bytes(1024 * 1024))
+
+
+def size_sampler(spec, rng):
+    kind, _, params = spec.partition(':')
+    if kind == 'fixed':
+        size = parse_size(params)
+        return lambda: size
+    if kind == 'uniform':
+        low, high = (parse_size(p) for p in params.split('-'))
+        return lambda: rng.randint(low, high)
+    if kind == 'lognormal':
+        median, sigma = params.split(',')
+        mu = math.log(parse_size(median))
+        return lambda: max(1, int(rng.lognormvariate(mu, float(sigma))))
+    if kind == 'choice':
+        sizes = [parse_size(p) for p in params.split(',')]
+        return lambda: rng.choice(sizes)
+    raise ValueError(f"Unknown size distribution '{spec}'")
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def rank(p):
+        return samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))] * 1000
+
+    return {'count': len(samples), 'p50_ms': rank(50), 'p95_ms': rank(95), 'p99_ms': rank(99),
+            'max_ms': samples[-1] * 1000}
+
+
+def transfer(host, port, name, size, arrival, timeout):
+    """One simulated send; returns a record with phase times relative to `arrival`."""
+    record = {'size': size}
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            record['accept'] = time.perf_counter() - arrival
+            metadata = json.dumps({'filename': name, 'filesize': size}).encode('utf-8')
+            s.sendall(len(metadata).to_bytes(4, 'big') + metadata)
+            if s.recv(4) != b'OK':
+                record['error'] = 'not_ready'
+                return record
+            record['first_byte'] = time.perf_counter() - arrival
+
+            remaining = size
+            while remaining > 0:
+                chunk = PAYLOAD[:min(len(PAYLOAD), remaining)]
+                s.sendall(chunk)
+                remaining -= len(chunk)
+            s.shutdown(socket.SHUT_WR)
+            s.recv(1) # the receiver closes once the last byte is written
+            record['complete'] = time.perf_counter() - arrival
+    except ConnectionRefusedError:
+        record['error'] = 'refused'
+    except socket.timeout:
+        record['error'] = 'timeout'
+    except OSError as e:
+        record['error'] = type(e).__name__
+    return record
+
+
+def sender_loop(index, args, host, port, origin, records):
+    rng = random.Random(args.seed + index)
+    next_size = size_sampler(args.sizes, rng)
+    arrival = origin + rng.uniform(0, args.ramp)
+    for i in range(args.files):
+        if args.rate > 0 and i > 0:
+            arrival += rng.expovariate(args.rate)
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        record = transfer(host, port, f"load-{index:04d}-{i:04d}.bin", next_size(), arrival, args.timeout)
+        record['end'] = time.perf_counter()
+        records.append(record)
+        if args.rate <= 0:
+            arrival = time.perf_counter()
+
+
+def spawn_receiver(port, save_dir, timeout=30):
+    command = [sys.executable, '-m', 'shuttle', 'receive', '--no-discovery', '--listen', '127.0.0.1',
+               '--port', str(port), '--dir', save_dir]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.01)
+    process.kill()
+    raise RuntimeError("Receiver did not start listening.")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--senders', type=int, default=16, help="concurrent simulated senders")
+    parser.add_argument('--files', type=int, default=4, help="transfers per sender")
+    parser.add_argument('--sizes', default='lognormal:256K,1.5', help="size distribution, see above")
+    parser.add_argument('--rate', type=float, default=0, help="Poisson arrivals/s per sender, 0 = closed loop")
+    parser.add_argument('--ramp', type=float, default=0, help="spread sender start times over this many seconds")
+    parser.add_argument('--timeout', type=float, default=60, help="socket timeout per transfer")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--target', metavar='HOST:PORT', help="use a running receiver instead of spawning one")
+    parser.add_argument('--storage', choices=('tmpfs', 'disk'), default='tmpfs')
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+    size_sampler(args.sizes, random.Random()) # reject a bad spec before starting anything
+
+    receiver = None
+    work = None
+    if args.target:
+        host, _, port = args.target.rpartition(':')
+        port = int(port)
+    else:
+        work = tempfile.mkdtemp(prefix='shuttle-load-', dir=storage_root(args.storage))
+        host, port = '127.0.0.1', free_port()
+        receiver = spawn_receiver(port, work)
+
+    records = []
+    try:
+        origin = time.perf_counter() + 0.1
+        threads = [threading.Thread(target=sender_loop, args=(i, args, host, port, origin, records), daemon=True)
+                   for i in range(args.senders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if receiver:
+            receiver.terminate()
+            receiver.wait(10)
+        if work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    completed = [r for r in records if 'complete' in r]
+    errors = {}
+    for r in records:
+        if 'error' in r:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    duration = max((r['end'] for r in records), default=origin) - origin
+    completed_bytes = sum(r['size'] for r in completed)
+
+    report = {
+        'python': sys.version.split()[0],
+        'config': {k: v for k, v in vars(args).items() if k not in ('output',)},
+        'transfers': len(records),
+        'completed': len(completed),
+        'errors': errors,
+        'duration_s': duration,
+        'throughput_mb_per_s': completed_bytes / duration / (1024 * 1024) if duration > 0 else None,
+        'transfers_per_s': len(completed) / duration if duration > 0 else None,
+        'time_to_accept': percentiles([r['accept'] for r in records if 'accept' in r]),
+        'time_to_first_byte': percentiles([r['first_byte'] for r in records if 'first_byte' in r]),
+        'completion_time': percentiles([r['complete'] for r in completed])
+    }
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Memory benchmark: large queues, many transfers and long discovery uptime.
+
+Three phases run in one process under tracemalloc; each records the traced
+growth, RSS before and after, and the top allocation sites:
+
+* queue: ``--files`` paths queued the way the GUI does it (one list from the
+  file dialog) plus the copy FileSender keeps; reports bytes per queued file.
+  With ``--gui`` and PyQt5 installed, the QListWidget rows are added too
+  (C++ memory, so RSS only).
+* transfers: ``--transfers`` one-file jobs through a ShuttleDaemon over
+  loopback, with receiver messages fed into a LogBuffer as the GUI does.
+* churn: ``--days`` of simulated discovery rounds (PeerRegistry, LinkMonitor
+  and PeerCache) for a fleet where ``--churn`` of the peers change address
+  every hour, as on a DHCP network. The clock is simulated, so days of
+  uptime take a minute or two.
+
+Run from the Linux directory:  python3 benchmarks/bench_memory.py --files 1000000
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle.config import DISCOVERY_INTERVAL, LOG_CAPACITY  # noqa: E402
+from shuttle.daemon import ShuttleDaemon  # noqa: E402
+from shuttle.discovery import LinkMonitor, PeerCache, PeerRegistry  # noqa: E402
+from shuttle.logbuffer import LogBuffer  # noqa: E402
+from shuttle.transfer import FileSender  # noqa: E402
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    filename = os.path.relpath(frame.filename, ROOT) if frame.filename.startswith(ROOT) else frame.filename
+    return {'site': f"{filename}:{frame.lineno}", 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+
+
+class Phase:
+    """Measures traced and resident growth across a `with` block."""
+
+    def __init__(self, name, top):
+        self.name = name
+        self.top = top
+        self.result = {}
+
+    def __enter__(self):
+        self._rss = rss_bytes()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start
+        snapshot = tracemalloc.take_snapshot()
+        rss = rss_bytes()
+        stats = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).compare_to(
+            self._snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]), 'lineno')
+        self.result.update({
+            'seconds': elapsed,
+            'traced_bytes': sum(stat.size_diff for stat in stats),
+            'rss_before_mb': self._rss / 2**20 if self._rss else None,
+            'rss_after_mb': rss / 2**20 if rss else None,
+            'top_sites': [_site(stat) for stat in stats[:self.top]]
+        })
+
+
+def phase_queue(args, report):
+    with Phase('queue', args.top) as phase:
+        paths = [f"/home/user/batch/dir{i // 1000:04d}/file{i:07d}.bin" for i in range(args.files)]
+        file_queue = paths # what browse_files keeps in self.file_queue
+        sender = FileSender('127.0.0.1', 1, file_queue) # copies the queue
+    phase.result['files'] = args.files
+    phase.result['bytes_per_queued_file'] = phase.result['traced_bytes'] / args.files
+    report['queue'] = phase.result
+
+    if args.gui:
+        if importlib.util.find_spec('PyQt5') is None:
+            report['queue_gui'] = {'skipped': "PyQt5 is not installed"}
+        else:
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+            from PyQt5.QtWidgets import QApplication, QListWidget
+            app = QApplication([])
+            widget = QListWidget()
+            before = rss_bytes()
+            for path in paths:
+                widget.addItem(f"{os.path.basename(path)} (0.0 MB)")
+            after = rss_bytes()
+            report['queue_gui'] = {'rss_bytes_per_row': (after - before) / args.files if before else None}
+            widget.clear()
+            app.quit()
+
+    del paths, file_queue, sender
+
+
+def phase_transfers(args, report, work):
+    payload = os.path.join(work, 'payload.bin')
+    with open(payload, 'wb') as f:
+        f.write(os.urandom(args.transfer_size))
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+    port = listener.getsockname()[1]
+
+    log_buffer = LogBuffer(LOG_CAPACITY, log_file=None)
+    done = threading.Semaphore(0)
+
+    with Phase('transfers', args.top) as phase:
+        daemon = ShuttleDaemon(os.path.join(work, 'received'), '127.0.0.1', port,
+                               os.path.join(work, 'control.sock'), discovery=False,
+                               listeners={'tcp': listener})
+        daemon.on('receiver_status_message', lambda event: log_buffer.log(event['args'][0]))
+        daemon.on('job_finished', lambda event: done.release())
+        daemon.start()
+        for _ in range(args.transfers):
+            daemon.enqueue('127.0.0.1', port, [payload])
+        finished = sum(done.acquire(timeout=30) for _ in range(args.transfers))
+        states = {}
+        for job in daemon.status()['jobs']:
+            states[job['state']] = states.get(job['state'], 0) + 1
+        daemon.stop()
+
+    phase.result.update({
+        'transfers': args.transfers,
+        'finished': finished,
+        'job_states': states,
+        'log_entries': len(log_buffer.since(0)),
+        'bytes_per_transfer': phase.result['traced_bytes'] / args.transfers
+    })
+    report['transfers'] = phase.result
+    log_buffer.close()
+
+
+def phase_churn(args, report, work):
+    rng = random.Random(args.seed)
+    next_host = iter(range(1, 2**24))
+
+    def new_ip():
+        n = next(next_host)
+        return f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+    with Phase('churn', args.top) as phase:
+        registry = PeerRegistry()
+        link_monitor = LinkMonitor()
+        peer_cache = PeerCache(os.path.join(work, 'peers.json'))
+        fleet = [new_ip() for _ in range(args.fleet)]
+        info = {'port': 65432, 'capabilities': ['json-metadata'], 'load': {}}
+
+        start = time.time()
+        rounds = int(args.days * 86400 / DISCOVERY_INTERVAL)
+        rounds_per_hour = int(3600 / DISCOVERY_INTERVAL)
+        seen = set(fleet)
+        for round_index in range(rounds):
+            now = start + round_index * DISCOVERY_INTERVAL
+            if round_index and round_index % rounds_per_hour == 0:
+                for i in rng.sample(range(len(fleet)), int(len(fleet) * args.churn)):
+                    fleet[i] = new_ip()
+                    seen.add(fleet[i])
+                peer_cache.save()
+
+            for ip in fleet:
+                registry.update(ip, f"host-{ip}", True, info, now=now)
+                link_monitor.add_rtt(ip, 0.0005)
+                peer_cache.update(ip, f"host-{ip}", info['port'], info['capabilities'], last_seen=now)
+            for record in registry.expire(now=now):
+                link_monitor.forget(record['ip'])
+
+    phase.result.update({
+        'simulated_days': args.days,
+        'rounds': rounds,
+        'distinct_peers': len(seen),
+        'registry_size': len(registry),
+        'cached_peers': len(peer_cache.peers())
+    })
+    report['churn'] = phase.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000000, help="paths to queue")
+    parser.add_argument('--gui', action='store_true', help="also measure the QListWidget rows")
+    parser.add_argument('--transfers', type=int, default=10000, help="one-file jobs to run")
+    parser.add_argument('--transfer-size', type=int, default=1024)
+    parser.add_argument('--days', type=float, default=3, help="simulated discovery uptime")
+    parser.add_argument('--fleet', type=int, default=50, help="peers online at any time")
+    parser.add_argument('--churn', type=float, default=0.1, help="share of peers changing address every hour")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--top', type=int, default=10, help="allocation sites to report per phase")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    report = {'python': sys.version.split()[0]}
+    with tempfile.TemporaryDirectory() as work:
+        phase_queue(args, report)
+        phase_transfers(args, report, work)
+        phase_churn(args, report, work)
+    tracemalloc.stop()
+
+    report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Multicast benchmark: MulticastSender against several receivers with packet loss.
+
+Sweeps the loss rate and reports, per case:
+
+* mb_per_s: payload MiB/s, from the first datagram until the sender is done
+  (every receiver has confirmed every file)
+* repair_rounds, repaired_blocks: NAK repair the sender had to do
+* parity_overhead: parity bytes sent per payload byte
+* per receiver: datagrams dropped, blocks rebuilt from parity, NAKs sent
+* ok: every receiver has every file with the right SHA-256
+
+By default everything runs on loopback and loss is simulated by the
+receivers (``--drop``). With ``--netns`` (root only) the sender and each
+receiver get their own network namespace, joined by veth pairs to a bridge
+in a hub namespace, and loss is applied with the netem qdisc on the hub side
+of each receiver's link when the kernel has it; otherwise the harness falls
+back to receiver-side dropping and says so in the report.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_multicast.py --receivers 3 --loss 0,0.01,0.05
+    python3 benchmarks/bench_multicast.py --size 200M --fec 32,0 --loss 0.02
+    sudo python3 benchmarks/bench_multicast.py --netns --receivers 8 --loss 0.01
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle.config import (MULTICAST_BLOCK_SIZE, MULTICAST_FEC_K, MULTICAST_FEC_R, MULTICAST_GROUP,  # noqa: E402
+                            MULTICAST_RATE)
+from shuttle.multicast import MulticastReceiver, MulticastSender  # noqa: E402
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BLOCK = 1024 * 1024
+NETNS_PREFIX = 'lfsmc'
+NETNS_SUBNET = '10.77.0.'
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('IB').rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:-1] if unit else text) * UNITS[unit])
+
+
+def storage_root(storage):
+    if storage == 'tmpfs' and os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def make_corpus(directory, size, count):
+    """Write `count` files of `size` random bytes; returns {path: sha256}."""
+    digests = {}
+    for i in range(count):
+        path = os.path.join(directory, f"file{i:04d}.bin")
+        digest = hashlib.sha256()
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                block = os.urandom(min(remaining, BLOCK))
+                f.write(block)
+                digest.update(block)
+                remaining -= len(block)
+        digests[path] = digest.hexdigest()
+    return digests
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_receiver(spec):
+    """Receive one session in this process and report the receiver's counters."""
+    receiver = MulticastReceiver(spec['dir'], spec['group'], spec['port'], spec['interface'],
+                                 drop_rate=spec['drop'], once=True)
+    failures = []
+    receiver.on('transfer_complete', lambda success, message: None if success else failures.append(message))
+    receiver.on('server_started', lambda started, message: None if started else failures.append(message))
+    receiver.run()
+    return dict(receiver.stats, errors=failures)
+
+
+def run_sender(spec):
+    """Send the corpus from this process and report timing and the sender's counters."""
+    sender = MulticastSender(spec['files'], spec['group'], spec['port'], spec['interface'], rate=spec['rate'],
+                             fec=tuple(spec['fec']), receivers=spec['receivers'])
+    result = {}
+    sender.on('transfer_complete', lambda success, message: result.update(success=success, message=message))
+    start = time.perf_counter()
+    sender.run()
+    return dict(sender.stats, seconds=time.perf_counter() - start, **result)
+
+
+def worker_command(mode, spec, netns=None):
+    command = [sys.executable, os.path.abspath(__file__), mode, json.dumps(spec)]
+    return ['ip', 'netns', 'exec', netns] + command if netns else command
+
+
+def sh(*command, check=True):
+    return subprocess.run(command, capture_output=True, text=True, check=check)
+
+
+class Netns:
+    """Sender and receiver namespaces on one bridge; `loss` per receiver link via netem if available."""
+
+    def __init__(self, receivers):
+        self.receivers = receivers
+        self.hub = f"{NETNS_PREFIX}-hub"
+        self.names = [f"{NETNS_PREFIX}-{i}" for i in range(receivers + 1)] # 0 is the sender
+        self.addresses = [f"{NETNS_SUBNET}{i + 1}" for i in range(receivers + 1)]
+
+    def setup(self):
+        self.close() # leftovers of an interrupted run
+        sh('ip', 'netns', 'add', self.hub)
+        sh('ip', 'netns', 'exec', self.hub, 'ip', 'link', 'add', 'br0', 'type', 'bridge', 'mcast_snooping', '0')
+        sh('ip', 'netns', 'exec', self.hub, 'ip', 'link', 'set', 'br0', 'up')
+        for i, (name, address) in enumerate(zip(self.names, self.addresses)):
+            sh('ip', 'netns', 'add', name)
+            sh('ip', 'link', 'add', f"lfs{i}", 'netns', name, 'type', 'veth', 'peer', 'name', f"hub{i}",
+               'netns', self.hub)
+            sh('ip', 'netns', 'exec', self.hub, 'ip', 'link', 'set', f"hub{i}", 'master', 'br0', 'up')
+            sh('ip', 'netns', 'exec', name, 'ip', 'addr', 'add', f"{address}/24", 'dev', f"lfs{i}")
+            sh('ip', 'netns', 'exec', name, 'ip', 'link', 'set', f"lfs{i}", 'up')
+            sh('ip', 'netns', 'exec', name, 'ip', 'link', 'set', 'lo', 'up')
+            sh('ip', 'netns', 'exec', name, 'ip', 'route', 'add', '224.0.0.0/4', 'dev', f"lfs{i}")
+
+    def set_loss(self, loss):
+        """Apply `loss` on every receiver's link; returns False if netem is not available."""
+        for i in range(1, self.receivers + 1):
+            sh('ip', 'netns', 'exec', self.hub, 'tc', 'qdisc', 'del', 'dev', f"hub{i}", 'root', check=False)
+            if loss and sh('ip', 'netns', 'exec', self.hub, 'tc', 'qdisc', 'add', 'dev', f"hub{i}", 'root',
+                           'netem', 'loss', f"{loss * 100}%", check=False).returncode != 0:
+                return False
+        return True
+
+    def close(self):
+        for name in self.names + [self.hub]:
+            sh('ip', 'netns', 'del', name, check=False)
+
+
+def run_case(case, digests, work, netns, timeout):
+    loss_method = 'drop'
+    if netns and netns.set_loss(case['loss']):
+        loss_method = 'netem' if case['loss'] else 'none'
+    drop = case['loss'] if loss_method == 'drop' else 0.0
+
+    receivers = []
+    for i in range(case['receivers']):
+        save_dir = os.path.join(work, f"received-{i}")
+        spec = {'dir': save_dir, 'group': case['group'], 'port': case['port'], 'drop': drop,
+                'interface': netns.addresses[i + 1] if netns else '127.0.0.1'}
+        process = subprocess.Popen(worker_command('--run-receiver', spec, netns and netns.names[i + 1]),
+                                   cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        receivers.append((save_dir, process))
+    time.sleep(0.5) # let every receiver join the group
+
+    spec = {'files': list(digests), 'group': case['group'], 'port': case['port'], 'rate': case['rate'],
+            'fec': case['fec'], 'receivers': case['receivers'],
+            'interface': netns.addresses[0] if netns else '127.0.0.1'}
+    entry = dict(case, loss_method=loss_method)
+    try:
+        result = subprocess.run(worker_command('--run-sender', spec, netns and netns.names[0]), cwd=ROOT,
+                                capture_output=True, text=True, timeout=timeout)
+        sender = json.loads(result.stdout) if result.returncode == 0 else {
+            'success': False, 'message': (result.stderr.strip().splitlines() or ["Sender failed."])[-1]}
+    except subprocess.TimeoutExpired:
+        sender = {'success': False, 'message': f"Timed out after {timeout}s"}
+
+    entry['receiver_stats'] = []
+    ok = bool(sender.get('success'))
+    for save_dir, process in receivers:
+        try:
+            stdout, stderr = process.communicate(timeout=10)
+            stats = json.loads(stdout) if process.returncode == 0 else {'errors': [stderr.strip()[-200:]]}
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            stats = {'errors': ["Receiver did not see the end of the session."]}
+        stats['complete'] = all(
+            os.path.exists(os.path.join(save_dir, os.path.basename(path)))
+            and file_digest(os.path.join(save_dir, os.path.basename(path))) == digest
+            for path, digest in digests.items())
+        ok = ok and stats['complete'] and not stats['errors']
+        entry['receiver_stats'].append(stats)
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    total = case['size'] * case['count']
+    blocks = case['count'] * -(-case['size'] // MULTICAST_BLOCK_SIZE)
+    seconds = sender.get('seconds')
+    entry.update({
+        'ok': ok,
+        'error': None if sender.get('success') else sender.get('message'),
+        'seconds': seconds,
+        'mb_per_s': total / seconds / BLOCK if ok and seconds else None,
+        'repair_rounds': sender.get('rounds'),
+        'repaired_blocks': sender.get('repaired'),
+        'parity_overhead': sender['parity'] / blocks if 'parity' in sender and blocks else None,
+        'naks_received': sender.get('naks')
+    })
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receivers', type=int, default=3)
+    parser.add_argument('--size', default='50M', help="bytes per file, e.g. 100M")
+    parser.add_argument('--count', type=int, default=1, help="files per case")
+    parser.add_argument('--loss', default='0,0.01,0.05', help="comma separated loss rates to sweep")
+    parser.add_argument('--fec', default=f"{MULTICAST_FEC_K},{MULTICAST_FEC_R}", help="K,R")
+    parser.add_argument('--rate', default=str(MULTICAST_RATE), help="sender pacing in bytes/s, e.g. 40M")
+    parser.add_argument('--group', default=MULTICAST_GROUP)
+    parser.add_argument('--port', type=int, default=50101, help="kept off the default so a live receiver is not hit")
+    parser.add_argument('--netns', action='store_true', help="one network namespace per host, netem loss (root)")
+    parser.add_argument('--storage', choices=('tmpfs', 'disk'), default='tmpfs')
+    parser.add_argument('--timeout', type=int, default=600, help="per case, in seconds")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    parser.add_argument('--run-receiver', help=argparse.SUPPRESS)
+    parser.add_argument('--run-sender', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_receiver:
+        print(json.dumps(run_receiver(json.loads(args.run_receiver))))
+        return 0
+    if args.run_sender:
+        print(json.dumps(run_sender(json.loads(args.run_sender))))
+        return 0
+
+    if args.netns and os.geteuid() != 0:
+        print("--netns needs root.", file=sys.stderr)
+        return 1
+    size = parse_size(args.size)
+    fec = [int(part) for part in args.fec.split(',')]
+    cases = [{'receivers': args.receivers, 'size': size, 'count': args.count, 'loss': float(loss), 'fec': fec,
+              'rate': parse_size(args.rate), 'group': args.group, 'port': args.port}
+             for loss in args.loss.split(',')]
+
+    work = tempfile.mkdtemp(prefix='shuttle-mcast-', dir=storage_root(args.storage))
+    netns = Netns(args.receivers) if args.netns else None
+    results = []
+    try:
+        corpus_dir = os.path.join(work, 'corpus')
+        os.makedirs(corpus_dir)
+        digests = make_corpus(corpus_dir, size, args.count)
+        if netns:
+            netns.setup()
+        for case in cases:
+            entry = run_case(case, digests, work, netns, args.timeout)
+            print(f"loss {case['loss']:.1%} ({entry['loss_method']}): " +
+                  (f"{entry['mb_per_s']:.1f} MB/s, {entry['repair_rounds']} repair round(s)" if entry['ok']
+                   else entry['error'] or "incomplete at a receiver"), file=sys.stderr)
+            results.append(entry)
+    finally:
+        if netns:
+            netns.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {'python': sys.version.split()[0], 'mode': 'netns' if args.netns else 'loopback', 'results': results}
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Shard benchmark: a batch of files spread over several loopback receivers, with slow and failing ones.
+
+Every receiver is an in-process FileReceiver behind a throttling TCP proxy.
+The proxy caps its link at ``--rate`` bytes/s, or ``--slow-rate`` for the
+first ``--slow`` receivers. With ``--kill-after S`` the last receiver's
+proxy drops every connection after S seconds and stops accepting, so the
+sender has to place its files again. Each strategy runs on the same corpus
+of files with mixed sizes. Per strategy the report has:
+
+* seconds, and ideal_s: the batch over the summed link rates of the receivers
+  that stay up (a lower bound)
+* targets: files and bytes per receiver, from the manifest
+* moved: files that did not end up on the receiver assigned first
+* ok: every file arrived, exactly where the manifest says, byte for byte
+
+``ring_moved_share`` is the share of file names that change owner on the
+hash ring when one of the receivers is removed; ideal is 1/receivers.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_shard.py --receivers 4 --files 64
+    python3 benchmarks/bench_shard.py --receivers 4 --slow 1 --kill-after 2
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle.config import SHARD_STRATEGIES  # noqa: E402
+from shuttle.shaping import TokenBucket  # noqa: E402
+from shuttle.shard import HashRing, ShardSender  # noqa: E402
+from shuttle.transfer import FileReceiver  # noqa: E402
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BLOCK = 1024 * 1024
+PROXY_SLICE = 64 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('IB').rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:-1] if unit else text) * UNITS[unit])
+
+
+def storage_root(storage):
+    if storage == 'tmpfs' and os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def make_corpus(directory, count, largest, seed):
+    """`count` files from 1/16 of `largest` up to `largest`; returns {path: sha256}."""
+    rng = random.Random(seed)
+    digests = {}
+    for i in range(count):
+        path = os.path.join(directory, f"part{i:05d}.bin")
+        size = largest >> rng.randrange(5)
+        data = os.urandom(size)
+        with open(path, 'wb') as f:
+            f.write(data)
+        digests[path] = hashlib.sha256(data).hexdigest()
+    return digests
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ThrottledProxy:
+    """Forwards TCP connections to `upstream`, capping the sender-to-receiver direction at `rate` bytes/s."""
+
+    def __init__(self, upstream, rate):
+        self.upstream = upstream
+        self.bucket = TokenBucket(rate)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024) # keep the sender close to the cap
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+        self._connections = []
+        self._lock = threading.Lock()
+        self._is_running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def kill(self):
+        """Drop every connection and refuse new ones, like a receiver that went away."""
+        self._is_running = False
+        self.listener.close()
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                conn.close()
+
+    def _accept(self):
+        while self._is_running:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            try:
+                server = socket.create_connection(self.upstream)
+            except OSError:
+                client.close()
+                continue
+            with self._lock:
+                self._connections += [client, server]
+            threading.Thread(target=self._pipe, args=(server, client, False), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(client, server, True), daemon=True).start()
+
+    def _pipe(self, source, sink, throttle):
+        try:
+            while True:
+                data = source.recv(PROXY_SLICE)
+                if not data:
+                    break
+                if throttle:
+                    delay = self.bucket.reserve(len(data))
+                    if delay > 0:
+                        time.sleep(delay)
+                sink.sendall(data)
+            sink.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def run_strategy(strategy, digests, work, args):
+    receivers = []
+    proxies = []
+    targets = []
+    for i in range(args.receivers):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(8)
+        port = listener.getsockname()[1]
+        receiver = FileReceiver('127.0.0.1', port, os.path.join(work, strategy, f"receiver-{i}"),
+                                listen_socket=listener, buffer_size=args.buffer)
+        threading.Thread(target=receiver.run, daemon=True).start()
+        proxy = ThrottledProxy(('127.0.0.1', port), args.slow_rate if i < args.slow else args.rate)
+        receivers.append(receiver)
+        proxies.append(proxy)
+        targets.append(('127.0.0.1', proxy.port))
+
+    manifest_path = os.path.join(work, f"{strategy}-manifest.json")
+    sender = ShardSender(targets, list(digests), strategy=strategy, manifest_path=manifest_path)
+    result = {}
+    sender.on('transfer_complete', lambda success, message: result.update(success=success, message=message))
+    killer = None
+    if args.kill_after:
+        killer = threading.Timer(args.kill_after, proxies[-1].kill)
+        killer.start()
+    start = time.perf_counter()
+    sender.run()
+    seconds = time.perf_counter() - start
+    if killer:
+        killer.cancel()
+    time.sleep(0.5) # let the receivers close their last files
+    for receiver in receivers:
+        receiver.stop()
+    for proxy in proxies:
+        proxy.kill()
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    directories = {f"127.0.0.1:{proxy.port}": os.path.join(work, strategy, f"receiver-{i}")
+                   for i, proxy in enumerate(proxies)}
+    ok = result.get('success', False)
+    for entry in manifest['files']:
+        path = os.path.join(directories.get(entry['target'] or '', ''), entry['name'])
+        ok = ok and entry['ok'] and os.path.isfile(path) and file_digest(path) == digests[entry['path']]
+    rates = [args.slow_rate if i < args.slow else args.rate for i in range(args.receivers)]
+    if args.kill_after:
+        rates = rates[:-1]
+    total = sum(entry['size'] for entry in manifest['files'])
+    return {
+        'strategy': strategy,
+        'ok': ok,
+        'message': result.get('message'),
+        'seconds': seconds,
+        'ideal_s': total / sum(rates) if sum(rates) else None,
+        'moved': sum(1 for entry in manifest['files'] if entry['target'] != entry['assigned']),
+        'targets': {label: {'files': target['files'], 'bytes': target['bytes'], 'failed': bool(target['failed'])}
+                    for label, target in manifest['targets'].items()}
+    }
+
+
+def ring_moved_share(receivers, names):
+    labels = [f"10.0.0.{i + 1}:65432" for i in range(receivers)]
+    before = HashRing(labels)
+    after = HashRing(labels[:-1])
+    moved = sum(1 for name in names if before.owners(name)[0] != after.owners(name)[0])
+    return moved / len(names) if names else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receivers', type=int, default=4)
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--largest', default='8M', help="largest file; the others are 1/2 to 1/16 of it")
+    parser.add_argument('--rate', default='40M', help="link rate of a receiver in bytes/s")
+    parser.add_argument('--slow', type=int, default=0, help="receivers on a slow link")
+    parser.add_argument('--slow-rate', default='5M', help="link rate of the slow receivers")
+    parser.add_argument('--kill-after', type=float, default=0, metavar='S',
+                        help="take the last receiver away after S seconds")
+    parser.add_argument('--strategies', default=','.join(SHARD_STRATEGIES))
+    parser.add_argument('--buffer', type=int, default=64 * 1024, help="receiver buffer size")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--storage', choices=('tmpfs', 'disk'), default='tmpfs')
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+    args.rate = parse_size(args.rate)
+    args.slow_rate = parse_size(args.slow_rate)
+
+    work = tempfile.mkdtemp(prefix='shuttle-shard-', dir=storage_root(args.storage))
+    try:
+        corpus = os.path.join(work, 'corpus')
+        os.makedirs(corpus)
+        digests = make_corpus(corpus, args.files, parse_size(args.largest), args.seed)
+        runs = [run_strategy(strategy, digests, work, args) for strategy in args.strategies.split(',')]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        'python': sys.version.split()[0],
+        'receivers': args.receivers,
+        'files': args.files,
+        'rate_bps': args.rate,
+        'slow': args.slow,
+        'slow_rate_bps': args.slow_rate,
+        'kill_after': args.kill_after,
+        'ring_moved_share': ring_moved_share(args.receivers, [f"part{i:05d}.bin" for i in range(10000)]),
+        'runs': runs
+    }
+    for run in runs:
+        print(f"{run['strategy']}: {run['seconds']:.2f} s (ideal {run['ideal_s'] or 0:.2f} s), "
+              f"{run['moved']} moved, ok={run['ok']}", file=sys.stderr)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0 if all(run['ok'] for run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Startup benchmark: time-to-listening and time-to-first-peer.
+
+Each run spawns a fresh interpreter, so import and bind costs are included.
+
+* time-to-listening: from spawn until a TCP connect to the receiver port succeeds,
+  for the headless receiver and (when PyQt5 is installed) the GUI launcher
+  running on the offscreen platform.
+* time-to-first-peer: from spawn until ``shuttle peers --first`` exits after
+  seeing a responder on loopback, with an empty ("cold") and a pre-filled
+  ("warm") peer cache.
+
+Run from the Linux directory:  python3 benchmarks/bench_startup.py --runs 10
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle.config import DEFAULT_PORT  # noqa: E402
+from shuttle.discovery import DiscoveryResponseServer  # noqa: E402
+
+
+def _env(home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['SHUTTLE_CONTROL_SOCKET'] = os.path.join(home, 'control.sock')
+    env['QT_QPA_PLATFORM'] = 'offscreen'
+    env.pop('SHUTTLE_SWEEP_CIDR', None)
+    return env
+
+
+def _summary(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return {'runs': 0}
+    return {
+        'runs': len(samples),
+        'min_ms': min(samples) * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'max_ms': max(samples) * 1000
+    }
+
+
+def _port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('127.0.0.1', port))
+            return True
+        except OSError:
+            return False
+
+
+def time_to_listening(command, port, env, timeout=30):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.05):
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.001)
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def time_to_first_peer(env, timeout=15):
+    command = [sys.executable, '-m', 'shuttle', 'peers', '--first', '--sweep', '127.0.0.1/32',
+               '--timeout', str(timeout)]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 and result.stdout.strip() else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=47990, help="receiver port for the headless runs")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'runs': args.runs, 'time_to_listening': {},
+              'time_to_first_peer': {}}
+
+    with tempfile.TemporaryDirectory() as home:
+        env = _env(home)
+        receive_dir = os.path.join(home, 'received')
+
+        headless = [sys.executable, '-m', 'shuttle', 'receive', '--no-discovery',
+                    '--port', str(args.port), '--dir', receive_dir]
+        report['time_to_listening']['headless'] = _summary(
+            [time_to_listening(headless, args.port, env) for _ in range(args.runs)])
+
+        gui_available = importlib.util.find_spec('PyQt5') is not None and _port_free(DEFAULT_PORT)
+        if gui_available:
+            gui = [sys.executable, os.path.join(ROOT, 'main.py')]
+            report['time_to_listening']['gui'] = _summary(
+                [time_to_listening(gui, DEFAULT_PORT, env) for _ in range(args.runs)])
+        else:
+            report['time_to_listening']['gui'] = {'skipped': "PyQt5 missing or port in use"}
+
+        responder = DiscoveryResponseServer(lambda: True)
+        threading.Thread(target=responder.run, daemon=True).start()
+        time.sleep(0.2)
+
+        cache = os.path.join(home, '.lan_file_shuttle', 'peers.json')
+        cold, warm = [], []
+        for _ in range(args.runs):
+            if os.path.exists(cache):
+                os.remove(cache)
+            cold.append(time_to_first_peer(env))
+            warm.append(time_to_first_peer(env)) # the cold run just filled the cache
+        responder.stop()
+        report['time_to_first_peer']['cold'] = _summary(cold)
+        report['time_to_first_peer']['warm'] = _summary(warm)
+
+    text = json.dumps(report, indent=1)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Swarm benchmark: one seed and several receivers exchanging chunks on loopback.
+
+Every virtual host is a SwarmNode with its own DeviceDiscovery (sweep mode)
+and DiscoveryResponseServer, on its own address in 127.78.0.0/24, as in
+bench_discovery.py. Uploads are capped per host (``--seed-upload``,
+``--upload``) to model a source with less bandwidth than the receivers have
+together. The report has:
+
+* seconds: until every receiver has every file
+* seed_only_s: what the seed's link alone would need to deliver every copy
+* speedup: seed_only_s / seconds
+* seed_upload_factor: chunks the seed uploaded per chunk of the swarm (1.0
+  means every chunk left the seed exactly once)
+* declined: requests the seed turned away because a receiver had the chunk
+* ok: every receiver's files match the originals (SHA-256)
+
+``--interval`` overrides DISCOVERY_INTERVAL to compress the discovery rounds.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_swarm.py --receivers 4 --size 64M
+    python3 benchmarks/bench_swarm.py --receivers 8 --seed-upload 10M --upload 40M
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle import discovery  # noqa: E402
+from shuttle.config import DISCOVERY_PORT, SWARM_PORT  # noqa: E402
+from shuttle.discovery import DeviceDiscovery, DiscoveryResponseServer, PeerRegistry  # noqa: E402
+from shuttle.swarm import SwarmNode, build_manifest  # noqa: E402
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BLOCK = 1024 * 1024
+SWARM_NETWORK = '127.78.0.0/24'
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('IB').rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:-1] if unit else text) * UNITS[unit])
+
+
+def storage_root(storage):
+    if storage == 'tmpfs' and os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def make_corpus(directory, size, count):
+    """Write `count` files of `size` random bytes; returns {name: sha256}."""
+    digests = {}
+    for i in range(count):
+        name = f"file{i:04d}.bin"
+        digest = hashlib.sha256()
+        with open(os.path.join(directory, name), 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                block = os.urandom(min(remaining, BLOCK))
+                f.write(block)
+                digest.update(block)
+                remaining -= len(block)
+        digests[name] = digest.hexdigest()
+    return digests
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VirtualHost:
+    """A SwarmNode plus the discovery pair that advertises it, on one loopback address."""
+
+    def __init__(self, ip, node_args):
+        self.ip = ip
+        self.registry = PeerRegistry()
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((ip, SWARM_PORT))
+        listener.listen(32)
+        self.node = SwarmNode(self.registry, host=ip, port=SWARM_PORT, listen_socket=listener, **node_args)
+
+        response_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        response_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        response_sock.bind((ip, DISCOVERY_PORT))
+        discovery_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        discovery_sock.bind((ip, 0))
+        self.discovery = DeviceDiscovery(mode='sweep', sweep_cidr=SWARM_NETWORK, registry=self.registry,
+                                         sock=discovery_sock)
+        self.responder = DiscoveryResponseServer(lambda: False, registry=self.registry, sock=response_sock,
+                                                 swarm_callback=self.node.advertisement)
+        self.result = None
+        self.node.on('transfer_complete', lambda success, message: setattr(self, 'result', (success, message)))
+        self._threads = []
+
+    def start(self):
+        for worker in (self.responder, self.discovery, self.node):
+            thread = threading.Thread(target=worker.run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for worker in (self.node, self.discovery, self.responder):
+            worker.stop()
+        for thread in self._threads:
+            thread.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receivers', type=int, default=4)
+    parser.add_argument('--size', default='64M', help="bytes per file")
+    parser.add_argument('--count', type=int, default=1, help="files in the swarm")
+    parser.add_argument('--seed-upload', default='20M', help="the seed's upload cap in bytes/s")
+    parser.add_argument('--upload', default='20M', help="each receiver's upload cap in bytes/s, 0 = none")
+    parser.add_argument('--interval', type=float, default=1.0, help="discovery round, seconds")
+    parser.add_argument('--storage', choices=('tmpfs', 'disk'), default='tmpfs')
+    parser.add_argument('--timeout', type=float, default=600, help="seconds until the run is given up")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    discovery.DISCOVERY_INTERVAL = args.interval # read on every round of DeviceDiscovery.run
+    size = parse_size(args.size)
+    seed_rate = parse_size(args.seed_upload)
+    upload_rate = parse_size(args.upload)
+    work = tempfile.mkdtemp(prefix='shuttle-swarm-', dir=storage_root(args.storage))
+    hosts = []
+    try:
+        corpus_dir = os.path.join(work, 'corpus')
+        os.makedirs(corpus_dir)
+        digests = make_corpus(corpus_dir, size, args.count)
+        manifest = build_manifest([os.path.join(corpus_dir, name) for name in digests])
+
+        seed = VirtualHost('127.78.0.1', {'manifest': manifest, 'upload_rate': seed_rate,
+                                          'paths': [os.path.join(corpus_dir, name) for name in digests]})
+        hosts.append(seed)
+        for i in range(args.receivers):
+            hosts.append(VirtualHost(f"127.78.0.{i + 2}", {'swarm_id': manifest['id'], 'linger': args.timeout,
+                                                            'save_dir': os.path.join(work, f"received-{i}"),
+                                                            'upload_rate': upload_rate}))
+        start = time.perf_counter()
+        for host in hosts:
+            host.start()
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and not all(host.result for host in hosts[1:]):
+            time.sleep(0.05)
+        seconds = time.perf_counter() - start
+
+        ok = all(host.result and host.result[0] for host in hosts[1:]) and all(
+            file_digest(os.path.join(work, f"received-{i}", name)) == digest
+            for i in range(args.receivers) for name, digest in digests.items())
+        chunks = len(manifest['hashes'])
+        total = size * args.count
+        seed_only = args.receivers * total / seed_rate if seed_rate else None
+        report = {
+            'python': sys.version.split()[0],
+            'receivers': args.receivers,
+            'bytes': total,
+            'chunks': chunks,
+            'seed_upload_bps': seed_rate,
+            'upload_bps': upload_rate,
+            'ok': ok,
+            'seconds': seconds,
+            'seed_only_s': seed_only,
+            'speedup': seed_only / seconds if seed_only else None,
+            'mb_per_s_per_receiver': total / seconds / BLOCK,
+            'seed_upload_factor': seed.node.stats['uploaded'] / chunks if chunks else None,
+            'declined': seed.node.stats['declined'],
+            'receiver_stats': [host.node.stats for host in hosts[1:]]
+        }
+    finally:
+        for host in hosts:
+            host.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(f"{args.receivers} receivers: {report['seconds']:.1f} s, seed alone {report['seed_only_s'] or 0:.1f} s, "
+          f"seed uploaded each chunk {report['seed_upload_factor'] or 0:.2f} times", file=sys.stderr)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
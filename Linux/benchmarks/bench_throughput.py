@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Throughput benchmark: FileSender against FileReceiver over loopback.
+
+Sweeps file size, file count, buffer size and transfer mode. Every case runs
+in a fresh interpreter so its peak RSS is its own, and reports:
+
+* mb_per_s: payload MiB/s, from the first connect until the receiver has
+  written the last file
+* files_per_s
+* cpu_s_per_gib: user + system CPU of sender and receiver together
+* peak_rss_mb
+
+The synthetic corpus is generated per case (tmpfs at /dev/shm by default,
+``--storage disk`` for the temp dir) and is not part of the timing. Cases
+larger than ``--max-total`` or the free space are reported as skipped.
+
+Run from the Linux directory:
+    python3 benchmarks/bench_throughput.py --sizes 1K,1M,100M --counts 1,100
+    python3 benchmarks/bench_throughput.py --save-baseline base.json
+    python3 benchmarks/bench_throughput.py --baseline base.json --tolerance 0.1
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from shuttle.config import TRANSFER_MODES  # noqa: E402
+from shuttle.transfer import FileReceiver, FileSender  # noqa: E402
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BLOCK = 1024 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('IB').rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:-1] if unit else text) * UNITS[unit])
+
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return str(size)
+
+
+def case_key(case):
+    return f"{case['mode']}/{format_size(case['size'])}x{case['count']}/buf{format_size(case['buffer'])}"
+
+
+def storage_root(storage):
+    if storage == 'tmpfs' and os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def make_corpus(directory, size, count):
+    """Write `count` files of `size` bytes, repeating one random block."""
+    block = os.urandom(min(size, BLOCK))
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"file{i:06d}.bin")
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                written = f.write(block[:remaining])
+                remaining -= written
+        paths.append(path)
+    return paths
+
+
+def run_case(case):
+    """Runs one case in this process and returns its result dict."""
+    work = tempfile.mkdtemp(prefix='shuttle-bench-', dir=storage_root(case['storage']))
+    try:
+        corpus_dir = os.path.join(work, 'corpus')
+        save_dir = os.path.join(work, 'received')
+        os.makedirs(corpus_dir)
+        paths = make_corpus(corpus_dir, case['size'], case['count'])
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(64)
+        port = listener.getsockname()[1]
+
+        receiver = FileReceiver('127.0.0.1', port, save_dir, listen_socket=listener,
+                                buffer_size=case['buffer'])
+        finished = threading.Semaphore(0)
+        failures = []
+
+        def on_received(success, message):
+            if not success:
+                failures.append(message)
+            finished.release()
+
+        receiver.on('transfer_complete', on_received)
+        receiver_thread = threading.Thread(target=receiver.run, daemon=True)
+        receiver_thread.start()
+
+        sender = FileSender('127.0.0.1', port, paths, buffer_size=case['buffer'], mode=case['mode'])
+        sent = []
+        sender.on('transfer_complete', lambda success, message: sent.append((success, message)))
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        sender.run()
+        received = 0
+        if sent and sent[0][0]:
+            for _ in paths:
+                if not finished.acquire(timeout=60):
+                    break
+                received += 1
+        elapsed = time.perf_counter() - start
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+        receiver.stop()
+        receiver_thread.join(5)
+
+        if not sent or not sent[0][0]:
+            return {'error': sent[0][1] if sent else "Sender did not finish."}
+        if failures or received != len(paths):
+            return {'error': failures[0] if failures else f"Only {received}/{len(paths)} files received."}
+        for path in paths:
+            if os.path.getsize(os.path.join(save_dir, os.path.basename(path))) != case['size']:
+                return {'error': f"Size mismatch for {os.path.basename(path)}"}
+
+        total = case['size'] * case['count']
+        cpu = ((usage_after.ru_utime - usage_before.ru_utime) +
+               (usage_after.ru_stime - usage_before.ru_stime))
+        return {
+            'seconds': elapsed,
+            'bytes': total,
+            'mb_per_s': total / elapsed / BLOCK if elapsed > 0 else None,
+            'files_per_s': case['count'] / elapsed if elapsed > 0 else None,
+            'cpu_s': cpu,
+            'cpu_s_per_gib': cpu / (total / UNITS['G']) if total else None,
+            'peak_rss_mb': usage_after.ru_maxrss / 1024 # ru_maxrss is KiB on Linux
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def spawn_case(case, timeout):
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)]
+    try:
+        result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'error': f"Timed out after {timeout}s"}
+    if result.returncode != 0:
+        return {'error': (result.stderr.strip().splitlines() or ["Case failed."])[-1]}
+    return json.loads(result.stdout)
+
+
+def compare(results, baseline, tolerance):
+    """Per-case throughput ratios against a previous report; ratio < 1 - tolerance is a regression."""
+    previous = {r['key']: r for r in baseline.get('results', []) if r.get('mb_per_s')}
+    comparison = []
+    for r in results:
+        old = previous.get(r['key'])
+        if not old or not r.get('mb_per_s'):
+            continue
+        ratio = r['mb_per_s'] / old['mb_per_s']
+        comparison.append({
+            'key': r['key'],
+            'baseline_mb_per_s': old['mb_per_s'],
+            'mb_per_s': r['mb_per_s'],
+            'ratio': ratio,
+            'regression': ratio < 1 - tolerance
+        })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1K,64K,1M,100M,1G,10G', help="comma separated, e.g. 1K,1M,10G")
+    parser.add_argument('--counts', default='1,100,1000')
+    parser.add_argument('--buffers', default='4K,64K,1M')
+    parser.add_argument('--modes', default=','.join(TRANSFER_MODES))
+    parser.add_argument('--storage', choices=('tmpfs', 'disk'), default='tmpfs')
+    parser.add_argument('--max-total', default='1G', help="skip cases moving more than this per run")
+    parser.add_argument('--timeout', type=int, default=600, help="per case, in seconds")
+    parser.add_argument('--baseline', help="report to compare against; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--save-baseline', help="also write this report as the new baseline")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    max_total = parse_size(args.max_total)
+    root = storage_root(args.storage)
+    cases = [
+        {'mode': mode, 'size': parse_size(size), 'count': int(count), 'buffer': parse_size(buffer),
+         'storage': args.storage}
+        for mode, size, count, buffer in itertools.product(
+            args.modes.split(','), args.sizes.split(','), args.counts.split(','), args.buffers.split(','))
+    ]
+
+    results = []
+    for case in cases:
+        entry = dict(case, key=case_key(case))
+        total = case['size'] * case['count']
+        if total > max_total:
+            entry['skipped'] = f"{format_size(total)} exceeds --max-total"
+        elif 2 * total > shutil.disk_usage(root).free:
+            entry['skipped'] = f"not enough free space in {root}"
+        else:
+            entry.update(spawn_case(case, args.timeout))
+        print(f"{entry['key']}: " + (f"{entry['mb_per_s']:.1f} MB/s" if entry.get('mb_per_s')
+                                     else entry.get('skipped') or entry.get('error')), file=sys.stderr)
+        results.append(entry)
+
+    report = {'python': sys.version.split()[0], 'storage': root, 'results': results}
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(results, json.load(f), args.tolerance)
+        if any(c['regression'] for c in report['comparison']):
+            status = 1
+
+    text = json.dumps(report, indent=1)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
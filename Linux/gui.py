@@ -0,0 +1,997 @@
+"""Qt front end. Imported by main.py only after the listening sockets are bound."""
+
+import os
+import time
+import logging
+import threading
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
+                             QPushButton, QLineEdit, QLabel, QFileDialog,
+                             QProgressBar, QPlainTextEdit, QMessageBox, QGroupBox,
+                             QListWidget, QListView, QShortcut, QComboBox)
+from PyQt5.QtCore import (QObject, pyqtSignal, pyqtSlot, QThread, Qt, QTimer,
+                          QAbstractListModel, QModelIndex)
+from PyQt5.QtGui import QIntValidator, QKeySequence
+
+from shuttle.config import (DEFAULT_PORT, RECEIVE_DIR, AUTO_TARGET, PROFILE_DURATION, METRICS_FILE,
+                            JOB_PRIORITIES)
+from shuttle.control import ControlClient, ControlError
+from shuttle.discovery import (DeviceDiscovery, DiscoveryResponseServer, LinkMonitor,
+                               PeerCache, PeerRegistry, select_auto_target)
+from shuttle.logbuffer import LogBuffer
+from shuttle.metrics import MetricsFileWriter
+from shuttle.profiling import capture as capture_profile, install_signal_handler
+from shuttle.rate import format_eta, format_rate, sparkline
+from shuttle.scheduler import JOB_EVENTS, SendQueue
+from shuttle.shaping import Shaper
+from shuttle.net import get_local_ip, get_hostname
+from shuttle.tracing import TRACE
+from shuttle.transfer import FileReceiver, probe_capacity
+from shuttle.watchdog import EventLoopWatchdog
+
+LOG_RENDER_INTERVAL = 250 # ms between log panel repaints
+
+class QtWorker(QObject):
+    """Runs a core worker on a QThread and re-emits its events as Qt signals.
+
+    Subclasses declare one pyqtSignal per core event, with the same name.
+    Each forwarded event is a trace instant, so signal floods show up on the
+    worker's row of the timeline.
+    """
+    EVENTS = ()
+
+    def __init__(self, core):
+        super().__init__()
+        self.core = core
+        for event in self.EVENTS:
+            core.on(event, self._forward(event, getattr(self, event)))
+
+    @staticmethod
+    def _forward(event, signal):
+        def forward(*args):
+            TRACE.instant(event, 'signal')
+            signal.emit(*args)
+        return forward
+
+    def signals(self):
+        return [getattr(self, event) for event in self.EVENTS]
+
+    def run(self):
+        threading.current_thread().name = type(self).__name__ # label the QThread in traces
+        self.core.run()
+
+    def stop(self):
+        self.core.stop()
+
+class SendQueueWorker(QtWorker):
+    EVENTS = JOB_EVENTS
+    job_queued = pyqtSignal(dict)
+    job_started = pyqtSignal(dict)
+    job_status = pyqtSignal(dict)
+    job_progress = pyqtSignal(dict)
+    job_rate = pyqtSignal(dict)
+    job_finished = pyqtSignal(dict)
+
+class ReceiverWorker(QtWorker):
+    EVENTS = ('progress_updated', 'status_message', 'transfer_complete', 'server_started', 'speed_updated',
+              'rate_updated')
+    progress_updated = pyqtSignal(int)
+    status_message = pyqtSignal(str)
+    transfer_complete = pyqtSignal(bool, str)
+    server_started = pyqtSignal(bool, str)
+    speed_updated = pyqtSignal(str)
+    rate_updated = pyqtSignal(dict)
+
+class DiscoveryWorker(QtWorker):
+    EVENTS = ('device_found', 'link_updated', 'status_update')
+    device_found = pyqtSignal(str, str, bool, dict)
+    link_updated = pyqtSignal(str, dict)
+    status_update = pyqtSignal(str)
+
+class ResponseServerWorker(QtWorker):
+    EVENTS = ('device_discovered', 'status_update')
+    device_discovered = pyqtSignal(str, str, bool, dict)
+    status_update = pyqtSignal(str)
+
+class DaemonEventsWorker(QObject):
+    """Streams events from the resident daemon into the GUI thread."""
+    event_received = pyqtSignal(dict)
+    disconnected = pyqtSignal()
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def run(self):
+        try:
+            for event in self.client.events():
+                self.event_received.emit(event)
+        except OSError:
+            pass
+        self.disconnected.emit()
+
+    def stop(self):
+        self.client.shutdown()
+
+class DaemonPeersWorker(QObject):
+    """Copies the daemon's peers into the registry over a connection of its own."""
+    finished = pyqtSignal(bool)
+
+    def __init__(self, socket_path, registry):
+        super().__init__()
+        self.socket_path = socket_path
+        self.registry = registry
+
+    def run(self):
+        try:
+            with ControlClient(self.socket_path) as client:
+                peers = client.request('peers')['peers']
+        except (ControlError, OSError, ValueError):
+            self.finished.emit(False)
+            return
+        for peer in peers:
+            self.registry.update(peer['ip'], peer['hostname'], peer['is_receiving'], peer)
+        self.finished.emit(True)
+
+class CapacityProbeWorker(QObject):
+    probe_finished = pyqtSignal(str, bool, str)
+
+    def __init__(self, host, port, link_monitor):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.link_monitor = link_monitor
+
+    def run(self):
+        try:
+            bytes_per_second = probe_capacity(self.host, self.port)
+            self.link_monitor.add_capacity(self.host, bytes_per_second)
+            self.probe_finished.emit(self.host, True, f"{bytes_per_second / (1024*1024):.1f} MB/s")
+        except Exception as e:
+            self.probe_finished.emit(self.host, False, str(e))
+
+class EventLoopMonitor(QObject):
+    """Feeds an EventLoopWatchdog from the GUI thread.
+
+    A precise QTimer delivers the heartbeats; every tracked signal is counted
+    once on the emitting thread (direct connection) and once when the event
+    loop gets round to dispatching it (queued to this object).
+    """
+
+    def __init__(self, watchdog, parent=None):
+        super().__init__(parent)
+        self.watchdog = watchdog
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(watchdog.beat)
+
+    def start(self):
+        self.watchdog.start()
+        self.timer.start(int(self.watchdog.interval * 1000))
+
+    def stop(self):
+        self.timer.stop()
+        self.watchdog.stop()
+
+    def track(self, *signals):
+        for signal in signals:
+            signal.connect(self.watchdog.signal_queued, Qt.DirectConnection)
+            signal.connect(self._delivered)
+
+    @pyqtSlot()
+    def _delivered(self):
+        self.watchdog.signal_delivered()
+
+class DeviceListModel(QAbstractListModel):
+    """Device list fed by PeerRegistry diffs so only changed rows are repainted.
+
+    Registry listeners fire on discovery threads; re-emitting them as signals
+    of this GUI-thread object queues them onto the event loop.
+    """
+    peer_added = pyqtSignal(dict)
+    peer_updated = pyqtSignal(dict)
+    peer_removed = pyqtSignal(dict)
+
+    def __init__(self, registry, link_monitor, parent=None):
+        super().__init__(parent)
+        self.link_monitor = link_monitor
+        self._rows = []
+        self._row_of = {} # ip -> row
+        self.peer_added.connect(self._on_added)
+        self.peer_updated.connect(self._on_updated)
+        self.peer_removed.connect(self._on_removed)
+        registry.subscribe(self.peer_added.emit, self.peer_updated.emit, self.peer_removed.emit)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        device_info = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return self._device_text(device_info)
+        if role == Qt.UserRole:
+            return device_info
+        return None
+
+    def _device_text(self, device_info):
+        status_icon = "🟢" if device_info['is_receiving'] else "🔴"
+        item_text = f"{status_icon} {device_info['hostname']} ({device_info['ip']})"
+        if device_info['is_receiving']:
+            item_text += " [Ready to Receive]"
+
+        link = self.link_monitor.get(device_info['ip'])
+        if link and link['rtt_ms'] is not None:
+            item_text += f" · {link['rtt_ms']:.1f} ms"
+        if link and link['capacity_mbps'] is not None:
+            item_text += f" · {link['capacity_mbps']:.1f} MB/s"
+        return item_text
+
+    def _on_added(self, device_info):
+        if device_info['ip'] in self._row_of:
+            self._on_updated(device_info)
+            return
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.append(device_info)
+        self._row_of[device_info['ip']] = row
+        self.endInsertRows()
+
+    def _on_updated(self, device_info):
+        row = self._row_of.get(device_info['ip'])
+        if row is None:
+            self._on_added(device_info)
+            return
+        self._rows[row] = device_info
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def _on_removed(self, device_info):
+        row = self._row_of.pop(device_info['ip'], None)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._rows[row]
+        for later in self._rows[row:]:
+            self._row_of[later['ip']] -= 1
+        self.endRemoveRows()
+
+    def refresh_link(self, ip, link=None):
+        row = self._row_of.get(ip)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self._rows = []
+        self._row_of = {}
+        self.endResetModel()
+
+class LogView(QPlainTextEdit):
+    """Log panel that pulls new LogBuffer entries on a timer and appends them in one batch."""
+
+    def __init__(self, log_buffer, parent=None):
+        super().__init__(parent)
+        self.log_buffer = log_buffer
+        self._rendered_seq = 0
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(log_buffer.capacity)
+        self.render_timer = QTimer(self)
+        self.render_timer.timeout.connect(self.render_pending)
+        self.render_timer.start(LOG_RENDER_INTERVAL)
+
+    def render_pending(self):
+        entries = self.log_buffer.since(self._rendered_seq)
+        if not entries:
+            return
+        self._rendered_seq = entries[-1][0]
+        trace_start = time.perf_counter()
+
+        lines = []
+        for _, created, level, message in entries:
+            timestamp = time.strftime("%H:%M:%S", time.localtime(created))
+            if level >= logging.WARNING:
+                lines.append(f"[{timestamp}] {logging.getLevelName(level)}: {message}")
+            else:
+                lines.append(f"[{timestamp}] {message}")
+
+        scrollbar = self.verticalScrollBar()
+        follow = scrollbar.value() == scrollbar.maximum()
+        self.appendPlainText("\n".join(lines))
+        if follow:
+            scrollbar.setValue(scrollbar.maximum())
+        TRACE.complete('log_render', 'gui', trace_start, args={'entries': len(entries)})
+
+    def clear_log(self):
+        self.log_buffer.clear()
+        self.clear()
+
+class FileTransferApp(QWidget):
+    def __init__(self, listeners=None):
+        super().__init__()
+        self.listeners = dict(listeners or {})
+        self.log_buffer = LogBuffer()
+        self.loop_monitor = EventLoopMonitor(EventLoopWatchdog(
+            on_stall=lambda message: self.log_buffer.log(f"🐢 {message}", logging.WARNING)), self)
+        self.loop_monitor.start()
+        self.metrics_writer = MetricsFileWriter(METRICS_FILE).start() if METRICS_FILE else None
+        self.link_monitor = LinkMonitor()
+        self.peer_registry = PeerRegistry()
+        self.device_model = DeviceListModel(self.peer_registry, self.link_monitor)
+        self.init_ui()
+        
+        self.send_queue_thread = None
+        self.receiver_thread = None
+        self.send_shaper = Shaper()
+        self.send_queue_worker = None
+        self.receiver_worker = None
+        self.file_queue = []
+        self.is_receiving = False
+        self.receiver_port = DEFAULT_PORT
+        
+        self.peer_cache = PeerCache()
+        self.probe_thread = None
+        self.probe_worker = None
+        self.discovery_thread = None
+        self.discovery_worker = None
+        self.response_server_thread = None
+        self.response_server_worker = None
+        self.daemon_client = None
+        self.daemon_events_thread = None
+        self.daemon_events_worker = None
+        self.daemon_peers_thread = None
+        self.daemon_peers_worker = None
+        self.daemon_peers_again = False # a refresh came in while a copy was running
+        self.send_job_ids = set() # jobs queued from this window, locally or on the daemon
+        self.send_job_id = None # the newest one; the progress bar follows it
+        
+        os.makedirs(RECEIVE_DIR, exist_ok=True)
+        self.receiver_save_path_input.setText(os.path.abspath(RECEIVE_DIR))
+        
+        if self.listeners or not self.attach_to_daemon():
+            QTimer.singleShot(0, self.start_discovery_system)
+            QTimer.singleShot(0, self.start_receiving) # Automatically start the receiver server
+        
+        self.ui_update_timer = QTimer()
+        self.ui_update_timer.timeout.connect(self.expire_devices)
+        self.ui_update_timer.start(1000)
+
+        # Hidden developer shortcut: start tracing, press again to stop and dump
+        self.trace_shortcut = QShortcut(QKeySequence("Ctrl+Shift+T"), self)
+        self.trace_shortcut.activated.connect(self.toggle_trace)
+        # ...and Ctrl+Shift+P (or SIGUSR1) captures a profile of every thread
+        self.profile_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), self)
+        self.profile_shortcut.activated.connect(self.start_profile)
+        install_signal_handler(on_started=self.on_profile_started)
+
+    def attach_to_daemon(self):
+        """Use a running daemon's listeners and queue instead of starting our own."""
+        try:
+            self.daemon_client = ControlClient(timeout=0.5)
+            status = self.daemon_client.request('status')
+            events_client = ControlClient()
+            events_client.subscribe()
+        except (ControlError, OSError, ValueError):
+            if self.daemon_client:
+                self.daemon_client.close()
+            self.daemon_client = None
+            return False
+
+        receiver = status['receiver']
+        self.is_receiving = True
+        self.receiver_port = receiver['port']
+        self.receiver_save_path_input.setText(receiver['save_dir'])
+        self.receiver_port_input.setText(str(receiver['port']))
+        self.browse_save_dir_button.setEnabled(False)
+
+        self.daemon_events_thread = QThread()
+        self.daemon_events_worker = DaemonEventsWorker(events_client)
+        self.daemon_events_worker.moveToThread(self.daemon_events_thread)
+        self.loop_monitor.track(self.daemon_events_worker.event_received, self.daemon_events_worker.disconnected)
+        self.daemon_events_worker.event_received.connect(self.on_daemon_event)
+        self.daemon_events_worker.disconnected.connect(self.on_daemon_disconnected)
+        self.daemon_events_thread.started.connect(self.daemon_events_worker.run)
+        self.daemon_events_thread.start()
+
+        self.sync_daemon_peers()
+        self.log_status(f"🔗 Attached to daemon {status['pid']} - transfers continue after this window closes")
+        return True
+
+    def sync_daemon_peers(self):
+        """Copy the daemon's peers on attach and refresh; its peer events keep the list current in between."""
+        if self.daemon_peers_thread:
+            self.daemon_peers_again = True
+            return
+
+        self.daemon_peers_thread = QThread()
+        self.daemon_peers_worker = DaemonPeersWorker(self.daemon_client.socket_path, self.peer_registry)
+        self.daemon_peers_worker.moveToThread(self.daemon_peers_thread)
+        self.loop_monitor.track(self.daemon_peers_worker.finished)
+        self.daemon_peers_worker.finished.connect(self.on_daemon_peers_synced)
+        self.daemon_peers_thread.started.connect(self.daemon_peers_worker.run)
+        self.daemon_peers_thread.start()
+
+    def on_daemon_peers_synced(self, success):
+        if not success:
+            self.log_status("⚠️ Could not fetch the daemon's peers", logging.WARNING)
+        if self.daemon_peers_thread:
+            self.daemon_peers_thread.quit()
+            self.daemon_peers_thread.wait(3000)
+            self.daemon_peers_thread = None
+            self.daemon_peers_worker = None
+        if self.daemon_peers_again and self.daemon_client:
+            self.daemon_peers_again = False
+            self.sync_daemon_peers()
+
+    def on_daemon_event(self, event):
+        kind = event.get('event')
+        if kind in ('peer_added', 'peer_updated'):
+            peer = event['peer']
+            self.peer_registry.update(peer['ip'], peer['hostname'], peer['is_receiving'], peer)
+        elif kind == 'peer_removed':
+            self.peer_registry.remove(event['peer']['ip'])
+        elif kind == 'receiver_status_message':
+            self.log_status(f"📥 {event['args'][0]}")
+        elif kind == 'receiver_progress_updated':
+            self.receiver_progress_bar.setValue(event['args'][0])
+        elif kind == 'receiver_rate_updated':
+            self.show_rate(self.receiver_speed_label, event['args'][0])
+        elif kind == 'receiver_transfer_complete':
+            self.on_receiver_complete(*event['args'])
+        elif kind in JOB_EVENTS:
+            self.on_job_event(event)
+
+    def on_job_event(self, event):
+        """Events of the send queue, the local one or the daemon's."""
+        kind = event['event']
+        job_id = event['job']['id'] if isinstance(event['job'], dict) else event['job']
+        if job_id not in self.send_job_ids:
+            return # another client's job on the daemon
+        if kind == 'job_status':
+            self.log_status(f"📤 [job {job_id}] {event['message']}")
+        elif kind == 'job_progress' and job_id == self.send_job_id:
+            self.sender_progress_bar.setValue(event['progress'])
+        elif kind == 'job_rate' and job_id == self.send_job_id:
+            self.show_rate(self.sender_speed_label, event['rate'])
+        elif kind == 'job_finished':
+            self.send_job_ids.discard(job_id)
+            job = event['job']
+            if job_id == self.send_job_id:
+                self.send_job_id = None
+                self.on_sender_complete(job['state'] == 'done', job['message'])
+            else:
+                self.log_status(f"📤 [job {job_id}] {job['state']}: {job['message']}",
+                                logging.INFO if job['state'] == 'done' else logging.ERROR)
+
+    def on_daemon_disconnected(self):
+        if not self.daemon_client:
+            return # detached on purpose
+        self.log_status("⚠️ Lost connection to the daemon - starting local receiver and discovery", logging.WARNING)
+        self.daemon_client.close()
+        self.daemon_client = None
+        self.daemon_events_thread.quit()
+        self.browse_save_dir_button.setEnabled(True)
+        if self.send_job_ids:
+            self.send_job_ids.clear()
+            self.send_job_id = None
+            self.on_sender_complete(False, "The daemon stopped before the queued transfers finished.")
+        self.start_discovery_system()
+        self.start_receiving()
+
+    def start_discovery_system(self):
+        self.discovery_thread = QThread()
+        self.discovery_worker = DiscoveryWorker(DeviceDiscovery(peer_cache=self.peer_cache,
+                                                                link_monitor=self.link_monitor,
+                                                                registry=self.peer_registry))
+        self.discovery_worker.moveToThread(self.discovery_thread)
+        self.loop_monitor.track(*self.discovery_worker.signals())
+        
+        self.discovery_worker.link_updated.connect(self.device_model.refresh_link)
+        self.discovery_worker.status_update.connect(lambda msg: self.log_status(f"Discovery: {msg}"))
+        
+        self.discovery_thread.started.connect(self.discovery_worker.run)
+        self.discovery_thread.start()
+        
+        self.response_server_thread = QThread()
+        self.response_server_worker = ResponseServerWorker(DiscoveryResponseServer(lambda: self.is_receiving,
+                                                                                   lambda: self.receiver_port,
+                                                                                   self.receiver_load,
+                                                                                   registry=self.peer_registry,
+                                                                                   sock=self.listeners.pop('udp', None)))
+        self.response_server_worker.moveToThread(self.response_server_thread)
+        self.loop_monitor.track(*self.response_server_worker.signals())
+        
+        self.response_server_worker.status_update.connect(lambda msg: self.log_status(f"Response Server: {msg}"))
+        
+        self.response_server_thread.started.connect(self.response_server_worker.run)
+        self.response_server_thread.start()
+        
+        self.log_status("Discovery system started - continuously searching for devices...")
+
+    def init_ui(self):
+        self.setWindowTitle('Tiwut LAN File Shuttle Pro 🚀')
+        self.setGeometry(100, 100, 900, 750)
+        
+        main_layout = QVBoxLayout()
+        
+        info_label = QLabel(f"Local IP: {get_local_ip()} | Hostname: {get_hostname()}")
+        info_label.setStyleSheet("font-weight: bold; color: #2196F3; padding: 5px;")
+        main_layout.addWidget(info_label)
+        
+        sender_group = QGroupBox("📤 Send File(s)")
+        sender_layout = QVBoxLayout()
+
+        network_layout = QVBoxLayout()
+        network_label = QLabel("🌐 Available Devices on Network:")
+        self.device_list_view = QListView()
+        self.device_list_view.setModel(self.device_model)
+        self.device_list_view.setUniformItemSizes(True)
+        self.device_list_view.setMaximumHeight(120)
+        self.device_list_view.clicked.connect(self.select_device_from_list)
+        self.refresh_devices_button = QPushButton("🔄 Refresh Devices")
+        self.refresh_devices_button.clicked.connect(self.refresh_devices)
+        self.measure_link_button = QPushButton("📶 Measure Link")
+        self.measure_link_button.clicked.connect(self.measure_selected_link)
+        
+        device_actions_layout = QVBoxLayout()
+        device_actions_layout.addWidget(self.refresh_devices_button)
+        device_actions_layout.addWidget(self.measure_link_button)
+        
+        device_button_layout = QHBoxLayout()
+        device_button_layout.addWidget(self.device_list_view)
+        device_button_layout.addLayout(device_actions_layout)
+        
+        network_layout.addWidget(network_label)
+        network_layout.addLayout(device_button_layout)
+        sender_layout.addLayout(network_layout)
+        
+        file_select_layout = QVBoxLayout()
+        file_select_label = QLabel("📁 Files to Send:")
+        self.file_list_widget = QListWidget()
+        self.file_list_widget.setMaximumHeight(100)
+        
+        file_buttons_layout = QHBoxLayout()
+        self.browse_file_button = QPushButton("📄 Select File(s)...")
+        self.browse_file_button.clicked.connect(self.browse_files)
+        self.clear_files_button = QPushButton("🗑️ Clear List")
+        self.clear_files_button.clicked.connect(self.clear_files)
+        file_buttons_layout.addWidget(self.browse_file_button)
+        file_buttons_layout.addWidget(self.clear_files_button)
+        
+        file_select_layout.addWidget(file_select_label)
+        file_select_layout.addWidget(self.file_list_widget)
+        file_select_layout.addLayout(file_buttons_layout)
+        sender_layout.addLayout(file_select_layout)
+        
+        recipient_layout = QHBoxLayout()
+        recipient_layout.addWidget(QLabel("🎯 Target IP:"))
+        self.recipient_ip_input = QLineEdit("192.168.1.100")
+        recipient_layout.addWidget(self.recipient_ip_input)
+        recipient_layout.addWidget(QLabel("Port:"))
+        self.sender_port_input = QLineEdit(str(DEFAULT_PORT))
+        self.sender_port_input.setValidator(QIntValidator(1024, 65535))
+        recipient_layout.addWidget(self.sender_port_input)
+        sender_layout.addLayout(recipient_layout)
+        
+        self.sender_progress_bar = QProgressBar()
+        self.sender_speed_label = QLabel("Speed: 0.00 MB/s")
+        
+        self.send_button = QPushButton("🚀 Start Transfer")
+        self.send_button.clicked.connect(self.start_sending)
+        self.send_button.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold; padding: 8px;")
+        self.priority_input = QComboBox()
+        self.priority_input.addItems(JOB_PRIORITIES)
+        self.priority_input.setCurrentText('normal')
+        self.priority_input.setToolTip("Queued transfers run by priority, then smallest first")
+        self.limit_input = QLineEdit("0")
+        self.limit_input.setValidator(QIntValidator(0, 1000000))
+        self.limit_input.setMaximumWidth(70)
+        self.limit_input.setToolTip("Bandwidth cap for all sends in MB/s, 0 for none; running transfers follow it at once")
+        self.limit_input.editingFinished.connect(self.apply_send_limit)
+        
+        send_button_layout = QHBoxLayout()
+        send_button_layout.addWidget(QLabel("Priority:"))
+        send_button_layout.addWidget(self.priority_input)
+        send_button_layout.addWidget(QLabel("Limit MB/s:"))
+        send_button_layout.addWidget(self.limit_input)
+        send_button_layout.addWidget(self.send_button, 1)
+        
+        sender_layout.addWidget(self.sender_progress_bar)
+        sender_layout.addWidget(self.sender_speed_label)
+        sender_layout.addLayout(send_button_layout)
+
+        sender_group.setLayout(sender_layout)
+        main_layout.addWidget(sender_group)
+
+        receiver_group = QGroupBox("📥 Receive File")
+        receiver_layout = QVBoxLayout()
+        
+        save_dir_layout = QHBoxLayout()
+        save_dir_layout.addWidget(QLabel("💾 Save Location:"))
+        self.receiver_save_path_input = QLineEdit()
+        self.receiver_save_path_input.setReadOnly(True)
+        self.browse_save_dir_button = QPushButton("📂 Select Folder...")
+        self.browse_save_dir_button.clicked.connect(self.browse_save_directory)
+        save_dir_layout.addWidget(self.receiver_save_path_input)
+        save_dir_layout.addWidget(self.browse_save_dir_button)
+        receiver_layout.addLayout(save_dir_layout)
+        
+        listen_layout = QHBoxLayout()
+        listen_layout.addWidget(QLabel("🔗 Listen IP:"))
+        self.listen_ip_input = QLineEdit("0.0.0.0")
+        listen_layout.addWidget(self.listen_ip_input)
+        listen_layout.addWidget(QLabel("Port:"))
+        self.receiver_port_input = QLineEdit(str(DEFAULT_PORT))
+        self.receiver_port_input.setValidator(QIntValidator(1024, 65535))
+        listen_layout.addWidget(self.receiver_port_input)
+        receiver_layout.addLayout(listen_layout)
+        
+        # The buttons have been removed as per the original logic update
+        
+        self.receiver_progress_bar = QProgressBar()
+        self.receiver_speed_label = QLabel("Speed: 0.00 MB/s")
+        receiver_layout.addWidget(self.receiver_progress_bar)
+        receiver_layout.addWidget(self.receiver_speed_label)
+        
+        receiver_group.setLayout(receiver_layout)
+        main_layout.addWidget(receiver_group)
+        
+        status_group = QGroupBox("📋 Status & Logs")
+        status_layout = QVBoxLayout()
+        self.status_log = LogView(self.log_buffer)
+        self.status_log.setMaximumHeight(150)
+        self.status_log.setStyleSheet("font-family: monospace; font-size: 9pt;")
+        
+        log_buttons_layout = QHBoxLayout()
+        clear_log_button = QPushButton("🧹 Clear Log")
+        clear_log_button.clicked.connect(self.status_log.clear_log)
+        log_buttons_layout.addWidget(clear_log_button)
+        log_buttons_layout.addStretch()
+        
+        status_layout.addWidget(self.status_log)
+        status_layout.addLayout(log_buttons_layout)
+        status_group.setLayout(status_layout)
+        main_layout.addWidget(status_group)
+        
+        self.setLayout(main_layout)
+        self.log_status("🚀 LAN File Shuttle Pro Started!")
+
+    def expire_devices(self):
+        if self.daemon_client:
+            return # the daemon expires its peers and says so in peer_removed events
+        with TRACE.span('expire_devices', 'gui'):
+            for device_info in self.peer_registry.expire():
+                self.link_monitor.forget(device_info['ip'])
+
+    def toggle_trace(self):
+        if not TRACE.enabled:
+            TRACE.clear()
+            TRACE.enable()
+            self.log_status("⏺️ Tracing started - press Ctrl+Shift+T again to save the trace")
+            return
+        TRACE.disable()
+        try:
+            path = TRACE.dump()
+            self.log_status(f"💾 Trace saved to {path} (open it in ui.perfetto.dev)")
+        except OSError as e:
+            self.log_status(f"❌ Could not save trace: {e}", logging.ERROR)
+
+    def start_profile(self):
+        try:
+            self.on_profile_started(capture_profile())
+        except RuntimeError as e:
+            self.log_status(f"⚠️ {e}", logging.WARNING)
+
+    def on_profile_started(self, out_dir):
+        self.log_status(f"🔬 Profiling for {PROFILE_DURATION} s into {out_dir}")
+
+    def select_device_from_list(self, index):
+        device_info = index.data(Qt.UserRole)
+        if device_info:
+            self.recipient_ip_input.setText(device_info['ip'])
+            self.sender_port_input.setText(str(device_info.get('port', DEFAULT_PORT)))
+            self.log_status(f"✅ Device selected: {device_info['hostname']} ({device_info['ip']})")
+
+    def receiver_load(self):
+        worker = self.receiver_worker
+        return worker.core.load() if worker else {}
+
+    def measure_selected_link(self):
+        index = self.device_list_view.currentIndex()
+        device_info = index.data(Qt.UserRole) if index.isValid() else None
+        if not device_info:
+            QMessageBox.warning(self, "No Device", "Please select a device to measure.")
+            return
+        if self.probe_thread:
+            return
+
+        self.measure_link_button.setEnabled(False)
+        self.log_status(f"📶 Measuring link to {device_info['hostname']} ({device_info['ip']})...")
+
+        self.probe_thread = QThread()
+        self.probe_worker = CapacityProbeWorker(device_info['ip'], device_info.get('port', DEFAULT_PORT),
+                                                self.link_monitor)
+        self.probe_worker.moveToThread(self.probe_thread)
+        self.loop_monitor.track(self.probe_worker.probe_finished)
+        self.probe_worker.probe_finished.connect(self.on_probe_finished)
+        self.probe_thread.started.connect(self.probe_worker.run)
+        self.probe_thread.start()
+
+    def on_probe_finished(self, host, success, message):
+        if success:
+            self.log_status(f"📶 Link to {host}: {message}")
+        else:
+            self.log_status(f"❌ Link probe to {host} failed: {message}", logging.ERROR)
+
+        self.measure_link_button.setEnabled(True)
+        if self.probe_thread:
+            self.probe_thread.quit()
+            self.probe_thread.wait(3000)
+            self.probe_thread = None
+            self.probe_worker = None
+        self.device_model.refresh_link(host)
+
+    def refresh_devices(self):
+        self.device_model.clear()
+        self.peer_registry.clear()
+        if self.daemon_client:
+            self.sync_daemon_peers()
+        elif self.discovery_worker:
+            self.discovery_worker.core.request_refresh()
+        self.log_status("🔄 Refreshing device list...")
+
+    def browse_files(self):
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Select File(s) to Send")
+        if filenames:
+            self.file_queue = filenames
+            self.file_list_widget.clear()
+            total_size = 0
+            for filepath in filenames:
+                filename = os.path.basename(filepath)
+                filesize = os.path.getsize(filepath)
+                total_size += filesize
+                size_mb = filesize / (1024*1024)
+                self.file_list_widget.addItem(f"{filename} ({size_mb:.1f} MB)")
+            
+            total_size_mb = total_size / (1024*1024)
+            self.log_status(f"📁 {len(self.file_queue)} file(s) selected (Total: {total_size_mb:.1f} MB)")
+
+    def clear_files(self):
+        self.file_queue.clear()
+        self.file_list_widget.clear()
+        self.log_status("🗑️ File list cleared")
+
+    def browse_save_directory(self):
+        directory = QFileDialog.getExistingDirectory(self, "Select Save Directory")
+        if directory:
+            self.receiver_save_path_input.setText(directory)
+            self.log_status(f"💾 Save location changed: {directory}")
+
+    def start_sending(self):
+        if not self.file_queue:
+            QMessageBox.warning(self, "No Files", "Please select at least one file to send.")
+            return
+
+        recipient_ip = self.recipient_ip_input.text().strip()
+        sender_port = int(self.sender_port_input.text())
+        
+        if not recipient_ip:
+            QMessageBox.warning(self, "No Target IP", "Please enter a target IP address.")
+            return
+        
+        if recipient_ip.lower() == AUTO_TARGET:
+            total_size = sum(os.path.getsize(path) for path in self.file_queue if os.path.exists(path))
+            target = select_auto_target(self.peer_registry.devices(), total_size, self.link_monitor)
+            if not target:
+                QMessageBox.warning(self, "No Receiver", "No discovered receiver can take this transfer.")
+                return
+            recipient_ip = target['ip']
+            sender_port = target.get('port', DEFAULT_PORT)
+            self.log_status(f"🎯 Auto-selected {target['hostname']} ({recipient_ip}) as the least-loaded receiver")
+        
+        priority = self.priority_input.currentText()
+        self.sender_progress_bar.setValue(0)
+        self.log_status(f"🚀 Queueing {len(self.file_queue)} file(s) for {recipient_ip}:{sender_port} ({priority} priority)")
+
+        if self.daemon_client:
+            try:
+                job_id = self.daemon_client.enqueue(recipient_ip, sender_port, self.file_queue,
+                                                    priority=priority)['job']['id']
+            except (ControlError, OSError, ValueError) as e:
+                self.on_sender_complete(False, f"Daemon refused the transfer: {e}")
+                return
+            self.log_status(f"📤 Queued as daemon job {job_id}")
+        else:
+            if not self.send_queue_worker:
+                self.start_send_queue()
+            job_id = self.send_queue_worker.core.submit(recipient_ip, sender_port, self.file_queue, priority).id
+
+        self.send_job_ids.add(job_id)
+        self.send_job_id = job_id
+        self.file_queue = [] # the job keeps its own list; this one is free for the next batch
+        self.file_list_widget.clear()
+
+    def apply_send_limit(self):
+        if not self.limit_input.isModified():
+            return # editingFinished also fires on focus changes
+        self.limit_input.setModified(False)
+        rate = int(self.limit_input.text() or 0) * 1024 * 1024
+        if self.daemon_client:
+            try:
+                self.daemon_client.request('limits', **{'global': rate})
+            except (ControlError, OSError, ValueError) as e:
+                self.log_status(f"Daemon refused the bandwidth limit: {e}", logging.ERROR)
+                return
+        else:
+            self.send_shaper.set_limits(global_rate=rate)
+        self.log_status(f"📶 Send bandwidth limit: {format_rate(rate) if rate else 'none'}")
+
+    def start_send_queue(self):
+        self.send_queue_thread = QThread()
+        self.send_queue_worker = SendQueueWorker(SendQueue(shaper=self.send_shaper))
+        self.send_queue_worker.moveToThread(self.send_queue_thread)
+        self.loop_monitor.track(*self.send_queue_worker.signals())
+        for signal in self.send_queue_worker.signals():
+            signal.connect(self.on_job_event)
+        self.send_queue_thread.started.connect(self.send_queue_worker.run)
+        self.send_queue_thread.start()
+
+    def on_sender_complete(self, success, message):
+        self.log_status(f"📤 {message}", logging.INFO if success else logging.ERROR)
+        
+        if success:
+            QMessageBox.information(self, "Transfer Successful", message)
+        else:
+            QMessageBox.critical(self, "Transfer Error", message)
+            
+        self.sender_progress_bar.setValue(0)
+        self.sender_speed_label.setText("Speed: 0.00 MB/s")
+
+    def start_receiving(self):
+        listen_ip = self.listen_ip_input.text()
+        receiver_port = int(self.receiver_port_input.text())
+        save_dir = self.receiver_save_path_input.text()
+
+        if not os.path.isdir(save_dir):
+            QMessageBox.warning(self, "Invalid Path", "Please select a valid save directory.")
+            return
+
+        self.is_receiving = True
+        self.receiver_port = receiver_port
+        
+        self.receiver_progress_bar.setValue(0)
+        
+        self.log_status(f"📥 Starting receiver server on {listen_ip}:{receiver_port}")
+
+        self.receiver_thread = QThread()
+        listen_socket = self.listeners.pop('tcp', None)
+        if listen_socket and listen_socket.getsockname()[1] != receiver_port:
+            listen_socket.close()
+            listen_socket = None
+        self.receiver_worker = ReceiverWorker(FileReceiver(listen_ip, receiver_port, save_dir, listen_socket))
+        self.receiver_worker.moveToThread(self.receiver_thread)
+        self.loop_monitor.track(*self.receiver_worker.signals())
+
+        self.receiver_worker.progress_updated.connect(self.receiver_progress_bar.setValue)
+        self.receiver_worker.status_message.connect(lambda msg: self.log_status(f"📥 {msg}"))
+        self.receiver_worker.transfer_complete.connect(self.on_receiver_complete)
+        self.receiver_worker.server_started.connect(self.on_receiver_server_status)
+        self.receiver_worker.speed_updated.connect(lambda speed: self.receiver_speed_label.setText(f"Speed: {speed}"))
+        self.receiver_worker.rate_updated.connect(lambda rate: self.show_rate(self.receiver_speed_label, rate))
+
+        self.receiver_thread.started.connect(self.receiver_worker.run)
+        self.receiver_thread.start()
+
+    def on_receiver_server_status(self, started, message):
+        if started:
+            self.log_status(f"✅ Server started: {message}")
+        else:
+            self.log_status(f"❌ Server Error: {message}", logging.ERROR)
+            QMessageBox.critical(self, "Server Error", message)
+            # Since the receiver is auto-started, we don't call stop_receiving() here to avoid loops.
+            # The server thread will simply end.
+
+    def on_receiver_complete(self, success, message):
+        if success:
+            self.log_status(f"✅ {message}")
+            QMessageBox.information(self, "File Received", message)
+        else:
+            self.log_status(f"❌ {message}", logging.ERROR)
+            QMessageBox.warning(self, "Reception Error", message)
+        
+        self.receiver_progress_bar.setValue(0)
+        self.receiver_speed_label.setText("Speed: 0.00 MB/s")
+
+    def stop_receiving(self): # This function is kept for manual intervention or future use
+        self.is_receiving = False
+        
+        if self.receiver_thread and self.receiver_worker:
+            self.log_status("📥 Stopping receiver server...")
+            self.receiver_worker.stop()
+            self.receiver_thread.quit()
+            self.receiver_thread.wait(5000)
+            if self.receiver_thread.isRunning():
+                self.receiver_thread.terminate()
+                self.log_status("⚠️ Receiver thread forcibly terminated", logging.WARNING)
+            self.receiver_thread = None
+            self.receiver_worker = None
+        
+        self.receiver_progress_bar.setValue(0)
+        self.receiver_speed_label.setText("Speed: 0.00 MB/s")
+        self.log_status("📥 Receiver server stopped")
+
+    def show_rate(self, label, rate):
+        """Smoothed speed, ETA and a sparkline of the recent rate history."""
+        label.setText(f"Speed: {format_rate(rate['rate_bps'])}   ETA {format_eta(rate['eta_s'])}   "
+                      f"{sparkline(rate['history'], 30)}")
+
+    def log_status(self, message, level=logging.INFO):
+        self.log_buffer.log(message, level)
+
+    def closeEvent(self, event):
+        self.log_status("🔄 Exiting application...")
+
+        if self.daemon_client:
+            # Detach only; the daemon keeps its listeners and queued transfers
+            client, self.daemon_client = self.daemon_client, None
+            client.close()
+            self.daemon_events_worker.stop()
+            self.daemon_events_thread.quit()
+            self.daemon_events_thread.wait(2000)
+            if self.daemon_peers_thread:
+                self.daemon_peers_thread.quit()
+                self.daemon_peers_thread.wait(2000)
+        
+        if self.send_queue_worker and self.send_queue_thread:
+            self.send_queue_worker.stop()
+            self.send_queue_thread.quit()
+            self.send_queue_thread.wait(2000)
+            if self.send_queue_thread.isRunning():
+                self.send_queue_thread.terminate()
+
+        if self.receiver_worker and self.receiver_thread:
+            self.receiver_worker.stop()
+            self.receiver_thread.quit()
+            self.receiver_thread.wait(3000)
+            if self.receiver_thread.isRunning():
+                self.receiver_thread.terminate()
+
+        if self.discovery_worker and self.discovery_thread:
+            self.discovery_worker.stop()
+            self.discovery_thread.quit()
+            self.discovery_thread.wait(2000)
+            if self.discovery_thread.isRunning():
+                self.discovery_thread.terminate()
+
+        if self.response_server_worker and self.response_server_thread:
+            self.response_server_worker.stop()
+            self.response_server_thread.quit()
+            self.response_server_thread.wait(2000)
+            if self.response_server_thread.isRunning():
+                self.response_server_thread.terminate()
+
+        if hasattr(self, 'ui_update_timer'):
+            self.ui_update_timer.stop()
+        self.loop_monitor.stop()
+        if self.metrics_writer:
+            self.metrics_writer.stop()
+
+        self.log_status("👋 Application closed")
+        self.log_buffer.close()
+        event.accept()
+
+def run(argv, listeners=None):
+    app = QApplication(argv)
+    
+    app.setApplicationName("LAN File Shuttle Pro")
+    app.setApplicationVersion("2.0")
+    app.setOrganizationName("Tiwut")
+    
+    try:
+        window = FileTransferApp(listeners)
+        window.show()
+        return app.exec_()
+    except Exception as e:
+        print(f"Error starting application: {e}")
+        return 1
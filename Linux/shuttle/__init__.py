@@ -0,0 +1,7 @@
+"""LAN File Shuttle transfer engine.
+
+Pure-Python core shared by the Qt GUI (``main.py``) and the headless command
+line (``python3 -m shuttle``). Nothing in this package imports Qt.
+"""
+
+__version__ = '2.0'
@@ -0,0 +1,83 @@
+"""Listening sockets bound before anything heavy is imported, or inherited via LISTEN_FDS.
+
+Binding first means senders that connect while the GUI is still loading
+queue up in the listen backlog instead of getting ConnectionRefusedError.
+Under systemd socket activation (or any manager that speaks the LISTEN_FDS
+protocol) the pre-bound sockets are adopted instead of binding new ones.
+"""
+
+import os
+import socket
+
+from .config import DISCOVERY_PORT
+
+SD_LISTEN_FDS_START = 3
+LISTEN_BACKLOG = 64
+
+
+def inherited_sockets():
+    """Sockets handed over by the service manager, consumed at most once per process."""
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return []
+    try:
+        count = int(os.environ.get('LISTEN_FDS', '0'))
+    except ValueError:
+        return []
+
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(name, None)
+
+    sockets = []
+    for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count):
+        try:
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            continue
+        os.set_inheritable(fd, False)
+        sockets.append(sock)
+    return sockets
+
+
+def _bound_port(sock):
+    try:
+        return sock.getsockname()[1]
+    except (OSError, IndexError):
+        return None
+
+
+def bind_listeners(listen_ip, port, discovery_port=DISCOVERY_PORT, discovery=True):
+    """Return ``{'tcp': sock, 'udp': sock}`` for the receiver and the discovery responder.
+
+    Inherited sockets win; anything missing is bound here. A socket that cannot
+    be bound (e.g. the port is taken) is left out so the caller can report it
+    when the worker starts.
+    """
+    listeners = {}
+    for sock in inherited_sockets():
+        if sock.type == socket.SOCK_STREAM and _bound_port(sock) == port and 'tcp' not in listeners:
+            listeners['tcp'] = sock
+        elif sock.type == socket.SOCK_DGRAM and _bound_port(sock) == discovery_port and 'udp' not in listeners:
+            listeners['udp'] = sock
+        else:
+            sock.close()
+
+    if 'tcp' not in listeners:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((listen_ip, port))
+            sock.listen(LISTEN_BACKLOG)
+            listeners['tcp'] = sock
+        except OSError:
+            sock.close()
+
+    if discovery and 'udp' not in listeners:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', discovery_port))
+            listeners['udp'] = sock
+        except OSError:
+            sock.close()
+
+    return listeners
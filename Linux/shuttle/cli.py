@@ -0,0 +1,850 @@
+"""Headless command line: ``shuttle send``, ``shuttle receive``, ``shuttle peers``,
+``shuttle shard``, multicast distribution (``mcast-send``, ``mcast-receive``), swarm distribution
+(``swarm-seed``, ``swarm-get``) and the daemon commands (``daemon``, ``enqueue``, ``status``, ``cancel``, ``limits``,
+``events``, ``metrics``, ``trace``, ``profile``).
+
+Run it as ``python3 -m shuttle <command>``. Only the modules a command needs
+are imported, so it starts without touching Qt or a display.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from .config import (AUTO_TARGET, CONTROL_SOCKET, DEFAULT_PORT, DISCOVERY_INTERVAL, DISCOVERY_PORT,
+                     JOB_PRIORITIES, METRICS_FILE, MULTICAST_FEC_K, MULTICAST_FEC_R, MULTICAST_GROUP, MULTICAST_PORT,
+                     MULTICAST_RATE, PROFILE_DURATION, RECEIVE_DIR, RELAY_MODES, SHARD_MANIFEST,
+                     SHARD_STRATEGIES, SWARM_ADVERTISE_INTERVAL, SWARM_LINGER, SWARM_PORT)
+
+
+def _print_status(prefix):
+    def handler(message):
+        print(f"{prefix}{message}", flush=True)
+    return handler
+
+
+def _parse_rate(text):
+    """Bytes/s from ``500K``, ``10M``, ``1.5G`` (binary units) or a plain number; 0 or ``off`` for no limit."""
+    text = text.strip().upper().removesuffix('/S').removesuffix('B')
+    if text in ('OFF', 'NONE'):
+        return 0
+    scale = 1024 ** ('KMG'.index(text[-1]) + 1) if text and text[-1] in 'KMG' else 1
+    try:
+        rate = float(text[:-1] if scale > 1 else text) * scale
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate '{text}', e.g. 500K, 10M or 1G") from None
+    if rate < 0:
+        raise argparse.ArgumentTypeError("a rate cannot be negative")
+    return int(rate)
+
+
+def _limit_text(rate):
+    from .rate import format_rate
+
+    return format_rate(rate) if rate else "unlimited"
+
+
+def _rate_text(rate, width=20):
+    """``12.34 MB/s  ETA 0:42  ▁▃▅▇`` from a RateEstimator snapshot."""
+    from .rate import format_eta, format_rate, sparkline
+
+    return f"{format_rate(rate['rate_bps']):>12}  ETA {format_eta(rate['eta_s']):>7}  {sparkline(rate['history'], width)}"
+
+
+class _ProgressLine:
+    """Rewrites a single stderr line with percent, speed and ETA when attached to a terminal."""
+
+    def __init__(self):
+        self.enabled = sys.stderr.isatty()
+        self.percent = 0
+        self.speed = ''
+
+    def progress(self, percent):
+        if percent != self.percent:
+            self.percent = percent
+            self._draw()
+
+    def rate_changed(self, rate):
+        self.speed = _rate_text(rate)
+        self._draw()
+
+    def _draw(self):
+        if self.enabled:
+            sys.stderr.write(f"\r{self.percent:3d}%  {self.speed}\033[K")
+            sys.stderr.flush()
+
+    def finish(self):
+        if self.enabled and self.percent:
+            sys.stderr.write("\n")
+
+
+def _start_metrics(args):
+    """Start the exporters asked for with --metrics-port/--metrics-file; returns a stop function."""
+    from .metrics import MetricsFileWriter, start_metrics_server
+
+    stoppers = []
+    if args.metrics_port:
+        stoppers.append(start_metrics_server(args.metrics_port).shutdown)
+    if args.metrics_file:
+        stoppers.append(MetricsFileWriter(args.metrics_file).start().stop)
+    return lambda: [stop() for stop in stoppers]
+
+
+def _start_trace(args):
+    """Turn tracing on for --trace FILE; returns a function that writes the file."""
+    if not args.trace:
+        return lambda: None
+    from .tracing import TRACE
+
+    TRACE.enable()
+
+    def dump():
+        print(f"Trace written to {TRACE.dump(args.trace)}", file=sys.stderr)
+    return dump
+
+
+def _profile_on_sigusr1():
+    from .profiling import install_signal_handler
+
+    install_signal_handler(on_started=lambda out_dir: print(f"Profiling into {out_dir}", file=sys.stderr))
+
+
+def _discover(seconds, sweep_cidr=None, stop_at_first=False):
+    from .discovery import DeviceDiscovery, PeerCache
+
+    discovery = DeviceDiscovery(mode='sweep' if sweep_cidr else 'broadcast',
+                                sweep_cidr=sweep_cidr, peer_cache=PeerCache())
+    found = threading.Event()
+    if stop_at_first:
+        discovery.on('device_found', lambda *args: found.set())
+    thread = threading.Thread(target=discovery.run, name='discovery', daemon=True)
+    thread.start()
+    if stop_at_first:
+        found.wait(seconds)
+    else:
+        time.sleep(seconds)
+    discovery.stop()
+    thread.join(DISCOVERY_INTERVAL + 1)
+    return discovery
+
+
+def _parse_targets(text, default_port):
+    """``host[:port],host[:port],...`` as (host, port) pairs."""
+    targets = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        host, _, port = item.partition(':')
+        targets.append((host, int(port) if port else default_port))
+    return targets
+
+
+def cmd_send(args):
+    from .transfer import FileSender
+
+    host, port = args.host, args.port
+    if ',' in host:
+        if args.relay:
+            print("--relay takes a single first receiver, not a list.", file=sys.stderr)
+            return 1
+        return _send_fanout(args)
+    if host.lower() == AUTO_TARGET:
+        from .discovery import select_auto_target
+
+        discovery = _discover(args.discover_time)
+        total_size = sum(os.path.getsize(path) for path in args.files if os.path.exists(path))
+        target = select_auto_target(discovery.registry.devices(), total_size, discovery.link_monitor)
+        if not target:
+            print("No discovered receiver can take this transfer.", file=sys.stderr)
+            return 1
+        host, port = target['ip'], target.get('port', DEFAULT_PORT)
+        print(f"Auto-selected {target['hostname']} ({host})")
+
+    relay = None
+    if args.relay:
+        try:
+            relay = _parse_targets(args.relay, args.port)
+        except ValueError:
+            print(f"Invalid relay list '{args.relay}', expected host[:port],host[:port],...", file=sys.stderr)
+            return 1
+
+    flow = None
+    if args.limit:
+        from .shaping import Shaper
+
+        flow = Shaper(transfer_rate=args.limit).flow(host)
+    sender = FileSender(host, port, args.files, flow=flow, relay=relay)
+    return _run_sender(sender, args)
+
+
+def _send_fanout(args):
+    from .fanout import FanoutSender
+    from .shaping import Shaper
+
+    try:
+        targets = _parse_targets(args.host, args.port)
+    except ValueError:
+        print(f"Invalid target list '{args.host}', expected host[:port],host[:port],...", file=sys.stderr)
+        return 1
+    shaper = Shaper(transfer_rate=args.limit) if args.limit else None # --limit caps each target
+    return _run_sender(FanoutSender(targets, args.files, shaper=shaper), args)
+
+
+def cmd_shard(args):
+    from .shard import ShardSender
+    from .transfer import hop_label
+
+    weights = {}
+    if args.targets.lower() == AUTO_TARGET:
+        from .discovery import expected_rate
+
+        discovery = _discover(args.discover_time, args.sweep)
+        devices = [device for device in discovery.registry.devices()
+                   if device.get('is_receiving') and 'relay' in device.get('capabilities', [])]
+        if not devices:
+            print("No discovered receiver can take shards.", file=sys.stderr)
+            return 1
+        targets = [(device['ip'], device.get('port', DEFAULT_PORT)) for device in devices]
+        for device, target in zip(devices, targets):
+            weights[hop_label(*target)] = expected_rate(device, discovery.link_monitor)
+        print(f"Sharding over {len(targets)} receiver(s): " +
+              ", ".join(f"{device['hostname']} ({device['ip']})" for device in devices))
+    else:
+        try:
+            targets = _parse_targets(args.targets, args.port)
+        except ValueError:
+            print(f"Invalid target list '{args.targets}', expected host[:port],host[:port],...", file=sys.stderr)
+            return 1
+
+    shaper = None
+    if args.limit:
+        from .shaping import Shaper
+
+        shaper = Shaper(transfer_rate=args.limit) # --limit caps each receiver
+    sender = ShardSender(targets, args.files, strategy=args.strategy, weights=weights, manifest_path=args.manifest,
+                         shaper=shaper)
+    return _run_sender(sender, args)
+
+
+def _run_sender(sender, args):
+    progress = _ProgressLine()
+    result = {}
+    sender.on('status_message', _print_status(''))
+    sender.on('progress_updated', progress.progress)
+    sender.on('rate_updated', progress.rate_changed)
+    sender.on('transfer_complete', lambda success, message: result.update(success=success, message=message))
+
+    stop_metrics = _start_metrics(args)
+    dump_trace = _start_trace(args)
+    try:
+        sender.run()
+    except KeyboardInterrupt:
+        sender.stop()
+        result.setdefault('success', False)
+        result.setdefault('message', "Transfer cancelled.")
+    finally:
+        stop_metrics()
+        dump_trace()
+    progress.finish()
+
+    if result.get('message'):
+        print(result['message'], file=sys.stdout if result.get('success') else sys.stderr)
+    return 0 if result.get('success') else 1
+
+
+def cmd_receive(args):
+    from .activation import bind_listeners
+    from .transfer import FileReceiver, relay_policy
+
+    if args.relay == 'peers' and args.no_discovery:
+        print("--relay peers needs discovery to know the peers.", file=sys.stderr)
+        return 2
+    listeners = bind_listeners(args.listen, args.port, discovery=not args.no_discovery)
+    registry = None
+    if args.relay == 'peers':
+        from .discovery import PeerRegistry
+
+        registry = PeerRegistry()
+    receiver = FileReceiver(args.listen, args.port, os.path.abspath(args.dir), listeners.get('tcp'),
+                            allow_relay=relay_policy(args.relay, registry))
+    receiver.on('status_message', _print_status(''))
+    receiver.on('server_started', lambda started, message: None if started else print(message, file=sys.stderr))
+    receiver.on('transfer_complete', lambda success, message: print(message, flush=True))
+
+    response_server = None
+    discovery = None
+    if not args.no_discovery:
+        from .discovery import DeviceDiscovery, DiscoveryResponseServer
+
+        response_server = DiscoveryResponseServer(lambda: True, lambda: args.port, receiver.load,
+                                                  registry=registry, sock=listeners.get('udp'))
+        threading.Thread(target=response_server.run, name='discovery-response', daemon=True).start()
+        if registry is not None:
+            discovery = DeviceDiscovery(registry=registry)
+            threading.Thread(target=discovery.run, name='discovery', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: receiver.stop())
+    _profile_on_sigusr1()
+    stop_metrics = _start_metrics(args)
+    dump_trace = _start_trace(args)
+    try:
+        receiver.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        if response_server:
+            response_server.stop()
+        if discovery:
+            discovery.stop()
+        stop_metrics()
+        dump_trace()
+    return 0
+
+
+def _parse_fec(text):
+    """``K,R`` as a pair of ints: data blocks per group and parity blocks per group."""
+    try:
+        k, r = (int(part) for part in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid FEC '{text}', expected K,R such as 32,4") from None
+    if k < 1 or not 0 <= r <= min(k, 255):
+        raise argparse.ArgumentTypeError("FEC needs K >= 1 and 0 <= R <= K")
+    return k, r
+
+
+def cmd_mcast_send(args):
+    from .multicast import MulticastSender
+
+    sender = MulticastSender(args.files, args.group, args.port, args.interface, rate=args.rate,
+                             fec=args.fec, receivers=args.receivers)
+    return _run_sender(sender, args)
+
+
+def cmd_mcast_receive(args):
+    from .multicast import MulticastReceiver
+
+    receiver = MulticastReceiver(os.path.abspath(args.dir), args.group, args.port, args.interface,
+                                 drop_rate=args.drop, once=args.once)
+    failures = []
+
+    def finished(success, message):
+        print(message, flush=True)
+        if not success:
+            failures.append(message)
+    receiver.on('status_message', _print_status(''))
+    receiver.on('server_started', lambda started, message: None if started else failures.append(message))
+    receiver.on('transfer_complete', finished)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: receiver.stop())
+    stop_metrics = _start_metrics(args)
+    dump_trace = _start_trace(args)
+    try:
+        receiver.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        stop_metrics()
+        dump_trace()
+    stats = receiver.stats
+    print(f"{stats['datagrams']} datagrams, {stats['dropped']} dropped, {stats['malformed']} malformed, "
+          f"{stats['recovered']} blocks rebuilt from parity, {stats['naks']} NAKs sent", flush=True)
+    for message in failures[:1]:
+        print(message, file=sys.stderr)
+    return 1 if failures else 0
+
+
+def _advertise_swarm(node, args):
+    """Have this host's discovery responses carry `node`'s advertisement; returns a function that stops it.
+
+    The daemon's responder carries it when a daemon runs: a second responder on
+    the discovery port would split unicast probes with the first one. Without a
+    daemon the node answers discovery itself, if nothing else has the port.
+    """
+    from .control import ControlClient, ControlError
+    from .discovery import DiscoveryResponseServer
+
+    try:
+        client = ControlClient(args.socket)
+    except ControlError:
+        client = None
+    if client is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # no SO_REUSEADDR: fail rather than share
+        try:
+            sock.bind(('', DISCOVERY_PORT))
+        except OSError as e:
+            sock.close()
+            print(f"Discovery port {DISCOVERY_PORT} is taken ({e.strerror}) and no daemon is running; start "
+                  f"'shuttle daemon' so the swarm can advertise through it.", file=sys.stderr)
+            return None
+        responder = DiscoveryResponseServer(lambda: False, registry=node.registry, sock=sock,
+                                            swarm_callback=node.advertisement)
+        threading.Thread(target=responder.run, name='discovery-response', daemon=True).start()
+        return responder.stop
+
+    stopped = threading.Event()
+
+    def refresh():
+        with client:
+            try:
+                while True:
+                    client.request('swarm', swarms=node.advertisement())
+                    if stopped.wait(SWARM_ADVERTISE_INTERVAL):
+                        return
+            except (ControlError, OSError, ValueError) as e:
+                print(f"The daemon stopped advertising the swarm: {e}", file=sys.stderr)
+    threading.Thread(target=refresh, name='swarm-advertise', daemon=True).start()
+    return stopped.set
+
+
+def _run_swarm(node, args):
+    """Advertise `node` through discovery, collect the other nodes' advertisements and run it."""
+    from .discovery import DeviceDiscovery
+
+    stop_advertising = _advertise_swarm(node, args)
+    if stop_advertising is None:
+        return 1
+    discovery = DeviceDiscovery(mode='sweep' if args.sweep else 'broadcast', sweep_cidr=args.sweep,
+                                registry=node.registry)
+    threading.Thread(target=discovery.run, name='discovery', daemon=True).start()
+
+    progress = _ProgressLine()
+    result = {}
+
+    def finished(success, message):
+        progress.finish()
+        print(message, flush=True)
+        result['success'] = success
+    node.on('status_message', _print_status(''))
+    node.on('server_started', lambda started, message: print(message, file=sys.stdout if started else sys.stderr))
+    node.on('progress_updated', progress.progress)
+    node.on('rate_updated', progress.rate_changed)
+    node.on('transfer_complete', finished)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: node.stop())
+    stop_metrics = _start_metrics(args)
+    dump_trace = _start_trace(args)
+    try:
+        node.run()
+    except KeyboardInterrupt:
+        node.stop()
+    finally:
+        discovery.stop()
+        stop_advertising()
+        stop_metrics()
+        dump_trace()
+    stats = node.stats
+    if node.is_seed:
+        print(f"{stats['uploaded']} chunk(s) uploaded, {stats['declined']} request(s) sent to other holders",
+              flush=True)
+    else:
+        print(f"{stats['downloaded']} chunk(s) downloaded ({stats['from_seed']} from the seed), "
+              f"{stats['uploaded']} uploaded, {stats['corrupt']} corrupt", flush=True)
+    return 0 if result.get('success', node.is_seed) else 1
+
+
+def cmd_swarm_seed(args):
+    from .discovery import PeerRegistry
+    from .swarm import SwarmNode, build_manifest
+
+    missing = [path for path in args.files if not os.path.isfile(path)]
+    if missing:
+        print(f"File '{missing[0]}' not found.", file=sys.stderr)
+        return 1
+    print(f"Hashing {len(args.files)} file(s)...", flush=True)
+    manifest = build_manifest(args.files)
+    print(f"Swarm id: {manifest['id']}  (on every receiver: shuttle swarm-get {manifest['id']})", flush=True)
+    node = SwarmNode(PeerRegistry(), manifest=manifest, paths=args.files, host=args.listen, port=args.port,
+                     receivers=args.receivers, upload_rate=args.upload_limit)
+    return _run_swarm(node, args)
+
+
+def cmd_swarm_get(args):
+    from .discovery import PeerRegistry
+    from .swarm import SwarmNode
+
+    node = SwarmNode(PeerRegistry(), swarm_id=args.swarm, save_dir=os.path.abspath(args.dir), host=args.listen,
+                     port=args.port, linger=args.linger, upload_rate=args.upload_limit)
+    return _run_swarm(node, args)
+
+
+def cmd_peers(args):
+    discovery = _discover(args.timeout, args.sweep, stop_at_first=args.first)
+    devices = sorted(discovery.registry.devices(), key=lambda device: device['ip'])
+
+    if args.json:
+        for device in devices:
+            device['capabilities'] = list(device['capabilities'])
+            device['link'] = discovery.link_monitor.get(device['ip'])
+        print(json.dumps(devices, indent=1))
+        return 0
+
+    for device in devices:
+        state = "ready" if device['is_receiving'] else "not receiving"
+        line = f"{device['ip']:<15} {device['port']:<6} {device['hostname']:<24} {state}"
+        link = discovery.link_monitor.get(device['ip'])
+        if link and link['rtt_ms'] is not None:
+            line += f"  {link['rtt_ms']:.1f} ms"
+        print(line)
+    return 0
+
+
+def cmd_daemon(args):
+    from .activation import bind_listeners
+    from .daemon import DaemonError, ShuttleDaemon
+
+    if args.relay == 'peers' and args.no_discovery:
+        print("--relay peers needs discovery to know the peers.", file=sys.stderr)
+        return 2
+    listeners = bind_listeners(args.listen, args.port, discovery=not args.no_discovery)
+    daemon = ShuttleDaemon(args.dir, args.listen, args.port, args.socket, discovery=not args.no_discovery,
+                           listeners=listeners, relay=args.relay)
+    daemon.send_queue.shaper.set_limits(args.limit, args.peer_limit, args.transfer_limit)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    _profile_on_sigusr1()
+    daemon.on('daemon_started', lambda event: print(f"Daemon {event['pid']} listening on {daemon.socket_path}",
+                                                    flush=True))
+    daemon.on('receiver_status_message', lambda event: print(event['args'][0], flush=True))
+    daemon.on('job_finished', lambda event: print(f"Job {event['job']['id']} {event['job']['state']}: "
+                                                  f"{event['job']['message']}", flush=True))
+    stop_metrics = _start_metrics(args)
+    try:
+        daemon.serve_forever()
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_metrics()
+    return 0
+
+
+def cmd_enqueue(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        # Subscribe before enqueueing so a fast job cannot finish unseen
+        watcher = ControlClient(args.socket) if args.wait else None
+        if watcher:
+            watcher.subscribe()
+        with ControlClient(args.socket) as client:
+            job = client.enqueue(args.host, args.port, args.files, priority=args.priority, limit=args.limit)['job']
+        print(f"Queued job {job['id']}")
+        if not watcher:
+            return 0
+        with watcher:
+            for event in watcher.events():
+                if event.get('event') == 'job_finished' and event['job']['id'] == job['id']:
+                    print(f"Job {job['id']} {event['job']['state']}: {event['job']['message']}")
+                    return 0 if event['job']['state'] == 'done' else 1
+                if event.get('event') == 'job_status' and event['job'] == job['id']:
+                    print(event['message'])
+    except ControlError as e:
+        print(e, file=sys.stderr)
+    return 1
+
+
+def cmd_status(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            status = client.request('status')
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(status, indent=1))
+        return 0
+    receiver = status['receiver']
+    print(f"Daemon {status['pid']}: receiving on {receiver['listen']}:{receiver['port']} into {receiver['save_dir']}")
+    for job in status['jobs']:
+        print(f"  job {job['id']:<4} {job['state']:<10} {job['priority']:<6} {job['progress']:3d}%  "
+              f"{job['host']}:{job['port']}  {len(job['files'])} file(s)  {job['message']}")
+        if job['state'] == 'running' and job.get('rate'):
+            print(f"           {_rate_text(job['rate'])}")
+    return 0
+
+
+def cmd_cancel(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            job = client.request('cancel', job=args.job)['job']
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Job {job['id']}: {job['state']}")
+    return 0
+
+
+def cmd_limits(args):
+    from .control import ControlClient, ControlError
+
+    changes = {name: value for name, value in (('global', args.global_rate), ('peer', args.peer),
+                                               ('transfer', args.transfer), ('max_active', args.max_active),
+                                               ('max_per_peer', args.max_per_peer)) if value is not None}
+    try:
+        if args.host:
+            changes['peers'] = {host: None if rate.lower() == 'default' else _parse_rate(rate)
+                                for host, rate in args.host}
+        if args.job:
+            changes['job'], changes['limit'] = int(args.job[0]), _parse_rate(args.job[1])
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    try:
+        with ControlClient(args.socket) as client:
+            reply = client.request('limits', **changes)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(reply, indent=1))
+        return 0
+    shaping = reply['shaping']
+    print(f"Global {_limit_text(shaping['global'])}, per receiver {_limit_text(shaping['peer'])}, "
+          f"per transfer {_limit_text(shaping['transfer'])}; "
+          f"{reply['max_active']} job(s) at once, {reply['max_per_peer']} per receiver")
+    for host, rate in sorted(shaping['peers'].items()):
+        print(f"  receiver {host:<15} {_limit_text(rate)}")
+    for flow in shaping['flows']:
+        print(f"  sending to {flow['peer']:<15} weight {flow['weight']}  share {_limit_text(flow['share_bps'])}")
+    return 0
+
+
+def cmd_events(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            for event in client.events():
+                print(json.dumps(event), flush=True)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_metrics(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            reply = client.request('metrics')
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps({'phases': reply['phases'], 'transfers': reply['transfers']}, indent=1))
+    else:
+        sys.stdout.write(reply['text'])
+    return 0
+
+
+def cmd_trace(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            reply = client.request('trace', action=args.action)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if 'path' in reply:
+        print(f"Trace with {reply['events']} event(s) written to {reply['path']}")
+    else:
+        print(f"Tracing {'on' if reply['enabled'] else 'off'}, {reply['events']} event(s) buffered")
+    return 0
+
+
+def cmd_profile(args):
+    from .control import ControlClient, ControlError
+
+    try:
+        with ControlClient(args.socket) as client:
+            reply = client.request('profile', duration=args.duration)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Profiling the daemon for {reply['duration']:g} s into {reply['path']}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='shuttle', description="LAN File Shuttle command line")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send = commands.add_parser('send', help="send files to a receiver")
+    send.add_argument('host', help=f"receiver IP, '{AUTO_TARGET}' for the least-loaded receiver, or a "
+                                   "comma-separated list of host[:port] to send to all of them, reading the files once")
+    send.add_argument('files', nargs='+')
+    send.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    send.add_argument('--discover-time', type=float, default=DISCOVERY_INTERVAL,
+                      help="seconds to listen for receivers in auto mode")
+    send.add_argument('--limit', type=_parse_rate, default=0, metavar='RATE', help="bandwidth cap, e.g. 10M")
+    send.add_argument('--relay', metavar='HOSTS', help="host[:port],... the receiver passes the files on to, "
+                                                      "each hop forwarding to the next as data arrives")
+    send.set_defaults(func=cmd_send)
+
+    shard = commands.add_parser('shard', help="spread files over several receivers, each file to one of them")
+    shard.add_argument('targets', help=f"comma-separated host[:port] list, or '{AUTO_TARGET}' for every "
+                                       "discovered receiver")
+    shard.add_argument('files', nargs='+')
+    shard.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    shard.add_argument('--strategy', choices=SHARD_STRATEGIES, default='balanced',
+                       help="balance bytes by receiver speed, or hash file names so a name always lands on "
+                            "the same receiver")
+    shard.add_argument('--manifest', default=SHARD_MANIFEST, metavar='FILE',
+                       help="JSON list of which file went where, written after the batch")
+    shard.add_argument('--discover-time', type=float, default=DISCOVERY_INTERVAL,
+                       help="seconds to listen for receivers in auto mode")
+    shard.add_argument('--sweep', metavar='CIDR', help="unicast-sweep this range instead of broadcasting")
+    shard.add_argument('--limit', type=_parse_rate, default=0, metavar='RATE', help="bandwidth cap per receiver")
+    shard.set_defaults(func=cmd_shard)
+
+    receive = commands.add_parser('receive', help="receive files until interrupted")
+    receive.add_argument('-d', '--dir', default=RECEIVE_DIR)
+    receive.add_argument('-l', '--listen', default='0.0.0.0')
+    receive.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    receive.add_argument('--no-discovery', action='store_true', help="do not answer discovery requests")
+    receive.add_argument('--relay', choices=RELAY_MODES, default='off',
+                         help="pass chained sends on: never, only to discovered peers, or to any host")
+    receive.set_defaults(func=cmd_receive)
+
+    mcast_send = commands.add_parser('mcast-send', help="multicast files to every receiver in a group at once")
+    mcast_send.add_argument('files', nargs='+')
+    mcast_send.add_argument('--rate', type=_parse_rate, default=MULTICAST_RATE, metavar='RATE',
+                            help="pace to this rate, e.g. 40M (multicast has no congestion control)")
+    mcast_send.add_argument('--fec', type=_parse_fec, default=(MULTICAST_FEC_K, MULTICAST_FEC_R), metavar='K,R',
+                            help="R parity blocks per K data blocks; 0 parity leaves repair to NAKs")
+    mcast_send.add_argument('--receivers', type=int, default=0, metavar='N',
+                            help="move on as soon as N receivers have a file, and fail if fewer ever do")
+    mcast_send.set_defaults(func=cmd_mcast_send)
+
+    mcast_receive = commands.add_parser('mcast-receive', help="receive multicast files until interrupted")
+    mcast_receive.add_argument('-d', '--dir', default=RECEIVE_DIR)
+    mcast_receive.add_argument('--drop', type=float, default=0.0, metavar='SHARE',
+                               help="throw away this share of datagrams (0.05 = 5%%), to test repair")
+    mcast_receive.add_argument('--once', action='store_true', help="exit when the sender says goodbye")
+    mcast_receive.set_defaults(func=cmd_mcast_receive)
+
+    for command in (mcast_send, mcast_receive):
+        command.add_argument('-g', '--group', default=MULTICAST_GROUP)
+        command.add_argument('-p', '--port', type=int, default=MULTICAST_PORT)
+        command.add_argument('-i', '--interface', metavar='IP', help="local address of the interface to use")
+
+    swarm_seed = commands.add_parser('swarm-seed', help="offer files to a swarm of receivers that share chunks")
+    swarm_seed.add_argument('files', nargs='+')
+    swarm_seed.add_argument('--receivers', type=int, default=0, metavar='N',
+                            help="exit once N receivers have everything (default: serve until interrupted)")
+    swarm_seed.set_defaults(func=cmd_swarm_seed)
+
+    swarm_get = commands.add_parser('swarm-get', help="fetch a swarm's files from the seed and other receivers")
+    swarm_get.add_argument('swarm', help="swarm id printed by swarm-seed")
+    swarm_get.add_argument('-d', '--dir', default=RECEIVE_DIR)
+    swarm_get.add_argument('--linger', type=float, default=SWARM_LINGER,
+                           help="seconds to keep serving others after the last request once complete")
+    swarm_get.set_defaults(func=cmd_swarm_get)
+
+    for command in (swarm_seed, swarm_get):
+        command.add_argument('-l', '--listen', default='0.0.0.0')
+        command.add_argument('-p', '--port', type=int, default=SWARM_PORT, help="TCP port serving chunks")
+        command.add_argument('--sweep', metavar='CIDR', help="unicast-sweep this range instead of broadcasting")
+        command.add_argument('--upload-limit', type=_parse_rate, default=0, metavar='RATE',
+                             help="cap on chunk uploads, e.g. 20M")
+
+    peers = commands.add_parser('peers', help="list devices on the network")
+    peers.add_argument('-t', '--timeout', type=float, default=DISCOVERY_INTERVAL)
+    peers.add_argument('--sweep', metavar='CIDR', help="unicast-sweep this range instead of broadcasting")
+    peers.add_argument('--json', action='store_true')
+    peers.add_argument('--first', action='store_true', help="return as soon as one peer answers")
+    peers.set_defaults(func=cmd_peers)
+
+    daemon = commands.add_parser('daemon', help="run the resident daemon (receiver, discovery, send queue)")
+    daemon.add_argument('-d', '--dir', default=RECEIVE_DIR)
+    daemon.add_argument('-l', '--listen', default='0.0.0.0')
+    daemon.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    daemon.add_argument('--no-discovery', action='store_true')
+    daemon.add_argument('--relay', choices=RELAY_MODES, default='off',
+                        help="pass chained sends on: never, only to discovered peers, or to any host")
+    daemon.add_argument('--limit', type=_parse_rate, metavar='RATE', help="cap for all sends together")
+    daemon.add_argument('--peer-limit', type=_parse_rate, metavar='RATE', help="cap per receiver")
+    daemon.add_argument('--transfer-limit', type=_parse_rate, metavar='RATE', help="cap per job")
+    daemon.set_defaults(func=cmd_daemon)
+
+    enqueue = commands.add_parser('enqueue', help="queue a send on the daemon")
+    enqueue.add_argument('host')
+    enqueue.add_argument('files', nargs='+')
+    enqueue.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    enqueue.add_argument('-w', '--wait', action='store_true', help="stream progress until the job finishes")
+    enqueue.add_argument('--priority', choices=JOB_PRIORITIES, default='normal',
+                         help="scheduling class; within a class smaller jobs go first")
+    enqueue.add_argument('--limit', type=_parse_rate, default=0, metavar='RATE', help="bandwidth cap for this job")
+    enqueue.set_defaults(func=cmd_enqueue)
+
+    status = commands.add_parser('status', help="show daemon state and jobs")
+    status.add_argument('--json', action='store_true')
+    status.set_defaults(func=cmd_status)
+
+    cancel = commands.add_parser('cancel', help="cancel a queued or running job")
+    cancel.add_argument('job', type=int)
+    cancel.set_defaults(func=cmd_cancel)
+
+    limits = commands.add_parser('limits', help="show or change the daemon's bandwidth and concurrency limits")
+    limits.add_argument('--global', dest='global_rate', type=_parse_rate, metavar='RATE',
+                        help="all sends together, e.g. 50M; 0 for no limit")
+    limits.add_argument('--peer', type=_parse_rate, metavar='RATE', help="each receiver")
+    limits.add_argument('--transfer', type=_parse_rate, metavar='RATE', help="each job")
+    limits.add_argument('--host', nargs=2, action='append', metavar=('HOST', 'RATE'),
+                        help="one receiver, overriding --peer; RATE 'default' drops the override")
+    limits.add_argument('--job', nargs=2, metavar=('ID', 'RATE'), help="one job, also while it runs")
+    limits.add_argument('--max-active', type=int, metavar='N', help="jobs running at once")
+    limits.add_argument('--max-per-peer', type=int, metavar='N', help="jobs running to one receiver")
+    limits.add_argument('--json', action='store_true')
+    limits.set_defaults(func=cmd_limits)
+
+    events = commands.add_parser('events', help="stream daemon events as JSON lines")
+    events.set_defaults(func=cmd_events)
+
+    metrics = commands.add_parser('metrics', help="print the daemon's transfer phase metrics")
+    metrics.add_argument('--json', action='store_true', help="JSON instead of Prometheus text")
+    metrics.set_defaults(func=cmd_metrics)
+
+    trace = commands.add_parser('trace', help="switch the daemon's timeline trace on or off, or dump it")
+    trace.add_argument('action', choices=('start', 'stop', 'dump', 'status'))
+    trace.set_defaults(func=cmd_trace)
+
+    profile = commands.add_parser('profile', help="capture a stack and allocation profile of the daemon")
+    profile.add_argument('-t', '--duration', type=float, default=PROFILE_DURATION, help="seconds to sample")
+    profile.set_defaults(func=cmd_profile)
+
+    for command in (daemon, enqueue, status, cancel, limits, events, metrics, trace, profile, swarm_seed, swarm_get):
+        command.add_argument('--socket', help=f"daemon control socket (default {CONTROL_SOCKET})")
+
+    for command in (send, shard, receive, daemon, mcast_send, mcast_receive, swarm_seed, swarm_get):
+        command.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on 127.0.0.1:PORT/metrics")
+        command.add_argument('--metrics-file', default=METRICS_FILE,
+                             help="keep a Prometheus textfile here (default: $SHUTTLE_METRICS_FILE)")
+
+    for command in (send, shard, receive, mcast_send, mcast_receive, swarm_seed, swarm_get):
+        command.add_argument('--trace', metavar='FILE', help="record a Chrome/Perfetto trace and write it on exit")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
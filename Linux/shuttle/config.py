@@ -0,0 +1,116 @@
+"""Shared configuration for the transfer engine, discovery and front ends."""
+
+import os
+
+DEFAULT_PORT = 65432
+BUFFER_SIZE = 4096
+TRANSFER_MODES = ('buffered', 'sendfile')
+SENDFILE_MIN_SLICE = 1024 * 1024 # sendfile() slice between progress updates
+RECEIVE_DIR = 'received_files'
+DISCOVERY_PORT = 50000
+DISCOVERY_INTERVAL = 3
+# Set SHUTTLE_SWEEP_CIDR (e.g. '10.20.0.0/22') on networks that filter broadcast
+DISCOVERY_SWEEP_CIDR = os.environ.get('SHUTTLE_SWEEP_CIDR')
+DISCOVERY_MODE = 'sweep' if DISCOVERY_SWEEP_CIDR else 'broadcast'
+DISCOVERY_SWEEP_RATE = 2000 # unicast probes per second
+DISCOVERY_SWEEP_SLICE = 256 # unknown addresses re-probed per round after the first full sweep
+DISCOVERY_SWEEP_MAX_MISSES = 3 # rounds without a reply before a known host is forgotten
+DISCOVERY_SWEEP_MAX_PREFIX = 16 # widest range a sweep takes: a /16 is 65534 probes, about 33 s at the sweep rate
+DEVICE_TIMEOUT = 15 # seconds without a reply before a device leaves the list
+PEER_LOAD_UPDATE_INTERVAL = 5 # seconds between peer updates sent for a changed load alone
+PEER_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.lan_file_shuttle', 'peers.json')
+PEER_CACHE_MAX_AGE = 7 * 24 * 3600 # cached peers not seen for a week are dropped
+PROTOCOL_CAPABILITIES = ['json-metadata', 'echo', 'capacity-probe', 'relay']
+CAPACITY_PROBE_BYTES = 8 * 1024 * 1024 # payload of an on-demand TCP capacity probe
+CAPACITY_PROBE_MAX_BYTES = 64 * 1024 * 1024 # largest probe a receiver accepts
+AUTO_TARGET = 'auto' # enter this as the target IP to pick the least-loaded receiver
+AUTO_TARGET_DEFAULT_CAPACITY = 50 * 1024 * 1024 # assumed bytes/s for peers that were never probed
+LOG_CAPACITY = 2000 # entries kept in memory and in the log panel
+LOG_FILE = os.path.join(os.path.expanduser('~'), '.lan_file_shuttle', 'logs', 'shuttle.log')
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# Control socket of the resident daemon. A daemon run by root listens on the system socket, which
+# members of CONTROL_GROUP may use; anyone else's daemon listens in their own runtime directory
+SYSTEM_CONTROL_SOCKET = '/run/lan-file-shuttle/control.sock'
+CONTROL_GROUP = 'lan-file-shuttle' # socket mode 0660 with this group when it exists, 0600 otherwise
+_RUNTIME_DIR = os.environ.get('XDG_RUNTIME_DIR')
+CONTROL_SOCKET = os.environ.get('SHUTTLE_CONTROL_SOCKET') or (
+    os.path.join(_RUNTIME_DIR, 'lan-file-shuttle.sock') if _RUNTIME_DIR and os.getuid() != 0
+    else SYSTEM_CONTROL_SOCKET)
+CONTROL_SUBSCRIBER_BACKLOG = 1000 # events buffered per subscriber before old ones are dropped
+CONTROL_READ_SIZE = 64 * 1024 # bytes read per recvmsg on the control socket
+CONTROL_MAX_REQUEST = 16 * 1024 * 1024 # longest request line the daemon buffers
+CONTROL_MAX_FDS = 253 # descriptors per message (SCM_MAX_FD); longer lists span several messages
+# Prometheus textfile for the node_exporter textfile collector, e.g. /var/lib/node_exporter/shuttle.prom
+METRICS_FILE = os.environ.get('SHUTTLE_METRICS_FILE')
+METRICS_FILE_INTERVAL = 10 # seconds between textfile rewrites
+METRICS_LISTEN = '127.0.0.1' # address of the optional /metrics endpoint
+# Chrome/Perfetto timeline tracing; off unless SHUTTLE_TRACE=1 or switched on at runtime
+TRACE_ENABLED = os.environ.get('SHUTTLE_TRACE', '') not in ('', '0')
+TRACE_CAPACITY = 200000 # events kept in the in-memory ring
+TRACE_DIR = os.path.join(os.path.expanduser('~'), '.lan_file_shuttle', 'traces')
+# On-demand profiler (SIGUSR1, `shuttle profile`, Ctrl+Shift+P in the GUI)
+PROFILE_DIR = os.path.join(os.path.expanduser('~'), '.lan_file_shuttle', 'profiles')
+PROFILE_DURATION = 10 # seconds per capture
+PROFILE_MAX_DURATION = 300 # upper bound for durations asked for over the control socket
+PROFILE_SAMPLE_INTERVAL = 0.005 # seconds between stack samples
+# GUI event-loop watchdog
+LOOP_LAG_INTERVAL = 0.1 # seconds between event-loop heartbeats
+LOOP_STALL_THRESHOLD = 0.5 # heartbeat lateness that is logged as a stall, with the GUI thread's stack
+# Transfer rate estimation (speed, ETA and sparkline history)
+RATE_SAMPLE_INTERVAL = 0.5 # seconds between rate samples and rate_updated events
+RATE_HALF_LIFE = 3.0 # seconds until the smoothed rate has forgotten half of an old sample
+RATE_WINDOW = 10.0 # seconds covered by the windowed rate
+RATE_HISTORY = 60 # samples kept per transfer for sparklines
+# Send job scheduling (daemon queue and GUI)
+JOB_PRIORITIES = ('high', 'normal', 'low') # scheduling classes, most urgent first
+SCHEDULER_MAX_ACTIVE = 4 # sends running at once, across all receivers
+SCHEDULER_MAX_PER_PEER = 1 # sends running at once to one receiver (FileReceiver serves one at a time)
+SCHEDULER_AGING = 60 # seconds before a queued job is served in arrival order instead of smallest first
+JOB_HISTORY = 100 # finished jobs kept for `shuttle status`; older ones are forgotten
+# Bandwidth shaping of sends; rates in bytes/s, 0 = unlimited. Changeable at runtime with `shuttle limits`
+SHAPING_GLOBAL_RATE = 0 # all sends together
+SHAPING_PEER_RATE = 0 # all sends to one receiver
+SHAPING_TRANSFER_RATE = 0 # one job
+SHAPING_BURST = 0.05 # seconds of traffic a bucket may save up while idle
+SHAPING_REBALANCE_INTERVAL = 1.0 # seconds between fair-share recomputations
+PRIORITY_WEIGHTS = {'high': 4, 'normal': 2, 'low': 1} # bandwidth shares of concurrent jobs
+# One-to-many sends (`shuttle send host1,host2,... files`)
+FANOUT_BLOCK_SIZE = 1024 * 1024 # bytes read once and sent to every target
+FANOUT_WINDOW = 32 # blocks the fastest target may run ahead of the slowest one still fed from memory
+FANOUT_DETACH_AFTER = 1.0 # seconds a full window may keep caught-up targets waiting before the slowest go solo
+# Chain relay (`shuttle send host files --relay host2,host3`): each receiver forwards to the next as data arrives
+RELAY_CHUNK_SIZE = 64 * 1024 # receive size of a relaying hop; each chunk is written and forwarded at once
+RELAY_TIMEOUT = 120 # seconds a hop may stall (replaying to the hop after a failed one); reports wait this per hop below
+RELAY_MODES = ('off', 'peers', 'any') # whom a receiver forwards to: nobody, hosts discovery has seen, anyone
+# Multicast distribution (`shuttle mcast-send` / `mcast-receive`): one sender, any number of receivers on one L2 segment
+MULTICAST_GROUP = '239.255.70.83' # administratively scoped group
+MULTICAST_PORT = 50001
+MULTICAST_TTL = 1 # stay on the local segment
+MULTICAST_BLOCK_SIZE = 1400 # payload bytes per datagram; fits a 1500-byte MTU with the headers
+MULTICAST_FEC_K = 32 # data blocks per FEC group
+MULTICAST_FEC_R = 4 # XOR parity blocks per group, each over every R-th block: repairs any burst of up to R losses
+MULTICAST_RATE = 40 * 1024 * 1024 # bytes/s the sender paces to; multicast has no congestion control
+MULTICAST_NAK_WAIT = 0.25 # seconds the sender collects NAKs after announcing the end of a pass
+MULTICAST_NAK_BACKOFF = 0.05 # receivers spread their NAKs over this many seconds
+MULTICAST_LINGER = 2.0 # quiet seconds (no NAKs, no receiver newly done) before the sender moves on
+MULTICAST_MAX_ROUNDS = 100 # repair rounds per file before the sender gives up
+MULTICAST_META_INTERVAL = 1.0 # seconds between file announcements, for receivers that join late
+MULTICAST_MAX_BLOCKS = 1 << 26 # blocks per file a receiver accepts (one byte of bookkeeping each); 87 GiB at 1400
+# Swarm distribution (`shuttle swarm-seed` / `swarm-get`): receivers fetch verified chunks from each other
+SWARM_PORT = 65433 # TCP port serving chunks; advertised through discovery with the have-bitfield
+SWARM_CHUNK_SIZE = 4 * 1024 * 1024 # bytes per SHA-256 verified chunk
+SWARM_DOWNLOADS = 4 # chunk downloads running at once per node
+SWARM_PEER_DOWNLOADS = 2 # of those, from any one peer
+SWARM_UPLOAD_SLOTS = 8 # chunk uploads served at once; further requests are told to come back later
+SWARM_TIMEOUT = 30 # seconds a chunk connection may stall
+SWARM_RETRY_AFTER = 2.0 # seconds before a peer that failed or was busy is asked again
+SWARM_MAX_STRIKES = 3 # corrupt chunks before a peer is ignored
+SWARM_LINGER = 10 # seconds a finished node keeps serving after the last request it got
+SWARM_ADVERTISE_INTERVAL = 1.0 # seconds between have-bitfield updates a node hands the daemon for discovery
+# Sharded sends (`shuttle shard host1,host2,... files`): each file goes to exactly one receiver
+SHARD_STRATEGIES = ('balanced', 'hash') # bytes spread by expected rate, or consistent hashing of the file name
+SHARD_VNODES = 64 # points per receiver on the hash ring
+SHARD_SLOW_FACTOR = 2.0 # a receiver this many times slower than the median is slow; idle ones take over its queue
+SHARD_MIN_SAMPLE = 1.0 # seconds a receiver must have been sending before its rate is trusted
+SHARD_MANIFEST = 'shard-manifest.json' # where each file went, written after the batch
@@ -0,0 +1,118 @@
+"""Client side of the daemon control socket, used by the CLI and the GUI."""
+
+import json
+import os
+import socket
+
+from .config import CONTROL_MAX_FDS, CONTROL_SOCKET, SYSTEM_CONTROL_SOCKET
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlClient:
+    """One connection to the daemon. Requests are answered in order on the same socket.
+
+    Without a `socket_path` it tries the user's own daemon, then the system one.
+    """
+
+    def __init__(self, socket_path=None, timeout=5):
+        candidates = [socket_path] if socket_path else list(dict.fromkeys((CONTROL_SOCKET, SYSTEM_CONTROL_SOCKET)))
+        for path in candidates:
+            self.socket_path = path
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            try:
+                self._sock.connect(path)
+                break
+            except OSError as e:
+                self._sock.close()
+                error = e
+        else:
+            raise ControlError(f"No daemon listening on {' or '.join(candidates)}: {error}") from error
+        self._reader = self._sock.makefile('rb')
+        self._subscribed = False
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+    def shutdown(self):
+        """Unblock a thread reading events from this connection."""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ControlError("Daemon closed the connection.")
+        return json.loads(line)
+
+    def request(self, cmd, fds=None, **fields):
+        """Send one request, with `fds` attached as SCM_RIGHTS ancillary data, and return the reply."""
+        fields['cmd'] = cmd
+        data = json.dumps(fields).encode('utf-8') + b'\n'
+        if fds:
+            self._send_fds(data, fds)
+        else:
+            self._sock.sendall(data)
+        reply = self._read()
+        if not reply.get('ok'):
+            raise ControlError(reply.get('error', "Request failed."))
+        return reply
+
+    def _send_fds(self, data, fds):
+        batches = [fds[i:i + CONTROL_MAX_FDS] for i in range(0, len(fds), CONTROL_MAX_FDS)]
+        for i, batch in enumerate(batches):
+            piece = data[i:i + 1] if i < len(batches) - 1 else data[i:] # one byte carries each earlier batch
+            sent = socket.send_fds(self._sock, [piece], batch)
+            self._sock.sendall(piece[sent:])
+
+    def enqueue(self, host, port, files, **fields):
+        """Queue a send on the daemon, handing it the files opened here, with this process's permissions."""
+        files = [os.path.abspath(path) for path in files] # the daemon has its own working directory
+        fds = []
+        try:
+            for path in files:
+                try:
+                    fds.append(os.open(path, os.O_RDONLY))
+                except OSError as e:
+                    raise ControlError(f"Cannot read '{path}': {e.strerror}") from e
+            return self.request('enqueue', fds=fds, host=host, port=port, files=files, **fields)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def subscribe(self):
+        """Switch this connection to event streaming; events queue up until read."""
+        if not self._subscribed:
+            self.request('subscribe')
+            self._sock.settimeout(None)
+            self._subscribed = True
+
+    def events(self):
+        """Yield events until the daemon stops, subscribing first if needed."""
+        self.subscribe()
+        while True:
+            try:
+                yield self._read()
+            except ControlError:
+                return
+
+
+def daemon_available(socket_path=None):
+    try:
+        with ControlClient(socket_path, timeout=0.5) as client:
+            client.request('status')
+        return True
+    except (ControlError, OSError, ValueError):
+        return False
@@ -0,0 +1,498 @@
+"""Resident daemon that owns the listeners and the send queue.
+
+One daemon per box binds the receiver and discovery ports and runs queued
+sends through a SendQueue (priorities, shortest job first, per-peer limits),
+so transfers keep going when a GUI window closes. Clients talk to it over a
+Unix socket with newline-delimited JSON requests. The socket lives in a
+directory only its owner can write to, with mode 0600, or 0660 for the
+CONTROL_GROUP when that group exists. Clients other than the daemon's user
+and root only see their own jobs, in replies and in events:
+
+* ``{"cmd": "enqueue", "host": ..., "port": ..., "files": [...], "priority": "high" | "normal" | "low",
+  "limit": bytes_per_second}`` with one descriptor per file, opened by the client, attached as
+  SCM_RIGHTS data; clients running as the daemon's user or root may send bare paths instead
+* ``{"cmd": "cancel", "job": id}``
+* ``{"cmd": "limits", "global": ..., "peer": ..., "transfer": ..., "peers": {host: rate | null},
+  "max_active": n, "max_per_peer": n}`` changes any of the given limits (rates in bytes/s, 0 for none)
+  and returns them all; ``"job": id, "limit": rate`` changes one job's limit
+* ``{"cmd": "status"}``, ``{"cmd": "peers"}`` and ``{"cmd": "metrics"}``
+* ``{"cmd": "trace", "action": "start" | "stop" | "dump" | "status"}`` (daemon's user and root)
+* ``{"cmd": "profile", "duration": seconds}`` starts a capture and returns its directory (daemon's user and root)
+* ``{"cmd": "swarm", "swarms": {id: {"port", "have", "seed"}}}`` adds a swarm node's entry to this host's
+  discovery responses, replacing the last one from the same connection, until the client disconnects
+* ``{"cmd": "subscribe"}`` streams ``{"event": ...}`` lines until the client disconnects
+
+Every reply carries ``"ok"``; failures add an ``"error"`` message.
+"""
+
+import collections
+import fcntl
+import grp
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+
+from .config import (CONTROL_GROUP, CONTROL_MAX_FDS, CONTROL_MAX_REQUEST, CONTROL_READ_SIZE, CONTROL_SOCKET,
+                     CONTROL_SUBSCRIBER_BACKLOG, DEFAULT_PORT, PROFILE_DURATION, RECEIVE_DIR)
+from .discovery import DeviceDiscovery, DiscoveryResponseServer, PeerCache, PeerRegistry, LinkMonitor
+from .events import EventEmitter
+from .metrics import METRICS
+from .profiling import ProfileCapture
+from .scheduler import JOB_EVENTS, SendQueue
+from .tracing import TRACE
+from .transfer import FileReceiver, relay_policy
+
+
+class DaemonError(Exception):
+    pass
+
+
+def privileged(uid):
+    """Whether a client with `uid` may see and change everything: the daemon's own user and root."""
+    return uid in (None, 0, os.getuid())
+
+
+class Subscriber:
+    """Bounded event queue for one attached client; the oldest events are dropped when it lags."""
+
+    def __init__(self, uid=None, backlog=CONTROL_SUBSCRIBER_BACKLOG):
+        self.uid = uid
+        self._events = collections.deque(maxlen=backlog)
+        self._ready = threading.Condition()
+        self.closed = False
+
+    def wants(self, audience):
+        return audience is None or privileged(self.uid) or audience == self.uid
+
+    def put(self, event):
+        with self._ready:
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        with self._ready:
+            if not self._events and not self.closed:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+def peer_uid(conn):
+    """UID of the process on the other end of a Unix socket, or None where unsupported."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+class ShuttleDaemon(EventEmitter):
+    """Owns the receiver, discovery and the send queue.
+
+    Every event is re-published to attached subscribers as ``{"event": name, ...}``,
+    to those allowed to see it.
+    """
+
+    def __init__(self, save_dir=RECEIVE_DIR, listen_ip='0.0.0.0', port=DEFAULT_PORT,
+                 socket_path=None, discovery=True, listeners=None, relay='off'):
+        super().__init__()
+        self.listeners = dict(listeners or {})
+        self.save_dir = os.path.abspath(save_dir)
+        self.listen_ip = listen_ip
+        self.port = port
+        self.socket_path = socket_path or CONTROL_SOCKET
+        self.discovery_enabled = discovery
+
+        self.registry = PeerRegistry()
+        self.link_monitor = LinkMonitor()
+        self.receiver = FileReceiver(listen_ip, port, self.save_dir, self.listeners.pop('tcp', None),
+                                     allow_relay=relay_policy(relay, self.registry))
+        self.discovery = None
+        self.response_server = None
+
+        self.send_queue = SendQueue()
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._swarms = {} # control connection -> the swarm advertisements it registered
+        self._swarms_lock = threading.Lock()
+        self._threads = []
+        self._server = None
+        self._is_running = False
+
+    # --- events ---
+
+    def publish(self, event, audience=None, **fields):
+        """Send an event to the subscribers; `audience` is the one client uid besides privileged ones that sees it."""
+        fields['event'] = event
+        fields['time'] = time.time()
+        with self._subscribers_lock:
+            subscribers = [subscriber for subscriber in self._subscribers if subscriber.wants(audience)]
+        for subscriber in subscribers:
+            subscriber.put(fields)
+        self.emit(event, fields)
+
+    def _publish_job_event(self, fields):
+        job = fields['job']
+        if isinstance(job, dict):
+            owner = job['owner']
+        else:
+            found = self.send_queue.get(job)
+            owner = found.owner if found else os.getuid()
+        self.publish(audience=owner, **fields) # fields carry the event name
+
+    def subscribe(self, uid=None):
+        subscriber = Subscriber(uid)
+        with self._subscribers_lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._subscribers_lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    # --- swarm nodes on this host ---
+
+    def advertise_swarms(self, client, swarms):
+        """Answer discovery with `swarms` on behalf of `client`, so swarm nodes need no responder of their own."""
+        if not isinstance(swarms, dict) or not all(isinstance(entry, dict) for entry in swarms.values()):
+            raise DaemonError("'swarms' must map swarm ids to advertisements.")
+        with self._swarms_lock:
+            self._swarms[client] = swarms
+
+    def withdraw_swarms(self, client):
+        with self._swarms_lock:
+            self._swarms.pop(client, None)
+
+    def swarm_advertisement(self):
+        with self._swarms_lock:
+            return {swarm: entry for swarms in self._swarms.values() for swarm, entry in swarms.items()}
+
+    # --- jobs ---
+
+    def enqueue(self, host, port, files, owner=None, priority='normal', limit=0, fds=None):
+        """Queue a send of `files`, read through `fds` when given (one per file, opened by the client).
+
+        The descriptors are what keep one user from sending another user's files:
+        the client opened them with its own permissions, so the daemon never opens
+        a path on behalf of anyone but itself or root. The caller keeps ownership
+        of `fds`; the job works on duplicates.
+        """
+        for path in files:
+            if not os.path.isabs(path):
+                raise DaemonError(f"'{path}' is relative; the daemon needs absolute paths.")
+        files = [os.path.normpath(path) for path in files]
+        sources = {}
+        if fds:
+            if len(fds) != len(files):
+                raise DaemonError(f"Got {len(fds)} descriptors for {len(files)} files.")
+            for path, fd in zip(files, fds):
+                if not stat.S_ISREG(os.fstat(fd).st_mode):
+                    raise DaemonError(f"'{path}' is not a regular file.")
+                if fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_ACCMODE == os.O_WRONLY:
+                    raise DaemonError(f"'{path}' was not opened for reading.")
+            for path, fd in zip(files, fds):
+                if path not in sources:
+                    sources[path] = os.dup(fd)
+        elif not privileged(owner):
+            raise DaemonError("Attach the open files to the request; the daemon only reads paths for its own user.")
+        else:
+            for path in files:
+                if not os.path.isfile(path):
+                    raise DaemonError(f"File '{path}' not found.")
+        try:
+            return self.send_queue.submit(host, port, files, priority, owner, limit, sources=sources)
+        except ValueError as e:
+            for fd in sources.values():
+                os.close(fd)
+            raise DaemonError(str(e)) from e
+
+    def cancel(self, job_id, requester=None):
+        job = self.send_queue.get(job_id)
+        if job is None:
+            raise DaemonError(f"No job {job_id}.")
+        if requester not in (None, 0, job.owner):
+            raise DaemonError("Only the owner of a job can cancel it.")
+        return self.send_queue.cancel(job)
+
+    def limits(self, requester=None, job=None, limit=None, global_rate=None, peer_rate=None,
+               transfer_rate=None, peer_rates=None, max_active=None, max_per_peer=None):
+        """Change the given limits and return all of them; daemon-wide ones are for its own user and root."""
+        rates = [rate for rate in (limit, global_rate, peer_rate, transfer_rate, *(peer_rates or {}).values())
+                 if rate is not None]
+        if any(rate < 0 for rate in rates):
+            raise DaemonError("A bandwidth limit cannot be negative.")
+        if job is not None:
+            found = self.send_queue.get(job)
+            if found is None:
+                raise DaemonError(f"No job {job}.")
+            if requester not in (None, 0, found.owner):
+                raise DaemonError("Only the owner of a job can change its limit.")
+            if limit is not None:
+                self.send_queue.set_job_limit(found, limit)
+        changes = (global_rate, peer_rate, transfer_rate, peer_rates, max_active, max_per_peer)
+        if any(value is not None for value in changes):
+            if not privileged(requester):
+                raise DaemonError("Only the daemon's user can change daemon-wide limits.")
+            if any(value is not None and value < 1 for value in (max_active, max_per_peer)):
+                raise DaemonError("Concurrency limits must be at least 1.")
+            self.send_queue.shaper.set_limits(global_rate, peer_rate, transfer_rate, peer_rates)
+            self.send_queue.set_limits(max_active, max_per_peer)
+        scheduler = self.send_queue.scheduler
+        return {'shaping': self.send_queue.shaper.snapshot(),
+                'max_active': scheduler.max_active, 'max_per_peer': scheduler.max_per_peer}
+
+    def status(self, requester=None):
+        """Daemon state, with only the requester's own jobs unless it is privileged."""
+        jobs = self.send_queue.jobs()
+        if not privileged(requester):
+            jobs = [job for job in jobs if job['owner'] == requester]
+        return {
+            'pid': os.getpid(),
+            'receiver': {'listen': self.listen_ip, 'port': self.port, 'save_dir': self.save_dir,
+                         'load': self.receiver.load()},
+            'jobs': jobs,
+            'scheduler': self.send_queue.scheduler.counts(),
+            'subscribers': len(self._subscribers)
+        }
+
+    def trace(self, action, requester=None):
+        """Switch the trace ring on or off, or dump it; dumps always go to TRACE_DIR."""
+        if not privileged(requester):
+            raise DaemonError("Only the daemon's user can trace it.")
+        if action == 'start':
+            TRACE.enable()
+        elif action == 'stop':
+            TRACE.disable()
+        elif action == 'dump':
+            return {'enabled': TRACE.enabled, 'events': len(TRACE), 'path': TRACE.dump()}
+        elif action != 'status':
+            raise DaemonError(f"Unknown trace action '{action}'.")
+        return {'enabled': TRACE.enabled, 'events': len(TRACE)}
+
+    def peers(self):
+        devices = self.registry.devices()
+        for device in devices:
+            device['capabilities'] = list(device['capabilities'])
+            device['link'] = self.link_monitor.get(device['ip'])
+        return devices
+
+    # --- lifecycle ---
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _bind_control_socket(self):
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        os.makedirs(directory, mode=0o755, exist_ok=True)
+        st = os.stat(directory)
+        if st.st_uid not in (0, os.getuid()) or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise DaemonError(f"{directory} is writable by other users; put the control socket somewhere only "
+                              f"the daemon's user can write (see SHUTTLE_CONTROL_SOCKET).")
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path) # stale socket from a crashed daemon
+            else:
+                raise DaemonError(f"A daemon is already listening on {self.socket_path}.")
+            finally:
+                probe.close()
+
+        umask = os.umask(0o177) # no window in which other users can connect
+        try:
+            self._server = ControlServer(self.socket_path, self)
+        finally:
+            os.umask(umask)
+        try:
+            os.chown(self.socket_path, -1, grp.getgrnam(CONTROL_GROUP).gr_gid)
+        except (KeyError, OSError):
+            return # no such group, or the daemon's user is not in it: owner only
+        os.chmod(self.socket_path, 0o660)
+
+    def start(self):
+        self._bind_control_socket()
+        self._is_running = True
+
+        for event in ('status_message', 'transfer_complete', 'server_started', 'progress_updated', 'rate_updated'):
+            self.receiver.on(event, lambda *args, event=event: self.publish(f"receiver_{event}", os.getuid(),
+                                                                            args=list(args)))
+        self._start_thread(self.receiver.run, 'receiver')
+
+        if self.discovery_enabled:
+            self.response_server = DiscoveryResponseServer(lambda: True, lambda: self.port,
+                                                           self.receiver.load, registry=self.registry,
+                                                           sock=self.listeners.pop('udp', None),
+                                                           swarm_callback=self.swarm_advertisement)
+            self.discovery = DeviceDiscovery(peer_cache=PeerCache(), link_monitor=self.link_monitor,
+                                             registry=self.registry)
+            self.registry.subscribe(lambda device: self.publish('peer_added', peer=_jsonable(device)),
+                                    lambda device: self.publish('peer_updated', peer=_jsonable(device)),
+                                    lambda device: self.publish('peer_removed', peer=_jsonable(device)))
+            self._start_thread(self.response_server.run, 'discovery-response')
+            self._start_thread(self.discovery.run, 'discovery')
+
+        for event in JOB_EVENTS:
+            self.send_queue.on(event, self._publish_job_event)
+        self.send_queue.start()
+        self._start_thread(self._server.serve_forever, 'control')
+        self.publish('daemon_started', pid=os.getpid())
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self._is_running:
+                time.sleep(1)
+                self.registry.expire()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if not self._is_running:
+            return
+        self._is_running = False
+        self.send_queue.stop()
+
+        self.receiver.stop()
+        if self.discovery:
+            self.discovery.stop()
+        if self.response_server:
+            self.response_server.stop()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        with self._subscribers_lock:
+            for subscriber in self._subscribers:
+                subscriber.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def _jsonable(device):
+    device = dict(device)
+    device['capabilities'] = list(device['capabilities'])
+    return device
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.daemon
+        uid = peer_uid(self.request)
+        for line, fds in self._requests():
+            try:
+                request = json.loads(line)
+                command = request.get('cmd')
+                if command == 'subscribe':
+                    self._stream_events(daemon, uid)
+                    return
+                reply = self._dispatch(daemon, command, request, uid, fds)
+            except (ValueError, KeyError, TypeError, OSError, DaemonError) as e:
+                reply = {'ok': False, 'error': str(e)}
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            self._send(reply)
+
+    def finish(self):
+        self.server.daemon.withdraw_swarms(self)
+        super().finish()
+
+    def _requests(self):
+        """Yield each request line with the descriptors that arrived along with it."""
+        buffer = b''
+        fds = []
+        while True:
+            try:
+                data, received, _, _ = socket.recv_fds(self.request, CONTROL_READ_SIZE, CONTROL_MAX_FDS)
+            except OSError:
+                data, received = b'', []
+            fds += received
+            if not data:
+                for fd in fds:
+                    os.close(fd)
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                request_fds, fds = fds, []
+                yield line, request_fds
+            if len(buffer) > CONTROL_MAX_REQUEST:
+                for fd in fds:
+                    os.close(fd)
+                self._send({'ok': False, 'error': "Request too long."})
+                return
+
+    def _dispatch(self, daemon, command, request, uid, fds=()):
+        if command == 'enqueue':
+            job = daemon.enqueue(request['host'], request.get('port', DEFAULT_PORT), request['files'], owner=uid,
+                                 priority=request.get('priority', 'normal'), limit=request.get('limit', 0),
+                                 fds=fds)
+            return {'ok': True, 'job': job.as_dict()}
+        if command == 'swarm':
+            daemon.advertise_swarms(self, request['swarms'])
+            return {'ok': True}
+        if command == 'cancel':
+            return {'ok': True, 'job': daemon.cancel(int(request['job']), requester=uid).as_dict()}
+        if command == 'limits':
+            return {'ok': True, **daemon.limits(uid, int(request['job']) if 'job' in request else None,
+                                                request.get('limit'),
+                                                request.get('global'), request.get('peer'),
+                                                request.get('transfer'), request.get('peers'),
+                                                request.get('max_active'), request.get('max_per_peer'))}
+        if command == 'status':
+            return {'ok': True, **daemon.status(uid)}
+        if command == 'peers':
+            return {'ok': True, 'peers': daemon.peers()}
+        if command == 'metrics':
+            return {'ok': True, 'text': METRICS.render(), **METRICS.snapshot()}
+        if command == 'trace':
+            return {'ok': True, **daemon.trace(request.get('action', 'status'), uid)}
+        if command == 'profile':
+            if not privileged(uid):
+                raise DaemonError("Only the daemon's user can profile it.")
+            capture = ProfileCapture(request.get('duration', PROFILE_DURATION))
+            try:
+                out_dir = capture.start()
+            except RuntimeError as e:
+                raise DaemonError(str(e)) from e
+            return {'ok': True, 'path': out_dir, 'duration': capture.duration}
+        raise DaemonError(f"Unknown command '{command}'.")
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def _stream_events(self, daemon, uid):
+        subscriber = daemon.subscribe(uid)
+        try:
+            self._send({'ok': True})
+            while not subscriber.closed:
+                event = subscriber.get(timeout=1)
+                if event is not None:
+                    self._send(event)
+        except OSError:
+            pass # client went away
+        finally:
+            daemon.unsubscribe(subscriber)
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        super().__init__(socket_path, ControlHandler)
@@ -0,0 +1,728 @@
+"""Qt-free peer discovery: broadcast/sweep probing, peer registry, cache and link estimates.
+
+Workers report through EventEmitter events:
+
+* DeviceDiscovery: ``device_found(ip, hostname, is_receiving, info)``,
+  ``link_updated(ip, link)``, ``status_update(str)``
+* DiscoveryResponseServer: ``device_discovered(ip, hostname, is_receiving, info)``,
+  ``status_update(str)``
+"""
+
+import heapq
+import ipaddress
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from .config import (DEFAULT_PORT, DISCOVERY_PORT, DISCOVERY_INTERVAL, DISCOVERY_MODE,
+                     DISCOVERY_SWEEP_CIDR, DISCOVERY_SWEEP_RATE, DISCOVERY_SWEEP_SLICE,
+                     DISCOVERY_SWEEP_MAX_MISSES, DISCOVERY_SWEEP_MAX_PREFIX, DEVICE_TIMEOUT,
+                     PEER_LOAD_UPDATE_INTERVAL, PEER_CACHE_FILE, PEER_CACHE_MAX_AGE, PROTOCOL_CAPABILITIES,
+                     AUTO_TARGET_DEFAULT_CAPACITY)
+from .events import EventEmitter
+from .net import MAX_DATAGRAM, get_local_ip, get_hostname, drain_datagrams
+from .tracing import TRACE
+
+class SubnetSweeper:
+    """Unicast discovery over a whole CIDR range for networks that filter broadcast.
+
+    The first round probes every host address; a sweep that is interrupted
+    picks it up where it stopped. Later rounds only re-probe hosts that
+    answered recently plus a rotating slice of the rest of the range.
+    """
+
+    def __init__(self, cidr, rate=DISCOVERY_SWEEP_RATE, slice_size=DISCOVERY_SWEEP_SLICE,
+                 max_misses=DISCOVERY_SWEEP_MAX_MISSES):
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.version != 4:
+            raise ValueError("only IPv4 ranges can be swept")
+        if network.prefixlen < DISCOVERY_SWEEP_MAX_PREFIX:
+            raise ValueError(f"larger than a /{DISCOVERY_SWEEP_MAX_PREFIX}")
+        if network.num_addresses > 2:
+            # Skip the network and broadcast addresses
+            self._first = int(network.network_address) + 1
+            self._count = network.num_addresses - 2
+        else:
+            self._first = int(network.network_address)
+            self._count = network.num_addresses
+        self.network = network
+        self.rate = rate
+        self.slice_size = slice_size
+        self.max_misses = max_misses
+        self._known = {} # ip -> rounds since the last reply
+        self._cursor = 0
+        self._swept_once = False
+
+    @property
+    def known_hosts(self):
+        return list(self._known)
+
+    def mark_responsive(self, ip):
+        if ip in self._known or self._contains(ip):
+            self._known[ip] = 0
+
+    def _contains(self, ip):
+        try:
+            return 0 <= int(ipaddress.IPv4Address(ip)) - self._first < self._count
+        except ValueError:
+            return False
+
+    def _address(self, index):
+        return str(ipaddress.IPv4Address(self._first + index))
+
+    def _first_round(self):
+        while self._cursor < self._count:
+            yield self._address(self._cursor)
+            self._cursor += 1 # only once the address was taken, so an interrupted sweep resumes there
+        self._cursor = 0
+        self._swept_once = True
+
+    def targets(self):
+        """Addresses to probe this round, as an iterator; the first round is generated as it goes."""
+        if not self._swept_once:
+            return self._first_round()
+
+        for ip in list(self._known):
+            self._known[ip] += 1
+            if self._known[ip] > self.max_misses:
+                del self._known[ip]
+
+        targets = list(self._known)
+        remaining = min(self.slice_size, self._count)
+        while remaining > 0:
+            ip = self._address(self._cursor)
+            self._cursor = (self._cursor + 1) % self._count
+            remaining -= 1
+            if ip not in self._known:
+                targets.append(ip)
+        return iter(targets)
+
+    def sweep(self, sock, message, port, on_reply, should_stop=None):
+        """Send `message` to every target at most `rate` per second.
+
+        `sock` must be non-blocking. Replies that arrive while the sweep is
+        running are handed to `on_reply(data, addr)` as they come in. The
+        sweep ends early once `should_stop()` is true; it is asked between
+        batches.
+        """
+        targets = self.targets()
+        target = next(targets, None)
+        start = time.monotonic()
+        sent = 0
+
+        while target is not None and not (should_stop and should_stop()):
+            allowed = int((time.monotonic() - start) * self.rate) + 1
+            while sent < allowed and target is not None:
+                try:
+                    sock.sendto(message, (target, port))
+                except BlockingIOError:
+                    select.select([], [sock], [], 0.05)
+                    break
+                except OSError:
+                    pass # unreachable hosts and the like
+                sent += 1
+                target = next(targets, None)
+
+            wait = (sent + 1) / self.rate - (time.monotonic() - start)
+            drain_datagrams(sock, on_reply, max(0.0, wait))
+
+        return sent
+
+class LinkEstimate:
+    """Smoothed RTT and capacity for one peer.
+
+    RTT is smoothed like TCP's SRTT/RTTVAR (RFC 6298); capacity samples from
+    TCP probes are averaged with an EWMA.
+    """
+
+    __slots__ = ('srtt', 'rttvar', 'capacity', 'updated')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.capacity = None # bytes per second
+        self.updated = 0.0
+
+    def add_rtt(self, sample):
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.updated = time.time()
+
+    def add_capacity(self, bytes_per_second):
+        if self.capacity is None:
+            self.capacity = bytes_per_second
+        else:
+            self.capacity = 0.5 * self.capacity + 0.5 * bytes_per_second
+        self.updated = time.time()
+
+    def as_dict(self):
+        return {
+            'rtt_ms': self.srtt * 1000 if self.srtt is not None else None,
+            'rttvar_ms': self.rttvar * 1000 if self.rttvar is not None else None,
+            'capacity_mbps': self.capacity / (1024*1024) if self.capacity is not None else None
+        }
+
+class LinkMonitor:
+    """Thread-safe map of peer IP -> LinkEstimate shared by discovery and probes."""
+
+    def __init__(self):
+        self._links = {}
+        self._lock = threading.Lock()
+
+    def _link(self, ip):
+        link = self._links.get(ip)
+        if link is None:
+            link = self._links[ip] = LinkEstimate()
+        return link
+
+    def add_rtt(self, ip, seconds):
+        with self._lock:
+            link = self._link(ip)
+            link.add_rtt(seconds)
+            return link.as_dict()
+
+    def add_capacity(self, ip, bytes_per_second):
+        with self._lock:
+            link = self._link(ip)
+            link.add_capacity(bytes_per_second)
+            return link.as_dict()
+
+    def get(self, ip):
+        with self._lock:
+            link = self._links.get(ip)
+            return link.as_dict() if link else None
+
+    def forget(self, ip):
+        with self._lock:
+            self._links.pop(ip, None)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _load_value(load, key, default=None):
+    """A non-negative number from a peer's advertised load, or `default`; loads come off the wire."""
+    value = load.get(key) if isinstance(load, dict) else None
+    if not _is_number(value) or not 0 <= value < float('inf'):
+        return default
+    return value
+
+def expected_rate(device, link_monitor=None):
+    """Bytes/s a new transfer to `device` can expect.
+
+    The measured capacity (AUTO_TARGET_DEFAULT_CAPACITY if it was never
+    probed) minus current inbound traffic, but never less than a fair share
+    among the receiver's active transfers.
+    """
+    load = device.get('load')
+    link = link_monitor.get(device['ip']) if link_monitor else None
+    capacity = AUTO_TARGET_DEFAULT_CAPACITY
+    if link and link['capacity_mbps'] is not None:
+        capacity = link['capacity_mbps'] * 1024 * 1024
+    fair_share = capacity / (_load_value(load, 'active_transfers', 0) + 1)
+    return max(capacity - _load_value(load, 'inbound_bps', 0), fair_share)
+
+def select_auto_target(devices, total_bytes, link_monitor=None):
+    """Pick the receiver expected to finish `total_bytes` soonest, or None.
+
+    Only devices that are receiving, speak the JSON metadata protocol and have
+    room for the batch qualify; they are ranked by `expected_rate`.
+    """
+    best_device, best_score = None, None
+    for device in devices:
+        if not device.get('is_receiving'):
+            continue
+        capabilities = device.get('capabilities')
+        if not isinstance(capabilities, (list, tuple)) or 'json-metadata' not in capabilities:
+            continue
+
+        free_bytes = _load_value(device.get('load'), 'free_bytes')
+        if free_bytes is not None and free_bytes < total_bytes:
+            continue
+
+        link = link_monitor.get(device['ip']) if link_monitor else None
+        score = total_bytes / expected_rate(device, link_monitor)
+        if link and link['rtt_ms'] is not None:
+            score += link['rtt_ms'] / 1000
+
+        if best_score is None or score < best_score:
+            best_device, best_score = device, score
+    return best_device
+
+class PeerCache:
+    """Peers seen on earlier runs, persisted so discovery can warm-start.
+
+    Entries carry IP, hostname, port, capabilities and the last time the peer
+    answered. Entries older than `max_age` are dropped on load and save.
+    """
+
+    def __init__(self, path=PEER_CACHE_FILE, max_age=PEER_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._peers = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+
+        with self._lock:
+            self._peers = {}
+            for entry in entries if isinstance(entries, list) else []:
+                # Hand-edited or foreign files: skip entries _expire() and the probes cannot use
+                if (isinstance(entry, dict) and isinstance(entry.get('ip'), str)
+                        and _is_number(entry.get('last_seen'))):
+                    self._peers[entry['ip']] = entry
+            self._expire()
+        return self.peers()
+
+    def _expire(self):
+        cutoff = time.time() - self.max_age
+        for ip in [ip for ip, entry in self._peers.items() if entry.get('last_seen', 0) < cutoff]:
+            del self._peers[ip]
+            self._dirty = True
+
+    def peers(self):
+        with self._lock:
+            return [dict(entry) for entry in self._peers.values()]
+
+    def update(self, ip, hostname, port=DEFAULT_PORT, capabilities=None, last_seen=None):
+        with self._lock:
+            self._peers[ip] = {
+                'ip': ip,
+                'hostname': hostname,
+                'port': port,
+                'last_seen': last_seen if last_seen is not None else time.time(),
+                'capabilities': list(capabilities or [])
+            }
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            self._expire()
+            if not self._dirty:
+                return
+            entries = list(self._peers.values())
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+
+class PeerRecord:
+    __slots__ = ('ip', 'hostname', 'is_receiving', 'port', 'capabilities', 'load', 'swarms', 'last_seen')
+
+    def __init__(self, ip, hostname, is_receiving, port, capabilities, load, last_seen, swarms=None):
+        self.ip = ip
+        self.hostname = hostname
+        self.is_receiving = is_receiving
+        self.port = port
+        self.capabilities = capabilities
+        self.load = load
+        self.swarms = swarms or {} # swarm id -> {'port', 'have', 'seed'}, see swarm.py
+        self.last_seen = last_seen
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class PeerRegistry:
+    """The one table of live peers, keyed by IP and shared by all discovery threads.
+
+    Expiry runs off a min-heap of deadlines, so each tick only looks at peers
+    that are actually due. Stale heap entries left behind by refreshes are
+    skipped when popped. Listeners get add/update/remove diffs; updates are
+    only reported when a displayed field, the capabilities or the number of
+    active transfers change, or when the rest of the load changed and the
+    last report is `load_interval` seconds old.
+    """
+
+    def __init__(self, timeout=DEVICE_TIMEOUT, load_interval=PEER_LOAD_UPDATE_INTERVAL):
+        self.timeout = timeout
+        self.load_interval = load_interval
+        self._records = {}
+        self._reported = {} # ip -> when its last diff went out
+        self._heap = [] # (deadline, ip)
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, on_added, on_updated, on_removed):
+        self._listeners.append((on_added, on_updated, on_removed))
+
+    def __len__(self):
+        return len(self._records)
+
+    def ips(self):
+        with self._lock:
+            return list(self._records)
+
+    def get(self, ip):
+        with self._lock:
+            record = self._records.get(ip)
+            return record.as_dict() if record else None
+
+    def devices(self):
+        with self._lock:
+            return [record.as_dict() for record in self._records.values()]
+
+    def update(self, ip, hostname, is_receiving=None, info=None, now=None):
+        """Add or refresh a peer. `is_receiving=None` keeps the last known state."""
+        now = time.time() if now is None else now
+        info = info or {}
+        with self._lock:
+            record = self._records.get(ip)
+            if is_receiving is None:
+                is_receiving = record.is_receiving if record else False
+            if record is None:
+                record = PeerRecord(ip, hostname, is_receiving, info.get('port', DEFAULT_PORT),
+                                    tuple(info.get('capabilities', ())), info.get('load', {}), now,
+                                    info.get('swarms'))
+                self._records[ip] = record
+                change = 0
+            else:
+                load = info.get('load', record.load)
+                changed = (record.hostname != hostname or record.is_receiving != is_receiving
+                           or ('port' in info and record.port != info['port'])
+                           or ('capabilities' in info and record.capabilities != tuple(info['capabilities']))
+                           or _load_value(load, 'active_transfers') != _load_value(record.load, 'active_transfers')
+                           or (load != record.load and now - self._reported.get(ip, 0) >= self.load_interval))
+                record.hostname = hostname
+                record.is_receiving = is_receiving
+                if 'port' in info:
+                    record.port = info['port']
+                if 'capabilities' in info:
+                    record.capabilities = tuple(info['capabilities'])
+                if 'load' in info:
+                    record.load = info['load']
+                if 'swarms' in info:
+                    record.swarms = info['swarms']
+                record.last_seen = now
+                change = 1 if changed else None
+            if change is not None:
+                self._reported[ip] = now
+
+            heapq.heappush(self._heap, (now + self.timeout, ip))
+            if len(self._heap) > 4 * len(self._records) + 64:
+                self._compact()
+            snapshot = record.as_dict()
+
+        if change is not None:
+            for listener in self._listeners:
+                listener[change](snapshot)
+
+    def _compact(self):
+        self._heap = [(record.last_seen + self.timeout, ip) for ip, record in self._records.items()]
+        heapq.heapify(self._heap)
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, ip = heapq.heappop(self._heap)
+                record = self._records.get(ip)
+                # Only the entry matching the latest refresh counts
+                if record is not None and record.last_seen + self.timeout <= deadline:
+                    del self._records[ip]
+                    self._reported.pop(ip, None)
+                    removed.append(record.as_dict())
+
+        for snapshot in removed:
+            for listener in self._listeners:
+                listener[2](snapshot)
+        return removed
+
+    def remove(self, ip):
+        """Drop one peer at once, e.g. when another registry has expired it."""
+        with self._lock:
+            record = self._records.pop(ip, None)
+            self._reported.pop(ip, None)
+        if record is None:
+            return None
+        snapshot = record.as_dict()
+        for listener in self._listeners:
+            listener[2](snapshot)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            removed = [record.as_dict() for record in self._records.values()]
+            self._records.clear()
+            self._reported.clear()
+            self._heap.clear()
+        for snapshot in removed:
+            for listener in self._listeners:
+                listener[2](snapshot)
+
+class DeviceDiscovery(EventEmitter):
+    def __init__(self, mode=DISCOVERY_MODE, sweep_cidr=DISCOVERY_SWEEP_CIDR, peer_cache=None,
+                 link_monitor=None, registry=None, sock=None):
+        super().__init__()
+        self._sock = sock # optional pre-bound UDP socket, e.g. one per simulated host
+        self.link_monitor = link_monitor or LinkMonitor()
+        self.registry = registry if registry is not None else PeerRegistry()
+        self._pending_pings = {} # nonce -> (ip, monotonic send time)
+        self._next_nonce = 0
+        self._is_running = False
+        self.mode = mode
+        self.sweep_cidr = sweep_cidr
+        self.peer_cache = peer_cache
+        self._sweeper = None
+        self._refresh_requested = False
+
+    def request_refresh(self):
+        self._refresh_requested = True
+
+    def _handle_reply(self, data, addr):
+        try:
+            reply = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return
+        if reply.get('type') == 'PONG':
+            self._handle_pong(reply, addr)
+            return
+        if reply.get('type') != 'DISCOVERY_RESPONSE':
+            return
+
+        ip = addr[0]
+        TRACE.instant('discovery_reply', 'discovery', {'ip': ip})
+        if self._sweeper:
+            self._sweeper.mark_responsive(ip)
+        if ip != get_local_ip():
+            hostname = reply.get('sender_hostname', 'Unknown')
+            info = {
+                'port': reply.get('port', DEFAULT_PORT),
+                'capabilities': reply.get('capabilities', []),
+                'load': reply.get('load', {}),
+                'swarms': reply.get('swarms', {})
+            }
+            is_receiving = reply.get('is_receiving', False)
+            self.registry.update(ip, hostname, is_receiving, info)
+            if self.peer_cache:
+                self.peer_cache.update(ip, hostname, info['port'], info['capabilities'])
+            self.emit('device_found', ip, hostname, is_receiving, info)
+
+    def _handle_pong(self, reply, addr):
+        pending = self._pending_pings.pop(reply.get('nonce'), None)
+        if pending is None or pending[0] != addr[0]:
+            return
+        rtt = time.monotonic() - pending[1]
+        self.emit('link_updated', addr[0], self.link_monitor.add_rtt(addr[0], rtt))
+
+    def _send_pings(self, sock):
+        """UDP echo to every device seen recently; replies feed the RTT estimate."""
+        now = time.monotonic()
+        for nonce in [n for n, (_, sent) in self._pending_pings.items() if now - sent > DEVICE_TIMEOUT]:
+            del self._pending_pings[nonce]
+
+        for ip in self.registry.ips():
+            self._next_nonce += 1
+            message = json.dumps({'type': 'PING', 'nonce': self._next_nonce}).encode('utf-8')
+            try:
+                sock.sendto(message, (ip, DISCOVERY_PORT))
+                self._pending_pings[self._next_nonce] = (ip, time.monotonic())
+            except OSError:
+                pass
+
+    def _discovery_message(self):
+        return json.dumps({
+            'type': 'DISCOVERY_REQUEST',
+            'sender_ip': get_local_ip(),
+            'sender_hostname': get_hostname(),
+            'timestamp': time.time()
+        }).encode('utf-8')
+
+    def _probe_known_peers(self, sock):
+        """Unicast a request to every cached peer so known devices show up immediately."""
+        if not self.peer_cache:
+            return
+        message = self._discovery_message()
+        for peer in self.peer_cache.peers():
+            try:
+                sock.sendto(message, (peer['ip'], DISCOVERY_PORT))
+            except OSError:
+                pass
+
+    def run(self):
+        self._is_running = True
+        self.emit('status_update', "Network Discovery started...")
+
+        sock = self._sock
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setblocking(False)
+
+        if self.mode == 'sweep':
+            cidr = self.sweep_cidr or f"{get_local_ip()}/24"
+            try:
+                self._sweeper = SubnetSweeper(cidr)
+                self.emit('status_update', f"Sweeping {self._sweeper.network} ({self._sweeper.rate} probes/s)")
+            except ValueError as e:
+                self.emit('status_update', f"Invalid sweep range '{cidr}': {e}. Falling back to broadcast.")
+
+        if self.peer_cache:
+            cached = self.peer_cache.load()
+            if cached:
+                self.emit('status_update', f"Probing {len(cached)} cached peer(s)...")
+            self._probe_known_peers(sock)
+
+        while self._is_running:
+            try:
+                message = self._discovery_message()
+                round_start = time.monotonic()
+                trace_start = time.perf_counter()
+                
+                if self._sweeper:
+                    self._sweeper.sweep(sock, message, DISCOVERY_PORT, self._handle_reply,
+                                        lambda: not self._is_running or self._refresh_requested)
+                else:
+                    # Send broadcast to the local network
+                    sock.sendto(message, ('<broadcast>', DISCOVERY_PORT))
+
+                for record in self.registry.expire():
+                    self.link_monitor.forget(record['ip'])
+                    TRACE.instant('peer_expired', 'discovery', {'ip': record['ip']})
+
+                self._send_pings(sock)
+                TRACE.complete('discovery_probe', 'discovery', trace_start, args={'peers': len(self.registry)})
+
+                # Collect replies until the next round is due or a refresh is requested
+                while self._is_running and not self._refresh_requested:
+                    remaining = DISCOVERY_INTERVAL - (time.monotonic() - round_start)
+                    if remaining <= 0:
+                        break
+                    drain_datagrams(sock, self._handle_reply, min(remaining, 0.25))
+
+                if self._refresh_requested:
+                    self._refresh_requested = False
+                    self._probe_known_peers(sock)
+
+                if self.peer_cache:
+                    self.peer_cache.save()
+
+            except Exception as e:
+                self.emit('status_update', f"Discovery Error: {e}")
+                time.sleep(1)
+
+        sock.close()
+        if self.peer_cache:
+            self.peer_cache.save()
+        self.emit('status_update', "Discovery stopped.")
+
+    def stop(self):
+        self._is_running = False
+
+class DiscoveryResponseServer(EventEmitter):
+    def __init__(self, is_receiving_callback, port_callback=None, load_callback=None, registry=None,
+                 sock=None, swarm_callback=None):
+        super().__init__()
+        self.registry = registry
+        self._sock = sock
+        self._is_running = False
+        self.is_receiving_callback = is_receiving_callback
+        self.port_callback = port_callback or (lambda: DEFAULT_PORT)
+        self.load_callback = load_callback or (lambda: {})
+        self.swarm_callback = swarm_callback # have-bitfields of the swarms this host takes part in
+
+    def run(self):
+        self._is_running = True
+        
+        sock = self._sock
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        try:
+            if self._sock is None:
+                sock.bind(('', DISCOVERY_PORT))
+            sock.settimeout(1)
+            self.emit('status_update', "Discovery Response Server started.")
+            
+            while self._is_running:
+                try:
+                    data, addr = sock.recvfrom(MAX_DATAGRAM)
+                    sender_ip = addr[0]
+                    
+                    try:
+                        discovery_data = json.loads(data.decode('utf-8'))
+                        
+                        if discovery_data.get('type') == 'DISCOVERY_REQUEST':
+                            TRACE.instant('discovery_request', 'discovery', {'ip': sender_ip})
+                            local_ip = get_local_ip()
+                            hostname = get_hostname()
+                            
+                            response_data = {
+                                'type': 'DISCOVERY_RESPONSE',
+                                'sender_ip': local_ip,
+                                'sender_hostname': hostname,
+                                'is_receiving': self.is_receiving_callback(),
+                                'port': self.port_callback(),
+                                'capabilities': PROTOCOL_CAPABILITIES,
+                                'load': self.load_callback(),
+                                'timestamp': time.time()
+                            }
+                            if self.swarm_callback:
+                                response_data['swarms'] = self.swarm_callback()
+                            
+                            response = json.dumps(response_data).encode('utf-8')
+                            sock.sendto(response, addr)
+                            
+                            if sender_ip != local_ip:
+                                sender_hostname = discovery_data.get('sender_hostname', 'Unknown')
+                                if self.registry is not None:
+                                    self.registry.update(sender_ip, sender_hostname)
+                                self.emit('device_discovered', sender_ip, sender_hostname, False, {})
+                        
+                        elif discovery_data.get('type') == 'PING':
+                            pong = {'type': 'PONG', 'nonce': discovery_data.get('nonce')}
+                            sock.sendto(json.dumps(pong).encode('utf-8'), addr)
+                        
+                        elif discovery_data.get('type') == 'DISCOVERY_RESPONSE':
+                            sender_hostname = discovery_data.get('sender_hostname', 'Unknown')
+                            is_receiving = discovery_data.get('is_receiving', False)
+                            
+                            if sender_ip != get_local_ip():
+                                info = {
+                                    'port': discovery_data.get('port', DEFAULT_PORT),
+                                    'capabilities': discovery_data.get('capabilities', []),
+                                    'load': discovery_data.get('load', {}),
+                                    'swarms': discovery_data.get('swarms', {})
+                                }
+                                if self.registry is not None:
+                                    self.registry.update(sender_ip, sender_hostname, is_receiving, info)
+                                self.emit('device_discovered', sender_ip, sender_hostname, is_receiving, info)
+                    
+                    except json.JSONDecodeError:
+                        pass
+                        
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    if self._is_running:
+                        self.emit('status_update', f"Response Server Error: {e}")
+                        
+        except Exception as e:
+            self.emit('status_update', f"Could not start Discovery Response Server: {e}")
+        finally:
+            sock.close()
+            self.emit('status_update', "Discovery Response Server stopped.")
+
+    def stop(self):
+        self._is_running = False
@@ -0,0 +1,25 @@
+"""Plain-Python event interface used by the transfer and discovery workers."""
+
+
+class EventEmitter:
+    """Minimal observer: register handlers with `on()`, fire them with `emit()`.
+
+    Handlers run synchronously on the thread that emits. Front ends that need
+    the events elsewhere (e.g. the Qt GUI thread) forward them themselves.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def on(self, event, handler):
+        self._handlers.setdefault(event, []).append(handler)
+        return handler
+
+    def off(self, event, handler):
+        handlers = self._handlers.get(event, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def emit(self, event, *args):
+        for handler in self._handlers.get(event, ()):
+            handler(*args)
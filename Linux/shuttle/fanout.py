@@ -0,0 +1,355 @@
+"""One-to-many send: every file is read from disk once and streamed to all targets.
+
+FanoutSender opens one connection per target for each file and feeds them
+from a ring of `window` shared blocks of `block_size` bytes. The calling
+thread reads the file into the ring; one writer thread per target sends
+the blocks in order, each with its own cursor, and goes on to the next file
+as soon as it is done with one. A block is only overwritten
+once every writer still attached to the ring has sent it, so the fastest
+target runs at most `window` blocks ahead of the slowest.
+
+A slow target would hold everyone else to its pace, so when the ring is
+full and the fastest writer is a whole window ahead of the slowest for
+`detach_after` seconds, the writers at the tail are detached: each
+finishes its current block, leaves the ring and sends the rest of the file
+with sendfile() from its own file handle and offset (usually straight from
+the page cache the ring's reads just filled). The ring moves on at the pace
+of the remaining targets, and a target still busy with an earlier file
+when the next one starts sends that one on its own as well.
+
+A target that fails is reported and skipped for the rest of the batch; the
+others carry on. FanoutSender emits the same events as FileSender, with
+progress and rate over the bytes delivered to all targets together.
+"""
+
+import os
+import threading
+import time
+
+from .config import FANOUT_BLOCK_SIZE, FANOUT_DETACH_AFTER, FANOUT_WINDOW, SENDFILE_MIN_SLICE
+from .events import EventEmitter
+from .metrics import METRICS, PhaseTimer
+from .rate import RateEstimator, format_rate
+from .tracing import TRACE
+from .transfer import open_send_connection, send_error_message
+
+
+class _Ring:
+    """Blocks of one file in `window` reusable buffers, with the send cursor of every attached target."""
+
+    def __init__(self, slots, nblocks):
+        self.slots = slots
+        self.lengths = [0] * len(slots)
+        self.nblocks = nblocks
+        self.head = 0 # blocks read so far
+        self.cursors = {} # target -> next block it sends, while it is fed from the ring
+        self.detaching = set() # targets asked to leave the ring after their current block
+        self.aborted = False
+        self.changed = threading.Condition()
+
+    def lag(self):
+        return self.head - min(self.cursors.values()) if self.cursors else 0
+
+
+class FanoutSender(EventEmitter):
+    """Sends a list of files to several `targets` ((host, port) pairs), reading each file once."""
+
+    def __init__(self, targets, file_queue, block_size=FANOUT_BLOCK_SIZE, window=FANOUT_WINDOW,
+                 detach_after=FANOUT_DETACH_AFTER, metrics=METRICS, shaper=None):
+        super().__init__()
+        self.targets = [(host, int(port)) for host, port in targets]
+        self.file_queue = file_queue.copy()
+        self.block_size = block_size
+        self.window = window
+        self.detach_after = detach_after
+        self.metrics = metrics
+        self.shaper = shaper # with a Shaper, every target gets a flow of its own
+        self.failed = {} # target -> message; failed targets are skipped for the rest of the batch
+        self.detached = 0 # target-files that finished from their own read cursor
+        self.rate = RateEstimator()
+        self._flows = {}
+        self._pending = {} # target -> bytes still to deliver in this batch
+        self._progress = 0
+        self._rings = [] # one per file, appended by the reading thread
+        self._position = {} # target -> index of the file it is on
+        self._closed = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def run(self):
+        missing = [path for path in self.file_queue if not os.path.isfile(path)]
+        if missing:
+            self.emit('transfer_complete', False, f"File '{missing[0]}' not found.")
+            return
+        self.emit('status_message', f"Starting transfer to {len(self.targets)} target(s)...")
+        batch = sum(os.path.getsize(path) for path in self.file_queue)
+        self.rate = RateEstimator(batch * len(self.targets))
+        self._pending = dict.fromkeys(self.targets, batch)
+        self._flows = {target: self.shaper.flow(target[0]) for target in self.targets} if self.shaper else {}
+        self._rings = []
+        self._position = dict.fromkeys(self.targets, 0)
+        self._closed = False
+        writers = [threading.Thread(target=self._serve, args=(target,), name=f'fanout-{target[0]}:{target[1]}',
+                                    daemon=True)
+                   for target in self.targets]
+        for writer in writers:
+            writer.start()
+        slots = [bytearray(self.block_size) for _ in range(self.window)]
+
+        try:
+            for i, filepath in enumerate(self.file_queue):
+                if not self._is_running:
+                    break
+                ring = self._open_ring(i, filepath, slots)
+                if ring is None:
+                    break # every target has failed
+                solo = len(self._live()) - len(ring.cursors)
+                self.emit('status_message', f"Sending file {i+1}/{len(self.file_queue)}: {os.path.basename(filepath)} "
+                                            f"to {len(ring.cursors)} target(s)" + (f", {solo} on their own" if solo else ""))
+                self._read_file(filepath, ring, last=i == len(self.file_queue) - 1)
+        finally:
+            with self._changed:
+                self._closed = True # writers waiting for a file that will not be read give up
+                self._changed.notify_all()
+            for writer in writers:
+                writer.join()
+            for flow in self._flows.values():
+                flow.close()
+
+        if not self._is_running:
+            return
+        if self.failed:
+            details = "; ".join(f"{host}:{port}: {message}" for (host, port), message in self.failed.items())
+            self.emit('transfer_complete', False,
+                      f"{len(self.failed)} of {len(self.targets)} target(s) failed: {details}")
+        else:
+            self.emit('transfer_complete', True, f"All files sent to {len(self.targets)} target(s)!")
+
+    def _live(self):
+        return [target for target in self.targets if target not in self.failed]
+
+    def _open_ring(self, index, filepath, slots):
+        """Publish the ring for file `index`, attaching every target that is ready for it."""
+        filesize = os.path.getsize(filepath)
+        ring = _Ring(slots, -(-filesize // self.block_size))
+        deadline = time.monotonic() + self.detach_after
+        with self._changed:
+            # Targets still finishing the previous file on their own get a moment to catch up
+            while any(self._position[target] < index for target in self._live()) and self._is_running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            live = self._live()
+            if not live:
+                return None
+            ring.cursors = {target: 0 for target in live if self._position[target] == index}
+            self._rings.append(ring)
+            self._changed.notify_all()
+        return ring
+
+    def _read_file(self, filepath, ring, last=False):
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        try:
+            with open(filepath, 'rb') as f:
+                timer.lap('read') # opening the source file
+                self._read_blocks(f, ring, timer)
+            if not last:
+                self._drain(ring)
+                timer.lap('wait')
+        except OSError as e:
+            self.emit('status_message', f"Error reading '{filepath}': {e}")
+        finally:
+            with ring.changed:
+                if ring.head < ring.nblocks and ring.cursors:
+                    ring.aborted = True # writers still on the ring cannot finish
+                    ring.changed.notify_all()
+                    while ring.cursors:
+                        ring.changed.wait(0.05)
+            self.metrics.record('send', 'fanout', timer, not ring.aborted)
+            TRACE.complete('fanout_read', 'sender', trace_start,
+                           args={'file': os.path.basename(filepath), 'bytes': min(ring.head * self.block_size,
+                                                                                 os.path.getsize(filepath))})
+
+    def _drain(self, ring):
+        """Wait until no writer uses the ring's buffers, so the next file can reuse them.
+
+        Writers still sending when others are done and have waited `detach_after`
+        seconds for the next file finish this one on their own.
+        """
+        attached = len(ring.cursors)
+        waiting_since = None
+        with ring.changed:
+            while ring.cursors and self._is_running:
+                if len(ring.cursors) < attached and waiting_since is None:
+                    waiting_since = time.monotonic()
+                if waiting_since is not None and time.monotonic() - waiting_since >= self.detach_after:
+                    self._detach_tail(ring, everyone=True)
+                ring.changed.wait(0.05)
+
+    def _read_blocks(self, f, ring, timer):
+        window = len(ring.slots)
+        full_since = None
+        while ring.head < ring.nblocks and self._is_running:
+            with ring.changed:
+                if ring.lag() < window - 1:
+                    full_since = None # not gated by anyone
+                while ring.cursors and ring.lag() >= window and self._is_running:
+                    cursors = ring.cursors.values()
+                    if max(cursors) - min(cursors) < window - 1:
+                        full_since = None # all targets equally slow: the uplink is the limit, not one of them
+                    elif full_since is None:
+                        full_since = time.monotonic()
+                    elif time.monotonic() - full_since >= self.detach_after:
+                        self._detach_tail(ring)
+                        full_since = None
+                    ring.changed.wait(0.05)
+                if not ring.cursors:
+                    return # every target is detached or failed
+                slot = ring.head % window
+            timer.lap('wait')
+
+            # Every attached writer is past the block this slot held, so it can be refilled unlocked
+            n = f.readinto(ring.slots[slot])
+            timer.lap('read', n)
+            if not n:
+                raise OSError("file shrank while it was being sent")
+            with ring.changed:
+                ring.lengths[slot] = n
+                ring.head += 1
+                ring.changed.notify_all()
+
+    def _detach_tail(self, ring, everyone=False):
+        tail = min(ring.cursors.values())
+        for target, cursor in ring.cursors.items():
+            if (everyone or cursor == tail) and target not in ring.detaching:
+                ring.detaching.add(target)
+                self.emit('status_message', f"{target[0]}:{target[1]} is {ring.head - cursor} blocks behind; "
+                                            f"it continues from its own read cursor")
+
+    def _serve(self, target):
+        """Writer thread of one target: sends it every file in turn, from the rings or on its own."""
+        for i, filepath in enumerate(self.file_queue):
+            with self._changed:
+                self._position[target] = i
+                self._changed.notify_all()
+                while len(self._rings) <= i and not self._closed:
+                    self._changed.wait()
+                if len(self._rings) <= i:
+                    return
+                ring = self._rings[i]
+            if not self._feed(target, filepath, ring):
+                return
+
+    def _leave(self, ring, target):
+        with ring.changed:
+            ring.cursors.pop(target, None)
+            ring.changed.notify_all()
+
+    def _feed(self, target, filepath, ring):
+        """Send one file to one target; returns False once the target has failed."""
+        host, port = target
+        filesize = os.path.getsize(filepath)
+        flow = self._flows.get(target)
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        bytes_sent = 0
+        solo = target not in ring.cursors # it was still busy with the previous file when this one started
+        success = False
+        try:
+            with open_send_connection(host, port, os.path.basename(filepath), filesize, timer) as s:
+                cursor = 0
+                while cursor < ring.nblocks and not solo:
+                    with ring.changed:
+                        while cursor >= ring.head and not ring.aborted and self._is_running:
+                            ring.changed.wait(0.5)
+                        if target in ring.detaching:
+                            solo = True
+                            break
+                        if not self._is_running:
+                            raise ConnectionAbortedError("Transfer stopped.")
+                        if ring.aborted:
+                            raise ConnectionAbortedError("The source file could not be read.")
+                        slot = cursor % len(ring.slots)
+                        block = memoryview(ring.slots[slot])[:ring.lengths[slot]]
+                    timer.lap('wait')
+                    if flow:
+                        flow.throttle(len(block))
+                        timer.lap('shape')
+                    s.sendall(block)
+                    timer.lap('send', len(block))
+                    sent = len(block)
+                    block.release()
+                    cursor += 1
+                    bytes_sent += sent
+                    with ring.changed:
+                        ring.cursors[target] = cursor
+                        ring.changed.notify_all()
+                    self._delivered(target, sent)
+                    timer.lap('progress')
+                self._leave(ring, target)
+
+                if solo:
+                    with self._lock:
+                        self.detached += 1
+                    bytes_sent = self._send_solo(s, target, filepath, filesize, bytes_sent, timer)
+                if bytes_sent < filesize:
+                    raise ConnectionAbortedError("Transfer stopped.")
+                success = True
+        except Exception as e:
+            message = send_error_message(e, host, port)
+            with self._lock:
+                self.failed.setdefault(target, message)
+                if self.rate.total is not None:
+                    self.rate.total -= self._pending[target] # it will never arrive; keep the batch percent honest
+                self._pending[target] = 0
+            if self._is_running:
+                self.emit('status_message', f"{host}:{port} failed: {message}")
+        finally:
+            with self._changed:
+                self._changed.notify_all() # the reader may be waiting for this target
+            self._leave(ring, target)
+            if 'connect' in timer.phases:
+                timer.lap('close')
+            self.metrics.record('send', host, timer, success)
+            TRACE.complete('send_file', 'sender', trace_start,
+                           args={'file': os.path.basename(filepath), 'peer': host, 'bytes': bytes_sent,
+                                 'ok': success, 'solo': solo})
+        return success
+
+    def _send_solo(self, s, target, filepath, filesize, bytes_sent, timer):
+        flow = self._flows.get(target)
+        with open(filepath, 'rb') as f:
+            timer.lap('read') # opening the private file handle
+            while bytes_sent < filesize and self._is_running:
+                count = min(SENDFILE_MIN_SLICE, filesize - bytes_sent)
+                if flow:
+                    count = min(count, flow.quantum() or count)
+                    flow.throttle(count)
+                    timer.lap('shape')
+                sent = s.sendfile(f, bytes_sent, count)
+                timer.lap('send', sent)
+                if not sent:
+                    break
+                bytes_sent += sent
+                self._delivered(target, sent)
+                timer.lap('progress')
+        return bytes_sent
+
+    def _delivered(self, target, nbytes):
+        with self._lock:
+            self._pending[target] -= nbytes
+            sampled = self.rate.add(nbytes)
+            progress = self.rate.percent()
+            changed = progress != self._progress
+            self._progress = progress
+        if changed:
+            self.emit('progress_updated', progress)
+        if sampled:
+            self.emit('speed_updated', format_rate(self.rate.rate()))
+            self.emit('rate_updated', self.rate.snapshot())
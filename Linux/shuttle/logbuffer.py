@@ -0,0 +1,88 @@
+"""In-memory log ring with optional rotating JSON-lines file output."""
+
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+from .config import LOG_CAPACITY, LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            'time': record.created,
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }, ensure_ascii=False)
+
+class LogBuffer:
+    """Fixed-capacity ring of (seq, time, level, message) log entries.
+
+    Appending is O(1) and memory stays flat no matter how long the app runs.
+    When `log_file` is set, entries are also written as JSON lines to a
+    rotating file by a background QueueListener thread.
+    """
+
+    def __init__(self, capacity=LOG_CAPACITY, log_file=LOG_FILE):
+        self._entries = collections.deque(maxlen=capacity)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._logger = None
+        self._listener = None
+        if log_file:
+            self._start_file_logging(log_file)
+
+    @property
+    def capacity(self):
+        return self._entries.maxlen
+
+    def _start_file_logging(self, log_file):
+        try:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+        except OSError:
+            return
+        file_handler.setFormatter(JsonLogFormatter())
+
+        log_queue = queue.SimpleQueue()
+        self._logger = logging.getLogger(f'lan_file_shuttle.{id(self)}')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.DEBUG)
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self._listener.start()
+
+    def log(self, message, level=logging.INFO):
+        with self._lock:
+            self._seq += 1
+            self._entries.append((self._seq, time.time(), level, message))
+        if self._logger:
+            self._logger.log(level, message)
+
+    def since(self, seq):
+        """Entries newer than `seq`, oldest first."""
+        with self._lock:
+            if not self._entries or self._entries[-1][0] <= seq:
+                return []
+            newer = []
+            for entry in reversed(self._entries):
+                if entry[0] <= seq:
+                    break
+                newer.append(entry)
+        newer.reverse()
+        return newer
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,215 @@
+"""Per-transfer phase timings and their Prometheus text-format export.
+
+FileSender and FileReceiver time every phase of a transfer with a
+PhaseTimer and fold it into a TransferMetrics table when the file is done:
+
+* sender phases: ``connect``, ``handshake``, ``read``, ``shape`` (waiting
+  for bandwidth-limit tokens), ``send``, ``progress`` (event emission and
+  bookkeeping, i.e. Python), ``close``
+* receiver phases: ``handshake``, ``recv``, ``write``, ``progress``, ``close``,
+  and ``relay`` (forwarding to the next hop of a chain, waiting for its report;
+  sharded sends wait for the same report as a receipt)
+* multicast adds ``fec`` (computing parity, or rebuilding blocks from it)
+  and ``repair`` (collecting NAKs and resending what they list)
+
+Each phase carries wall seconds, thread CPU seconds, bytes and calls (one
+call is one read/send/recv/write, which is one syscall except where
+``sendall`` has to loop). The totals are exported with ``direction``,
+``peer`` and ``phase`` labels through a textfile for the node_exporter
+textfile collector, a local ``/metrics`` HTTP endpoint, or the daemon's
+``metrics`` control command. Other components (the GUI's event-loop
+watchdog) can `register()` with the same table to share those exporters.
+"""
+
+import http.server
+import os
+import threading
+import time
+
+from .config import METRICS_FILE_INTERVAL, METRICS_LISTEN
+from .tracing import TRACE
+
+
+class PhaseTimer:
+    """Wall time, CPU time, bytes and calls per phase of one transfer.
+
+    `lap(phase, nbytes)` charges everything since the previous lap to `phase`,
+    so the hot loops pay two clock reads per call and nothing else. With
+    tracing on, every lap is also recorded as a span.
+    """
+
+    __slots__ = ('phases', '_wall', '_cpu')
+
+    def __init__(self):
+        self.phases = {} # phase -> [seconds, cpu_seconds, bytes, calls]
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def lap(self, phase, nbytes=0):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        totals = self.phases.get(phase)
+        if totals is None:
+            totals = self.phases[phase] = [0.0, 0.0, 0, 0]
+        totals[0] += wall - self._wall
+        totals[1] += cpu - self._cpu
+        totals[2] += nbytes
+        totals[3] += 1
+        if TRACE.enabled:
+            TRACE.complete(phase, 'phase', self._wall, wall, {'bytes': nbytes} if nbytes else None)
+        self._wall = wall
+        self._cpu = cpu
+
+    def as_dict(self):
+        return {phase: {'seconds': t[0], 'cpu_seconds': t[1], 'bytes': t[2], 'calls': t[3]}
+                for phase, t in self.phases.items()}
+
+
+class TransferMetrics:
+    """Process-wide totals per direction, peer and phase."""
+
+    SERIES = (
+        ('shuttle_phase_seconds_total', "Wall time spent in each transfer phase."),
+        ('shuttle_phase_cpu_seconds_total', "Thread CPU time spent in each transfer phase."),
+        ('shuttle_phase_bytes_total', "Bytes moved in each transfer phase."),
+        ('shuttle_phase_calls_total', "Read/send/recv/write calls made in each transfer phase.")
+    )
+
+    def __init__(self):
+        self._phases = {} # (direction, peer, phase) -> [seconds, cpu_seconds, bytes, calls]
+        self._transfers = {} # (direction, peer, result) -> count
+        self._collectors = [] # objects with name, render() -> lines and snapshot() -> dict
+        self._lock = threading.Lock()
+
+    def record(self, direction, peer, timer, success):
+        with self._lock:
+            for phase, values in timer.phases.items():
+                totals = self._phases.setdefault((direction, peer, phase), [0.0, 0.0, 0, 0])
+                for i, value in enumerate(values):
+                    totals[i] += value
+            key = (direction, peer, 'ok' if success else 'failed')
+            self._transfers[key] = self._transfers.get(key, 0) + 1
+
+    def register(self, collector):
+        """Export `collector.render()` after the transfer series and its snapshot under its name."""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def unregister(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+            self._transfers.clear()
+
+    def snapshot(self):
+        """JSON-friendly copy: ``{'phases': [...], 'transfers': [...], 'collectors': {...}}``."""
+        with self._lock:
+            snapshot = {
+                'phases': [{'direction': d, 'peer': p, 'phase': ph, 'seconds': t[0], 'cpu_seconds': t[1],
+                            'bytes': t[2], 'calls': t[3]} for (d, p, ph), t in self._phases.items()],
+                'transfers': [{'direction': d, 'peer': p, 'result': r, 'count': n}
+                              for (d, p, r), n in self._transfers.items()]
+            }
+            collectors = list(self._collectors)
+        snapshot['collectors'] = {collector.name: collector.snapshot() for collector in collectors}
+        return snapshot
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            phases = sorted(self._phases.items())
+            transfers = sorted(self._transfers.items())
+            collectors = list(self._collectors)
+
+        lines = []
+        for i, (name, help_text) in enumerate(self.SERIES):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (direction, peer, phase), totals in phases:
+                labels = f'direction="{direction}",peer="{_escape(peer)}",phase="{phase}"'
+                lines.append(f"{name}{{{labels}}} {totals[i]}")
+        lines.append("# HELP shuttle_transfers_total Files sent or received, by result.")
+        lines.append("# TYPE shuttle_transfers_total counter")
+        for (direction, peer, result), count in transfers:
+            lines.append(f'shuttle_transfers_total{{direction="{direction}",peer="{_escape(peer)}",'
+                         f'result="{result}"}} {count}')
+        for collector in collectors:
+            lines.extend(collector.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically replace `path`, so a collector never reads a half-written file."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS = TransferMetrics() # shared by every sender and receiver in the process
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # scrapes every few seconds would flood stderr
+
+
+def start_metrics_server(port, host=METRICS_LISTEN, metrics=METRICS):
+    """Serve ``/metrics`` from a daemon thread; call `shutdown()` on the result to stop."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class MetricsFileWriter:
+    """Rewrites a textfile every `interval` seconds and once more on `stop()`."""
+
+    def __init__(self, path, interval=METRICS_FILE_INTERVAL, metrics=METRICS):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-file', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._write()
+        self._write()
+
+    def _write(self):
+        try:
+            self.metrics.write_textfile(self.path)
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(5)
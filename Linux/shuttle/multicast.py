@@ -0,0 +1,561 @@
+"""Reliable multicast distribution: send each file once to a UDP multicast group.
+
+For pushing the same files to many machines on one L2 segment, where even a
+fan-out over TCP multiplies the traffic on the sender's uplink. The sender
+paces datagrams with a TokenBucket (multicast has no congestion control)
+and runs each file in two phases:
+
+1. One pass over the file in FEC groups of K data blocks followed by R
+   parity blocks. Parity j is the XOR of every R-th block of the group
+   starting at j, so a receiver rebuilds any burst of up to R lost blocks
+   per group (or up to R scattered losses in different classes) without
+   asking.
+2. Repair rounds: the sender announces the end of the pass, receivers
+   answer with a NAK listing the blocks FEC could not rebuild (after a
+   random backoff, so a hundred NAKs do not arrive at once), and the sender
+   multicasts the union once. Receivers that have everything answer DONE.
+   The file is finished when the expected number of receivers is done, or
+   when MULTICAST_LINGER seconds pass without NAKs.
+
+Datagrams start with HEADER (magic, type, session, file index). The file
+announcement (META) is JSON and is repeated every MULTICAST_META_INTERVAL
+seconds, so receivers that join late pick the transfer up and repair what
+they missed. NAK and DONE go back to the sender by unicast. Anyone on the
+segment can send to the group, so receivers check every announcement
+against their own limits and drop datagrams they cannot parse.
+
+`drop_rate` on the receiver throws away that share of incoming datagrams,
+for tests and benchmarks/bench_multicast.py.
+"""
+
+import json
+import os
+import random
+import shutil
+import socket
+import struct
+import time
+
+from .config import (MULTICAST_BLOCK_SIZE, MULTICAST_FEC_K, MULTICAST_FEC_R, MULTICAST_GROUP, MULTICAST_LINGER,
+                     MULTICAST_MAX_BLOCKS, MULTICAST_MAX_ROUNDS, MULTICAST_META_INTERVAL, MULTICAST_NAK_BACKOFF, MULTICAST_NAK_WAIT,
+                     MULTICAST_PORT, MULTICAST_RATE, MULTICAST_TTL)
+from .events import EventEmitter
+from .metrics import METRICS, PhaseTimer
+from .rate import RateEstimator, format_rate
+from .shaping import TokenBucket
+from .tracing import TRACE
+
+MAGIC = b'LFSM'
+HEADER = struct.Struct('!4sBIH') # magic, type, session, file index
+INDEX = struct.Struct('!I')
+PARITY_HEADER = struct.Struct('!IB') # group, parity class
+RANGE = struct.Struct('!II') # first block, count
+META, DATA, PARITY, END, NAK, DONE, BYE = range(1, 8)
+MAX_DATAGRAM = 65535
+NAK_RANGES = (MULTICAST_BLOCK_SIZE - INDEX.size) // RANGE.size # ranges per NAK datagram
+NAK_DATAGRAMS = 8 # NAK datagrams per receiver and round; the rest waits for the next round
+
+
+def xor_blocks(blocks, size):
+    """XOR of `blocks`, each zero-padded to `size` bytes."""
+    acc = 0
+    for block in blocks:
+        acc ^= int.from_bytes(block, 'little')
+    return acc.to_bytes(size, 'little')
+
+
+def to_ranges(indexes):
+    """Sorted block numbers as (first, count) runs."""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][0] + ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([index, 1])
+    return ranges
+
+
+def _send_ignoring_full_buffer(sock, packet, address):
+    while True:
+        try:
+            return sock.sendto(packet, address)
+        except BlockingIOError:
+            time.sleep(0.0005)
+        except OSError as e:
+            if e.errno != 105: # ENOBUFS: the device queue is full; wait for it to drain
+                raise
+            time.sleep(0.0005)
+
+
+class MulticastSender(EventEmitter):
+    """Multicasts a list of files with FEC and NAK repair; events as FileSender.
+
+    With `receivers` set the sender moves to the next file as soon as that
+    many receivers are done, and reports failure if fewer ever were.
+    """
+
+    def __init__(self, file_queue, group=MULTICAST_GROUP, port=MULTICAST_PORT, interface=None,
+                 rate=MULTICAST_RATE, fec=(MULTICAST_FEC_K, MULTICAST_FEC_R), receivers=0, ttl=MULTICAST_TTL,
+                 block_size=MULTICAST_BLOCK_SIZE, metrics=METRICS):
+        super().__init__()
+        self.file_queue = file_queue.copy()
+        self.address = (group, port)
+        self.interface = interface
+        self.rate_limit = rate
+        self.k, self.r = fec
+        self.receivers = receivers
+        self.ttl = ttl
+        self.block_size = block_size
+        self.metrics = metrics
+        self.session = random.getrandbits(32)
+        self.rate = RateEstimator()
+        self.stats = {'datagrams': 0, 'parity': 0, 'repaired': 0, 'naks': 0, 'rounds': 0}
+        self._bucket = TokenBucket(rate)
+        self._progress = 0
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        if self.interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        return sock
+
+    def _send(self, sock, kind, index, body=b''):
+        packet = HEADER.pack(MAGIC, kind, self.session, index) + body
+        delay = self._bucket.reserve(len(packet))
+        if delay > 0.001:
+            time.sleep(delay) # sleep in batches; the bucket carries the remainder
+        _send_ignoring_full_buffer(sock, packet, self.address)
+        self.stats['datagrams'] += 1
+
+    def run(self):
+        self.emit('status_message', f"Multicasting {len(self.file_queue)} file(s) to {self.address[0]}:"
+                                    f"{self.address[1]} at up to {format_rate(self.rate_limit)}")
+        missing = [path for path in self.file_queue if not os.path.isfile(path)]
+        if missing:
+            self.emit('transfer_complete', False, f"File '{missing[0]}' not found.")
+            return
+        self.rate = RateEstimator(sum(os.path.getsize(path) for path in self.file_queue))
+
+        with self._open_socket() as sock:
+            for index, filepath in enumerate(self.file_queue):
+                if not self._is_running:
+                    break
+                self.emit('status_message', f"Sending file {index+1}/{len(self.file_queue)}: "
+                                            f"{os.path.basename(filepath)}")
+                success, message = self._send_file(sock, index, filepath)
+                self.emit('status_message', message)
+                if not success:
+                    self.emit('transfer_complete', False, message)
+                    return
+            for _ in range(3):
+                self._send(sock, BYE, len(self.file_queue))
+
+        if self._is_running:
+            stats = self.stats
+            self.emit('transfer_complete', True,
+                      f"All files multicast: {stats['datagrams']} datagrams, {stats['parity']} parity, "
+                      f"{stats['repaired']} repaired in {stats['rounds']} round(s)")
+
+    def _send_file(self, sock, index, filepath):
+        filename = os.path.basename(filepath)
+        filesize = os.path.getsize(filepath)
+        block, k, r = self.block_size, self.k, self.r
+        nblocks = -(-filesize // block)
+        meta = json.dumps({'name': filename, 'size': filesize, 'block': block, 'k': k, 'r': r,
+                           'files': len(self.file_queue)}).encode('utf-8')
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        success = False
+        try:
+            with open(filepath, 'rb') as f:
+                self._send(sock, META, index, meta)
+                next_meta = time.monotonic() + MULTICAST_META_INTERVAL
+                timer.lap('handshake')
+                for group in range(-(-nblocks // k)):
+                    if not self._is_running:
+                        return False, "Transfer stopped."
+                    data = f.read(block * k)
+                    timer.lap('read', len(data))
+                    blocks = [data[i:i + block] for i in range(0, len(data), block)]
+                    for i, payload in enumerate(blocks):
+                        self._send(sock, DATA, index, INDEX.pack(group * k + i) + payload)
+                    timer.lap('send', len(data))
+                    parities = [xor_blocks(blocks[j::r], block) for j in range(min(r, len(blocks)))]
+                    timer.lap('fec')
+                    for j, parity in enumerate(parities):
+                        self._send(sock, PARITY, index, PARITY_HEADER.pack(group, j) + parity)
+                    self.stats['parity'] += len(parities)
+                    timer.lap('send', len(parities) * block)
+                    if time.monotonic() >= next_meta:
+                        self._send(sock, META, index, meta)
+                        next_meta = time.monotonic() + MULTICAST_META_INTERVAL
+                    self._advance(len(data))
+                    timer.lap('progress')
+
+                done, rounds = self._repair(sock, index, meta, f.fileno(), nblocks, timer)
+            if not self._is_running:
+                return False, "Transfer stopped."
+            if rounds > MULTICAST_MAX_ROUNDS:
+                return False, f"'{filename}' still incomplete at some receivers after {MULTICAST_MAX_ROUNDS} repair rounds."
+            if len(done) < self.receivers:
+                return False, f"Only {len(done)} of {self.receivers} receivers confirmed '{filename}'."
+            success = True
+            return True, f"'{filename}' done at {len(done)} receiver(s) after {rounds} repair round(s)."
+        finally:
+            self.metrics.record('send', self.address[0], timer, success)
+            TRACE.complete('multicast_file', 'sender', trace_start,
+                           args={'file': filename, 'group': self.address[0], 'bytes': filesize, 'ok': success})
+
+    def _repair(self, sock, index, meta, fd, nblocks, timer):
+        """Announce the end of the pass and resend what receivers NAK until they are quiet or all done."""
+        done = set()
+        rounds = 0
+        quiet_since = time.monotonic()
+        while self._is_running and rounds <= MULTICAST_MAX_ROUNDS:
+            self._send(sock, META, index, meta)
+            self._send(sock, END, index, INDEX.pack(nblocks))
+            timer.lap('send')
+            missing, newly_done = self._collect(sock, index, nblocks, done)
+            timer.lap('repair')
+            if missing:
+                rounds += 1
+                self.stats['rounds'] += 1
+                for block_index in sorted(missing):
+                    payload = os.pread(fd, self.block_size, block_index * self.block_size)
+                    self._send(sock, DATA, index, INDEX.pack(block_index) + payload)
+                self.stats['repaired'] += len(missing)
+                timer.lap('repair', len(missing) * self.block_size)
+                quiet_since = time.monotonic()
+            elif newly_done:
+                quiet_since = time.monotonic()
+            if self.receivers and len(done) >= self.receivers and not missing:
+                break
+            if not missing and time.monotonic() - quiet_since >= MULTICAST_LINGER:
+                break
+        return done, rounds
+
+    def _collect(self, sock, index, nblocks, done):
+        """NAKed block numbers and whether a receiver newly reported DONE, over MULTICAST_NAK_WAIT seconds."""
+        missing = set()
+        newly_done = False
+        deadline = time.monotonic() + MULTICAST_NAK_WAIT
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                packet, addr = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                break
+            if len(packet) < HEADER.size + INDEX.size:
+                continue
+            magic, kind, session, file_index = HEADER.unpack_from(packet)
+            if magic != MAGIC or session != self.session or file_index != index:
+                continue
+            receiver = (addr[0], INDEX.unpack_from(packet, HEADER.size)[0])
+            if kind == DONE and receiver not in done:
+                done.add(receiver)
+                newly_done = True
+            elif kind == NAK:
+                self.stats['naks'] += 1
+                for offset in range(HEADER.size + INDEX.size, len(packet) - RANGE.size + 1, RANGE.size):
+                    first, count = RANGE.unpack_from(packet, offset)
+                    missing.update(range(first, min(first + count, nblocks)))
+        sock.settimeout(None)
+        return missing, newly_done
+
+    def _advance(self, nbytes):
+        sampled = self.rate.add(nbytes)
+        progress = self.rate.percent()
+        if progress != self._progress:
+            self._progress = progress
+            self.emit('progress_updated', progress)
+        if sampled:
+            self.emit('speed_updated', format_rate(self.rate.rate()))
+            self.emit('rate_updated', self.rate.snapshot())
+
+
+class _IncomingFile:
+    """A file being received: where it goes, which blocks are in, and parity waiting to be used."""
+
+    def __init__(self, save_dir, session, index, meta):
+        self.session = session
+        self.index = index
+        self.name = os.path.basename(str(meta['name']))
+        if self.name in ('', '.', '..'):
+            self.name = 'unnamed'
+        self.size = int(meta['size'])
+        self.block = int(meta['block'])
+        self.k = int(meta['k'])
+        self.r = int(meta['r'])
+        if not 1 <= self.block <= MAX_DATAGRAM or self.k < 1 or self.r < 1:
+            raise ValueError(f"Bad FEC layout: block {self.block}, k {self.k}, r {self.r}")
+        self.nblocks = -(-self.size // self.block)
+        if not 0 <= self.nblocks <= MULTICAST_MAX_BLOCKS:
+            raise ValueError(f"Bad size {self.size} for {self.block}-byte blocks")
+        if self.size > shutil.disk_usage(save_dir).free:
+            raise ValueError(f"'{self.name}' ({self.size} bytes) does not fit in {save_dir}")
+        self.have = bytearray(self.nblocks)
+        self.remaining = self.nblocks
+        self.parity = {} # group -> {class: payload}, until the group is complete
+        self.path = os.path.join(save_dir, self.name)
+        self.part_path = self.path + '.part'
+        self.fd = None
+        self.rate = RateEstimator(self.size)
+        self.timer = PhaseTimer()
+        self.trace_start = time.perf_counter()
+        self.recovered = 0
+
+    def open(self):
+        self.fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(self.fd, self.size)
+        except OSError:
+            self.close(False)
+            raise
+
+    def block_length(self, block_index):
+        return min(self.block, self.size - block_index * self.block)
+
+    def store(self, block_index, payload):
+        """Write one block; returns False if it was already there."""
+        if block_index >= self.nblocks or self.have[block_index]:
+            return False
+        os.pwrite(self.fd, payload[:self.block_length(block_index)], block_index * self.block)
+        self.have[block_index] = 1
+        self.remaining -= 1
+        return True
+
+    def recover(self, group):
+        """Rebuild what the group's parity allows; returns the number of blocks rebuilt."""
+        parities = self.parity.get(group)
+        if not parities:
+            return 0
+        first = group * self.k
+        last = min(first + self.k, self.nblocks)
+        rebuilt = 0
+        for j, parity in list(parities.items()):
+            members = range(first + j, last, self.r)
+            lost = [i for i in members if not self.have[i]]
+            if len(lost) != 1:
+                continue
+            others = [os.pread(self.fd, self.block_length(i), i * self.block) for i in members if i != lost[0]]
+            self.store(lost[0], xor_blocks(others + [parity], self.block))
+            rebuilt += 1
+        if all(self.have[first:last]):
+            del self.parity[group]
+        self.recovered += rebuilt
+        return rebuilt
+
+    def missing(self):
+        return [i for i, have in enumerate(self.have) if not have]
+
+    def close(self, complete):
+        os.close(self.fd)
+        if complete:
+            os.replace(self.part_path, self.path)
+        else:
+            os.remove(self.part_path)
+
+
+class MulticastReceiver(EventEmitter):
+    """Joins a multicast group and saves every file sent to it; events as FileReceiver."""
+
+    def __init__(self, save_dir, group=MULTICAST_GROUP, port=MULTICAST_PORT, interface=None, drop_rate=0.0,
+                 once=False, metrics=METRICS):
+        super().__init__()
+        self.save_dir = save_dir
+        self.address = (group, port)
+        self.interface = interface
+        self.drop_rate = drop_rate # share of datagrams thrown away on arrival, to simulate loss
+        self.once = once # return after the first session ends
+        self.metrics = metrics
+        self.id = random.getrandbits(32)
+        self.stats = {'datagrams': 0, 'dropped': 0, 'malformed': 0, 'recovered': 0, 'naks': 0}
+        self._file = None
+        self._finished = None # (session, index) of the last completed file, to repeat DONE for it
+        self._sender = None
+        self._nak_due = None
+        self._progress = 0
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        sock.bind(('', self.address[1]))
+        interface = socket.inet_aton(self.interface) if self.interface else struct.pack('!I', socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(self.address[0]) + interface)
+        return sock
+
+    def run(self):
+        os.makedirs(self.save_dir, exist_ok=True)
+        try:
+            sock = self._open_socket()
+        except OSError as e:
+            self.emit('server_started', False, f"Cannot join {self.address[0]}:{self.address[1]}: {e}")
+            return
+        self.emit('server_started', True, f"Listening on multicast group {self.address[0]}:{self.address[1]}")
+        try:
+            with sock:
+                sock.settimeout(1)
+                waiting = False # timeout shortened for a pending NAK; settimeout() per datagram is costly
+                while self._is_running:
+                    if self._nak_due:
+                        sock.settimeout(max(0.001, self._nak_due - time.monotonic()))
+                        waiting = True
+                    elif waiting:
+                        sock.settimeout(1)
+                        waiting = False
+                    try:
+                        packet, addr = sock.recvfrom(MAX_DATAGRAM)
+                    except socket.timeout:
+                        packet = None
+                    try:
+                        if packet is not None and not self._handle(sock, packet, addr):
+                            break
+                    except (ValueError, struct.error, KeyError, TypeError):
+                        self.stats['malformed'] += 1 # anyone on the segment can send to the group
+                    if self._nak_due and time.monotonic() >= self._nak_due:
+                        self._send_nak(sock)
+        finally:
+            if self._file:
+                self._abandon("Receiver stopped.")
+            self.emit('status_message', "Multicast receiver stopped.")
+
+    def _handle(self, sock, packet, addr):
+        """Process one datagram; returns False when a `once` receiver is done."""
+        self.stats['datagrams'] += 1
+        if self.drop_rate and random.random() < self.drop_rate:
+            self.stats['dropped'] += 1
+            return True
+        if len(packet) < HEADER.size:
+            return True
+        magic, kind, session, index = HEADER.unpack_from(packet)
+        if magic != MAGIC:
+            return True
+        body = memoryview(packet)[HEADER.size:]
+        incoming = self._file if self._file and (self._file.session, self._file.index) == (session, index) else None
+
+        if kind == META and incoming is None and self._finished != (session, index):
+            meta = json.loads(bytes(body))
+            if not isinstance(meta, dict):
+                raise ValueError("META is not an object")
+            announced = _IncomingFile(self.save_dir, session, index, meta) # checks it before dropping ours
+            if self._file:
+                self._abandon("The sender moved on before this file was complete.")
+            self._start(announced, addr)
+        elif kind == DATA and incoming:
+            block_index = INDEX.unpack_from(body)[0]
+            if incoming.store(block_index, body[INDEX.size:]):
+                incoming.timer.lap('write', len(body) - INDEX.size)
+                self._advance(incoming, len(body) - INDEX.size)
+        elif kind == PARITY and incoming:
+            group, j = PARITY_HEADER.unpack_from(body)
+            if j < incoming.r and group * incoming.k < incoming.nblocks and not all(incoming.have[group * incoming.k:
+                                                                               (group + 1) * incoming.k]):
+                incoming.parity.setdefault(group, {})[j] = bytes(body[PARITY_HEADER.size:])
+                self._recover(incoming, group)
+        elif kind == END:
+            self._sender = addr
+            if incoming:
+                for group in list(incoming.parity):
+                    self._recover(incoming, group)
+                if incoming.remaining:
+                    self._nak_due = time.monotonic() + random.uniform(0, MULTICAST_NAK_BACKOFF)
+            elif self._finished == (session, index):
+                self._reply(sock, DONE, session, index) # our earlier DONE may have been lost
+        elif kind == BYE:
+            if self._file and self._file.session == session:
+                self._abandon("The sender finished before this file was complete.")
+            if self.once and self._finished and self._finished[0] == session:
+                return False
+
+        if self._file and not self._file.remaining:
+            self._complete(sock)
+        return True
+
+    def _start(self, incoming, addr):
+        try:
+            incoming.open()
+        except OSError as e:
+            self.emit('status_message', f"Cannot receive '{incoming.name}' from {addr[0]}: {e}")
+            return
+        self._file = incoming
+        self._sender = addr
+        self._nak_due = None
+        self._progress = 0
+        incoming.timer.lap('handshake')
+        self.emit('status_message', f"Receiving file: {incoming.name} ({incoming.size / (1024*1024):.2f} MB) "
+                                    f"from {addr[0]} by multicast")
+
+    def _recover(self, incoming, group):
+        rebuilt = incoming.recover(group)
+        if rebuilt:
+            incoming.timer.lap('fec')
+            self.stats['recovered'] += rebuilt
+            self._advance(incoming, rebuilt * incoming.block) # rebuilt blocks count as received
+
+    def _advance(self, incoming, nbytes):
+        sampled = incoming.rate.add(nbytes)
+        progress = incoming.rate.percent()
+        if progress != self._progress:
+            self._progress = progress
+            self.emit('progress_updated', progress)
+        if sampled:
+            self.emit('speed_updated', format_rate(incoming.rate.rate()))
+            self.emit('rate_updated', incoming.rate.snapshot())
+
+    def _reply(self, sock, kind, session, index, body=b''):
+        if self._sender:
+            packet = HEADER.pack(MAGIC, kind, session, index) + INDEX.pack(self.id) + body
+            sock.sendto(packet, self._sender)
+
+    def _send_nak(self, sock):
+        self._nak_due = None
+        incoming = self._file
+        if not incoming or not incoming.remaining:
+            return
+        ranges = to_ranges(incoming.missing())
+        for start in range(0, min(len(ranges), NAK_RANGES * NAK_DATAGRAMS), NAK_RANGES):
+            body = b''.join(RANGE.pack(first, count) for first, count in ranges[start:start + NAK_RANGES])
+            self._reply(sock, NAK, incoming.session, incoming.index, body)
+            self.stats['naks'] += 1
+
+    def _complete(self, sock):
+        incoming, self._file = self._file, None
+        self._nak_due = None
+        self._finished = (incoming.session, incoming.index)
+        incoming.close(True)
+        self._reply(sock, DONE, incoming.session, incoming.index)
+        self._record(incoming, True)
+        self.emit('progress_updated', 100)
+        self.emit('transfer_complete', True, f"File '{incoming.name}' received successfully!"
+                                             f" ({incoming.recovered} block(s) rebuilt from parity)")
+        self.emit('progress_updated', 0)
+
+    def _abandon(self, message):
+        incoming, self._file = self._file, None
+        self._nak_due = None
+        incoming.close(False)
+        self._record(incoming, False)
+        self.emit('transfer_complete', False, f"Incomplete transfer of '{incoming.name}': {message}")
+        self.emit('progress_updated', 0)
+
+    def _record(self, incoming, success):
+        incoming.timer.lap('close')
+        self.metrics.record('receive', self._sender[0] if self._sender else self.address[0], incoming.timer, success)
+        TRACE.complete('multicast_receive', 'receiver', incoming.trace_start,
+                       args={'file': incoming.name, 'bytes': incoming.size, 'recovered': incoming.recovered,
+                             'ok': success})
@@ -0,0 +1,43 @@
+"""Small socket helpers shared by the transfer and discovery code."""
+
+import select
+import socket
+import time
+
+MAX_DATAGRAM = 65535 # discovery responses can carry swarm have-bitfields
+
+def get_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # doesn't have to be reachable
+        s.connect(('10.255.255.255', 1))
+        IP = s.getsockname()[0]
+    except Exception:
+        IP = '127.0.0.1'
+    finally:
+        s.close()
+    return IP
+
+def get_hostname():
+    try:
+        return socket.gethostname()
+    except Exception:
+        return "Unknown"
+
+def drain_datagrams(sock, on_reply, timeout):
+    """Hand every datagram that arrives on `sock` within `timeout` seconds to `on_reply`."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        readable, _, _ = select.select([sock], [], [], max(0.0, remaining))
+        if readable:
+            while True:
+                try:
+                    data, addr = sock.recvfrom(MAX_DATAGRAM)
+                except (BlockingIOError, socket.timeout):
+                    break
+                except OSError:
+                    break
+                on_reply(data, addr)
+        if remaining <= 0:
+            return
@@ -0,0 +1,159 @@
+"""On-demand profiling of a running process.
+
+A capture samples the stacks of every thread for a fixed time and diffs
+tracemalloc snapshots taken at both ends, then writes a timestamped
+directory under PROFILE_DIR:
+
+* ``stacks.folded``: one ``thread;outer;...;inner count`` line per stack,
+  ready for flamegraph.pl or https://www.speedscope.app
+* ``summary.txt``: samples per thread and the hottest functions (self and
+  inclusive) and lines
+* ``tracemalloc.txt``: allocation growth during the capture, by line
+* ``meta.json``: duration, interval and sample counts
+
+Sampling (``sys._current_frames``) is used rather than cProfile because
+cProfile only sees the thread that enabled it, while the hot loops run on
+the sender, receiver and discovery threads. Wall-clock samples also show
+where threads block, not just where they burn CPU.
+
+Trigger a capture with SIGUSR1 (``install_signal_handler``), ``shuttle
+profile`` against the daemon, or Ctrl+Shift+P in the GUI.
+"""
+
+import collections
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from .config import PROFILE_DIR, PROFILE_DURATION, PROFILE_MAX_DURATION, PROFILE_SAMPLE_INTERVAL
+
+_capture_lock = threading.Lock() # one capture at a time per process
+
+
+class ProfileCapture:
+    """One time-boxed capture; `start()` runs it on a background thread."""
+
+    def __init__(self, duration=PROFILE_DURATION, interval=PROFILE_SAMPLE_INTERVAL, out_dir=None):
+        self.duration = min(max(float(duration), 0.1), PROFILE_MAX_DURATION)
+        self.interval = interval
+        self.out_dir = out_dir or os.path.join(
+            PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        self.samples = 0
+        self._stacks = collections.Counter() # (thread, frame, ...) outermost first -> samples
+        self._lines = collections.Counter() # innermost 'file:line function' -> samples
+        self._thread = None
+
+    def start(self):
+        """Begin capturing; raises RuntimeError if another capture is running."""
+        if not _capture_lock.acquire(blocking=False):
+            raise RuntimeError("A profile capture is already running.")
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self.out_dir
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+
+            start = time.perf_counter()
+            deadline = start + self.duration
+            while time.perf_counter() < deadline:
+                self._sample()
+                time.sleep(self.interval)
+            elapsed = time.perf_counter() - start
+
+            after = tracemalloc.take_snapshot()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            self._write(elapsed, before, after)
+        finally:
+            _capture_lock.release()
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            self._lines[f"{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}"] += 1
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self._stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _write(self, elapsed, before, after):
+        os.makedirs(self.out_dir, exist_ok=True)
+
+        with open(os.path.join(self.out_dir, 'stacks.folded'), 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{';'.join(part.replace(';', ',') for part in stack)} {count}\n")
+
+        per_thread = collections.Counter()
+        own = collections.Counter()
+        inclusive = collections.Counter()
+        for stack, count in self._stacks.items():
+            per_thread[stack[0]] += count
+            if len(stack) > 1:
+                own[stack[-1]] += count
+            for function in set(stack[1:]):
+                inclusive[function] += count
+
+        with open(os.path.join(self.out_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"{self.samples} samples every {self.interval * 1000:.1f} ms over {elapsed:.1f} s\n\n")
+            f.write("Samples per thread:\n")
+            for name, count in per_thread.most_common():
+                f.write(f"  {count:8d}  {name}\n")
+            for title, table in (("Self", own), ("Inclusive", inclusive), ("Line (self)", self._lines)):
+                f.write(f"\n{title} samples, top 40:\n")
+                for function, count in table.most_common(40):
+                    f.write(f"  {count:8d}  {function}\n")
+
+        with open(os.path.join(self.out_dir, 'tracemalloc.txt'), 'w', encoding='utf-8') as f:
+            stats = after.compare_to(before, 'lineno')
+            f.write(f"Allocation growth during the capture: {sum(s.size_diff for s in stats)} bytes\n\n")
+            for stat in stats[:50]:
+                f.write(f"{stat}\n")
+
+        with open(os.path.join(self.out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'duration_s': elapsed, 'interval_s': self.interval,
+                       'samples': self.samples, 'threads': dict(per_thread)}, f, indent=1)
+
+
+def capture(duration=PROFILE_DURATION):
+    """Start a capture in the background and return its output directory."""
+    return ProfileCapture(duration).start()
+
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR1', None), on_started=None):
+    """Start a capture whenever `signum` arrives; `on_started(out_dir)` is told where it goes.
+
+    Must be called from the main thread. Does nothing where the signal does
+    not exist (Windows).
+    """
+    if signum is None:
+        return
+
+    def handler(received, frame):
+        try:
+            out_dir = capture()
+        except RuntimeError:
+            return
+        if on_started:
+            on_started(out_dir)
+
+    signal.signal(signum, handler)
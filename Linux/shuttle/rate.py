@@ -0,0 +1,131 @@
+"""Transfer rate estimation: smoothed speed, batch progress, ETA and history.
+
+A RateEstimator covers one whole transfer (a batch of files), so progress is
+weighted by bytes rather than reset per file. Every `interval` seconds it
+takes a sample and derives:
+
+* an exponentially weighted rate with a `half_life` in seconds, which
+  follows slowdowns within a few seconds and drives the ETA
+* a windowed rate over the last `window` seconds
+* the plain average since the start
+* a short history of per-sample rates, for a sparkline
+
+`add()` is called from the transfer loop and only does arithmetic until a
+sample is due; `snapshot()` may be called from any thread.
+"""
+
+import collections
+import threading
+import time
+
+from .config import RATE_HALF_LIFE, RATE_HISTORY, RATE_SAMPLE_INTERVAL, RATE_WINDOW
+
+SPARK_BLOCKS = '▁▂▃▄▅▆▇█'
+
+
+class RateEstimator:
+    """Rate and ETA for a transfer of `total` bytes (None when unknown)."""
+
+    def __init__(self, total=None, interval=RATE_SAMPLE_INTERVAL, half_life=RATE_HALF_LIFE,
+                 window=RATE_WINDOW, history=RATE_HISTORY, clock=time.monotonic):
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.half_life = half_life
+        self.window = window
+        self.history = collections.deque(maxlen=history) # bytes/s per sample, oldest first
+        self._clock = clock
+        self._start = self._sample_time = clock()
+        self._sample_done = 0
+        self._ewma = None
+        self._points = collections.deque([(self._start, 0)]) # (time, done) within the window
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        """Count `nbytes`; returns True when this call took a new sample."""
+        self.done += nbytes
+        now = self._clock()
+        if now - self._sample_time < self.interval:
+            return False
+        with self._lock:
+            return self._sample(now)
+
+    def _sample(self, now):
+        elapsed = now - self._sample_time
+        if elapsed < self.interval:
+            return False
+        done = self.done
+        rate = (done - self._sample_done) / elapsed
+        if self._ewma is None:
+            self._ewma = rate
+        else:
+            self._ewma += (1 - 0.5 ** (elapsed / self.half_life)) * (rate - self._ewma)
+        self.history.append(rate)
+        self._points.append((now, done))
+        while len(self._points) > 2 and self._points[1][0] <= now - self.window:
+            self._points.popleft()
+        self._sample_time = now
+        self._sample_done = done
+        return True
+
+    def rate(self):
+        """Smoothed bytes/second; the average until the first sample is in."""
+        return self._ewma if self._ewma is not None else self.average_rate()
+
+    def window_rate(self):
+        (first_time, first_done), (last_time, last_done) = self._points[0], self._points[-1]
+        return (last_done - first_done) / (last_time - first_time) if last_time > first_time else 0.0
+
+    def average_rate(self):
+        elapsed = self._clock() - self._start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def percent(self):
+        """Byte-weighted progress as an int, 0 to 100."""
+        if not self.total:
+            return 0
+        return min(100, self.done * 100 // self.total)
+
+    def eta(self):
+        """Seconds left at the smoothed rate, or None when it cannot be predicted."""
+        rate = self.rate()
+        if self.total is None or rate <= 0:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def snapshot(self):
+        """JSON-friendly state; takes a sample first if one is overdue, so stalls show up."""
+        with self._lock:
+            self._sample(self._clock())
+            return {
+                'bytes': self.done,
+                'total': self.total,
+                'percent': self.percent(),
+                'rate_bps': self.rate(),
+                'window_bps': self.window_rate(),
+                'average_bps': self.average_rate(),
+                'eta_s': self.eta(),
+                'history': [round(rate) for rate in self.history]
+            }
+
+
+def format_rate(bytes_per_second):
+    return f"{bytes_per_second / (1024*1024):.2f} MB/s"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds + 0.5)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+
+def sparkline(values, width=None):
+    """Unicode block sparkline of the last `width` values, scaled to their maximum."""
+    values = list(values)[-width:] if width else list(values)
+    peak = max(values, default=0)
+    if peak <= 0:
+        return SPARK_BLOCKS[0] * len(values)
+    top = len(SPARK_BLOCKS) - 1
+    return ''.join(SPARK_BLOCKS[round(value / peak * top)] for value in values)
@@ -0,0 +1,365 @@
+"""Send job scheduling shared by the daemon and the GUI.
+
+JobScheduler decides which queued job runs next:
+
+* priority classes (JOB_PRIORITIES), most urgent first
+* within a class, shortest job first by total bytes, so a handful of small
+  files never waits behind a multi-gigabyte image
+* a job that has waited SCHEDULER_AGING seconds is served in arrival order
+  within its class, so a steady trickle of small jobs cannot starve a big one
+* at most `max_active` jobs at once, and at most `max_per_peer` to any one
+  receiver; a saturated peer does not hold up jobs for the others
+
+Workers block in `take()` on a condition variable and are woken by
+`submit()`, `release()`, `set_limits()` and `close()`; nothing polls.
+
+SendQueue runs FileSender jobs from a JobScheduler on a pool of worker
+threads, each through a flow of its Shaper weighted by PRIORITY_WEIGHTS (so
+concurrent jobs share bandwidth limits fairly), and reports them with the same events the daemon publishes on its
+control socket, each carrying one dict: ``job_queued``, ``job_started`` and
+``job_finished`` (``job``: Job.as_dict()), ``job_status`` (``job``: id,
+``message``), ``job_progress`` (``job``, ``progress``) and ``job_rate``
+(``job``, ``rate``).
+"""
+
+import collections
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from .config import (JOB_HISTORY, JOB_PRIORITIES, PRIORITY_WEIGHTS, SCHEDULER_AGING, SCHEDULER_MAX_ACTIVE,
+                     SCHEDULER_MAX_PER_PEER)
+from .events import EventEmitter
+from .shaping import Shaper
+from .transfer import FileSender
+
+JOB_EVENTS = ('job_queued', 'job_started', 'job_status', 'job_progress', 'job_rate', 'job_finished')
+
+
+class Job:
+    __slots__ = ('id', 'host', 'port', 'files', 'sources', 'owner', 'priority', 'size', 'limit', 'state',
+                 'progress', 'rate', 'message', 'created', 'finished', 'sender')
+
+    def __init__(self, job_id, host, port, files, owner, priority='normal', size=0, limit=0, sources=None):
+        self.id = job_id
+        self.host = host
+        self.port = port
+        self.files = files
+        self.sources = sources or {} # path -> descriptor the job owns and reads instead of the path
+        self.owner = owner
+        self.priority = priority
+        self.size = size
+        self.limit = limit # bytes/s for this job alone, 0 for the shaper's transfer limit
+        self.state = 'queued'
+        self.progress = 0
+        self.rate = None # final RateEstimator snapshot, without history
+        self.message = ''
+        self.created = time.time()
+        self.finished = None
+        self.sender = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'host': self.host,
+            'port': self.port,
+            'files': self.files,
+            'owner': self.owner,
+            'priority': self.priority,
+            'size': self.size,
+            'limit': self.limit,
+            'state': self.state,
+            'progress': self.progress,
+            'rate': self.sender.rate.snapshot() if self.sender else self.rate,
+            'message': self.message,
+            'created': self.created,
+            'finished': self.finished
+        }
+
+
+class _Entry:
+    __slots__ = ('item', 'peer', 'rank', 'size', 'seq', 'queued_at', 'state')
+
+    def __init__(self, item, peer, rank, size, seq):
+        self.item = item
+        self.peer = peer
+        self.rank = rank
+        self.size = size
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.state = 'queued' # then 'active', or 'removed'
+
+
+class JobScheduler:
+    """Priority and shortest-job-first queue with global and per-peer concurrency limits."""
+
+    def __init__(self, max_active=SCHEDULER_MAX_ACTIVE, max_per_peer=SCHEDULER_MAX_PER_PEER,
+                 aging=SCHEDULER_AGING):
+        self.max_active = max_active
+        self.max_per_peer = max_per_peer
+        self.aging = aging
+        self._heaps = {} # peer -> heap of (rank, size, seq, entry); removed entries are skipped lazily
+        self._arrivals = {} # peer -> deque of entries in arrival order, for aging
+        self._entries = {} # item -> entry, while queued or active
+        self._active = 0
+        self._active_per_peer = collections.Counter()
+        self._seq = itertools.count()
+        self._changed = threading.Condition()
+        self._closed = False
+
+    def submit(self, item, peer, size=0, priority='normal'):
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'")
+        with self._changed:
+            entry = _Entry(item, peer, JOB_PRIORITIES.index(priority), size, next(self._seq))
+            self._entries[item] = entry
+            heapq.heappush(self._heaps.setdefault(peer, []), (entry.rank, size, entry.seq, entry))
+            self._arrivals.setdefault(peer, collections.deque()).append(entry)
+            self._changed.notify()
+
+    def remove(self, item):
+        """Drop a job that has not started; returns False if it is already running or unknown."""
+        with self._changed:
+            entry = self._entries.get(item)
+            if entry is None or entry.state != 'queued':
+                return False
+            entry.state = 'removed'
+            del self._entries[item]
+            return True
+
+    def take(self):
+        """Block until a job may start and return it, or None once the scheduler is closed."""
+        with self._changed:
+            while True:
+                if self._closed:
+                    return None
+                entry = self._pick()
+                if entry is not None:
+                    entry.state = 'active'
+                    self._active += 1
+                    self._active_per_peer[entry.peer] += 1
+                    return entry.item
+                self._changed.wait()
+
+    def release(self, item):
+        """Mark a job taken with `take()` as finished, freeing its slots."""
+        with self._changed:
+            entry = self._entries.pop(item, None)
+            if entry is None or entry.state != 'active':
+                return
+            self._active -= 1
+            self._active_per_peer[entry.peer] -= 1
+            if not self._active_per_peer[entry.peer]:
+                del self._active_per_peer[entry.peer]
+            self._changed.notify_all() # a freed peer slot may suit any waiting worker
+
+    def set_limits(self, max_active=None, max_per_peer=None):
+        with self._changed:
+            if max_active is not None:
+                self.max_active = max_active
+            if max_per_peer is not None:
+                self.max_per_peer = max_per_peer
+            self._changed.notify_all()
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def counts(self):
+        with self._changed:
+            active = self._active
+            return {'queued': len(self._entries) - active, 'active': active,
+                    'active_per_peer': dict(self._active_per_peer)}
+
+    def _pick(self):
+        if self._active >= self.max_active:
+            return None
+        now = time.monotonic()
+        best_key = best = None
+        for peer in list(self._heaps):
+            heap, arrivals = self._heaps[peer], self._arrivals[peer]
+            while heap and heap[0][3].state != 'queued':
+                heapq.heappop(heap)
+            while arrivals and arrivals[0].state != 'queued':
+                arrivals.popleft()
+            if not heap:
+                del self._heaps[peer], self._arrivals[peer]
+                continue
+            if self._active_per_peer[peer] >= self.max_per_peer:
+                continue
+
+            key, entry = heap[0][:3], heap[0][3]
+            oldest = arrivals[0]
+            if now - oldest.queued_at >= self.aging and (oldest.rank, -1, oldest.seq) < key:
+                key, entry = (oldest.rank, -1, oldest.seq), oldest
+            if best_key is None or key < best_key:
+                best_key, best = key, entry
+        return best
+
+
+class SendQueue(EventEmitter):
+    """Runs queued sends through a JobScheduler on `scheduler.max_active` worker threads."""
+
+    def __init__(self, scheduler=None, sender_factory=FileSender, shaper=None):
+        super().__init__()
+        self.scheduler = scheduler or JobScheduler()
+        self.shaper = shaper or Shaper()
+        self.sender_factory = sender_factory
+        self._jobs = {}
+        self._finished = collections.deque() # ids of finished jobs, oldest first; only JOB_HISTORY are kept
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _publish(self, event, **fields):
+        fields['event'] = event
+        self.emit(event, fields)
+
+    def submit(self, host, port, files, priority='normal', owner=None, limit=0, sources=None):
+        """Queue a send. The job takes ownership of the `sources` descriptors and closes them when it ends."""
+        sources = sources or {}
+        size = sum(os.fstat(sources[path]).st_size if path in sources else os.path.getsize(path)
+                   for path in files if path in sources or os.path.isfile(path))
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'")
+        if limit < 0:
+            raise ValueError("A bandwidth limit cannot be negative")
+        with self._lock:
+            job = Job(next(self._job_ids), host, int(port), list(files), owner, priority, size, limit, sources)
+            self._jobs[job.id] = job
+        self._publish('job_queued', job=job.as_dict())
+        self.scheduler.submit(job, f"{host}:{job.port}", size, priority)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return [job.as_dict() for job in self._jobs.values()]
+
+    def cancel(self, job):
+        finished = None
+        with self._lock:
+            if job.state == 'queued' and self.scheduler.remove(job):
+                finished = self._finish(job, 'cancelled', "Cancelled before it started.")
+            elif job.state in ('queued', 'running'):
+                job.state = 'cancelling' # a worker has it; it stops at the next chunk
+                if job.sender:
+                    job.sender.stop()
+        if finished:
+            self._publish('job_finished', job=finished)
+        return job
+
+    def set_job_limit(self, job, limit):
+        """Change one job's bandwidth limit, also while it is running."""
+        if limit < 0:
+            raise ValueError("A bandwidth limit cannot be negative")
+        with self._lock:
+            job.limit = limit
+            if job.sender and job.sender.flow:
+                job.sender.flow.set_limit(limit)
+        return job
+
+    def _finish(self, job, state, message):
+        """Close `job` and return it for ``job_finished``, which the caller publishes once it lets go of the lock."""
+        if state == 'done':
+            job.progress = 100
+        if job.sender:
+            job.rate = dict(job.sender.rate.snapshot(), history=[]) # finished jobs are kept; keep them small
+        job.state = state
+        job.message = message
+        job.finished = time.time()
+        job.sender = None
+        for fd in job.sources.values():
+            os.close(fd)
+        job.sources = {}
+        self._finished.append(job.id)
+        while len(self._finished) > JOB_HISTORY:
+            self._jobs.pop(self._finished.popleft(), None)
+        return job.as_dict()
+
+    def start(self):
+        self._spawn_workers()
+        return self
+
+    def _spawn_workers(self):
+        while len(self._threads) < self.scheduler.max_active:
+            thread = threading.Thread(target=self._work, name=f'sender-{len(self._threads) + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def set_limits(self, max_active=None, max_per_peer=None):
+        """Change the concurrency limits of a running queue; extra workers start as needed."""
+        self.scheduler.set_limits(max_active, max_per_peer)
+        if self._threads:
+            self._spawn_workers()
+
+    def run(self):
+        """Start the workers and block until `stop()`, for front ends that run it on their own thread."""
+        self.start()
+        for thread in list(self._threads):
+            thread.join()
+
+    def stop(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.sender:
+                    job.sender.stop()
+        self.scheduler.close()
+
+    def _work(self):
+        while True:
+            job = self.scheduler.take()
+            if job is None:
+                return
+            try:
+                self._run_job(job)
+            finally:
+                self.scheduler.release(job)
+
+    def _run_job(self, job):
+        with self._lock:
+            if job.state == 'cancelling':
+                finished = self._finish(job, 'cancelled', "Cancelled before it started.")
+            else:
+                finished = None
+                job.state = 'running'
+                flow = self.shaper.flow(job.host, PRIORITY_WEIGHTS.get(job.priority, 1), job.limit)
+                job.sender = sender = self.sender_factory(job.host, job.port, job.files, flow=flow,
+                                                          sources=job.sources)
+        if finished:
+            self._publish('job_finished', job=finished)
+            return
+
+        result = {}
+        sender.on('status_message', lambda message: self._publish('job_status', job=job.id, message=message))
+        sender.on('progress_updated', lambda progress: self._progress(job, progress))
+        sender.on('rate_updated', lambda rate: self._publish('job_rate', job=job.id, rate=rate))
+        sender.on('transfer_complete', lambda success, message: result.update(success=success, message=message))
+        self._publish('job_started', job=job.as_dict())
+
+        try:
+            sender.run()
+        except Exception as e:
+            result = {'success': False, 'message': f"Error while sending: {e}"}
+        finally:
+            flow.close()
+
+        with self._lock:
+            if job.state == 'cancelling':
+                finished = self._finish(job, 'cancelled', "Cancelled.")
+            elif result.get('success'):
+                finished = self._finish(job, 'done', result['message'])
+            else:
+                finished = self._finish(job, 'failed', result.get('message', "Transfer stopped."))
+        self._publish('job_finished', job=finished)
+
+    def _progress(self, job, progress):
+        if progress != job.progress:
+            job.progress = progress
+            self._publish('job_progress', job=job.id, progress=progress)
@@ -0,0 +1,230 @@
+"""Token-bucket bandwidth shaping for sends.
+
+Limits apply to all sends together, to each receiver and to each transfer
+(SHAPING_* in config.py, changeable at runtime with `Shaper.set_limits`).
+Rather than making every chunk pass three buckets, the Shaper divides the
+limits between the active flows by weighted max-min fairness and gives each
+flow a single bucket at its share:
+
+1. each receiver's limit is split between the flows to it, by weight, with
+   every flow capped by its own transfer limit;
+2. the global limit is split between all flows, capped by step 1.
+
+Shares are recomputed when a flow starts or ends, when a limit or weight
+changes, and every SHAPING_REBALANCE_INTERVAL seconds. On the periodic pass
+a flow that used clearly less than its share (the network or the receiver
+is its bottleneck) is capped near what it really used, so the rest of the
+budget goes to flows that can use it.
+
+Buckets never block while reserving: `reserve()` debits the tokens, into
+the negative if need be, and returns how long the caller has to sleep.
+Sleep overshoot is therefore paid back from the next reservation instead of
+lowering the rate. A flow settles with its bucket once per batch (10 ms of
+traffic, at most MAX_BATCH bytes) rather than per chunk, so small buffered
+chunks cost an addition and a comparison; a flow with no limit returns
+after one attribute check.
+"""
+
+import math
+import threading
+import time
+
+from .config import (SHAPING_BURST, SHAPING_GLOBAL_RATE, SHAPING_PEER_RATE, SHAPING_REBALANCE_INTERVAL,
+                     SHAPING_TRANSFER_RATE)
+
+MIN_RATE = 64 * 1024 # floor for demand-capped shares, so a stalled flow can recover
+MAX_BATCH = 64 * 1024 # bytes a flow may send before settling with its bucket
+
+
+class TokenBucket:
+    """`rate` bytes/s with up to `burst_seconds` of traffic saved up; rate 0 means unlimited."""
+
+    __slots__ = ('rate', 'burst', 'tokens', '_stamp', '_lock')
+
+    def __init__(self, rate=0, burst_seconds=SHAPING_BURST):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self._stamp = time.perf_counter()
+        self.set_rate(rate, burst_seconds)
+
+    def set_rate(self, rate, burst_seconds=SHAPING_BURST):
+        with self._lock:
+            self._refill(time.perf_counter())
+            self.rate = rate
+            self.burst = max(rate * burst_seconds, MIN_RATE)
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self, nbytes):
+        """Debit `nbytes` and return the seconds to wait before sending them."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(time.perf_counter())
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+def fair_share(capacity, demands):
+    """Weighted max-min split of `capacity` between ``{key: (weight, cap)}``; math.inf means no limit."""
+    if capacity == math.inf:
+        return {key: cap for key, (weight, cap) in demands.items()}
+    shares = {}
+    pending = dict(demands)
+    while pending:
+        unit = capacity / sum(weight for weight, cap in pending.values())
+        capped = [key for key, (weight, cap) in pending.items() if cap <= unit * weight]
+        if not capped:
+            shares.update((key, unit * weight) for key, (weight, cap) in pending.items())
+            break
+        for key in capped:
+            shares[key] = pending.pop(key)[1]
+            capacity -= shares[key]
+    return shares
+
+
+class Flow:
+    """One transfer's handle on a Shaper: call `throttle(n)` before sending n bytes."""
+
+    def __init__(self, shaper, peer, weight=1, limit=0):
+        self.shaper = shaper
+        self.peer = peer
+        self.weight = weight
+        self.limit = limit # this transfer's own cap, 0 for the shaper's transfer limit
+        self.bucket = TokenBucket()
+        self.share = math.inf
+        self.sent = 0
+        self._owed = 0 # bytes sent since the last reservation
+        self._batch = 1
+        self._period_sent = 0
+        self._period_start = time.monotonic()
+
+    def throttle(self, nbytes):
+        self.sent += nbytes
+        if not self.bucket.rate:
+            return
+        self._owed += nbytes
+        if self._owed < self._batch:
+            return
+        delay = self.bucket.reserve(self._owed)
+        self._owed = 0
+        self.shaper.maybe_rebalance()
+        if delay > 0:
+            time.sleep(delay)
+
+    def quantum(self):
+        """Largest chunk worth sending at once (about 50 ms at the current share), or None if unlimited."""
+        return max(MIN_RATE, int(self.bucket.rate * 0.05)) if self.bucket.rate else None
+
+    def set_weight(self, weight):
+        self.weight = weight
+        self.shaper.rebalance()
+
+    def set_limit(self, limit):
+        self.limit = limit
+        self.shaper.rebalance()
+
+    def close(self):
+        self.shaper.remove(self)
+
+
+class Shaper:
+    """Global, per-receiver and per-transfer limits, shared fairly between the active flows."""
+
+    def __init__(self, global_rate=SHAPING_GLOBAL_RATE, peer_rate=SHAPING_PEER_RATE,
+                 transfer_rate=SHAPING_TRANSFER_RATE):
+        self.global_rate = global_rate
+        self.peer_rate = peer_rate
+        self.transfer_rate = transfer_rate
+        self.peer_rates = {} # receiver -> limit overriding peer_rate
+        self._flows = []
+        self._lock = threading.Lock()
+        self._next_rebalance = math.inf
+
+    def flow(self, peer, weight=1, limit=0):
+        flow = Flow(self, peer, weight, limit)
+        with self._lock:
+            self._flows.append(flow)
+            self._rebalance()
+        return flow
+
+    def remove(self, flow):
+        with self._lock:
+            if flow in self._flows:
+                self._flows.remove(flow)
+                self._rebalance()
+
+    def set_limits(self, global_rate=None, peer_rate=None, transfer_rate=None, peer_rates=None):
+        """Change limits on the fly; in `peer_rates` a rate of None drops that receiver's override."""
+        with self._lock:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if peer_rate is not None:
+                self.peer_rate = peer_rate
+            if transfer_rate is not None:
+                self.transfer_rate = transfer_rate
+            for peer, rate in (peer_rates or {}).items():
+                if rate is None:
+                    self.peer_rates.pop(peer, None)
+                else:
+                    self.peer_rates[peer] = rate
+            self._rebalance()
+
+    def limits(self):
+        with self._lock:
+            return {'global': self.global_rate, 'peer': self.peer_rate, 'transfer': self.transfer_rate,
+                    'peers': dict(self.peer_rates)}
+
+    def snapshot(self):
+        limits = self.limits()
+        with self._lock:
+            limits['flows'] = [{'peer': flow.peer, 'weight': flow.weight, 'limit': flow.limit,
+                                'share_bps': None if flow.share == math.inf else flow.share, 'bytes': flow.sent}
+                               for flow in self._flows]
+        return limits
+
+    def rebalance(self):
+        with self._lock:
+            self._rebalance()
+
+    def maybe_rebalance(self):
+        if time.monotonic() >= self._next_rebalance:
+            with self._lock:
+                if time.monotonic() >= self._next_rebalance:
+                    self._rebalance(periodic=True)
+
+    def _rebalance(self, periodic=False):
+        now = time.monotonic()
+        caps = {}
+        by_peer = {}
+        for flow in self._flows:
+            cap = flow.limit or self.transfer_rate or math.inf
+            elapsed = now - flow._period_start
+            if periodic and flow.share != math.inf and elapsed > 0:
+                used = (flow.sent - flow._period_sent) / elapsed
+                if used < 0.8 * flow.share:
+                    cap = min(cap, max(used * 1.5, MIN_RATE)) # bottlenecked elsewhere; lend the rest out
+            caps[flow] = (flow.weight, cap)
+            by_peer.setdefault(flow.peer, []).append(flow)
+
+        peer_caps = {}
+        for peer, flows in by_peer.items():
+            peer_limit = self.peer_rates.get(peer, self.peer_rate) or math.inf
+            for flow, cap in fair_share(peer_limit, {flow: caps[flow] for flow in flows}).items():
+                peer_caps[flow] = (flow.weight, cap)
+        shares = fair_share(self.global_rate or math.inf, peer_caps)
+
+        for flow, share in shares.items():
+            flow.share = share
+            flow.bucket.set_rate(0 if share == math.inf else share)
+            flow._batch = 1 if share == math.inf else max(1, min(MAX_BATCH, int(share / 100)))
+            flow._period_sent = flow.sent
+            flow._period_start = now
+        limited = any(share != math.inf for share in shares.values())
+        self._next_rebalance = now + SHAPING_REBALANCE_INTERVAL if limited else math.inf
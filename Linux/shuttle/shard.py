@@ -0,0 +1,452 @@
+"""Sharded send: a batch of files spread over several receivers, each file to exactly one.
+
+ShardSender assigns every file to one target up front, then sends to all
+targets in parallel, one file at a time per target (a FileReceiver serves
+one transfer at a time). Two strategies:
+
+* ``balanced``: largest files first, each to the target that would be done
+  with it soonest given what it already has queued and its expected rate
+  (`weights`, bytes/s; AUTO_TARGET_DEFAULT_CAPACITY when unknown). While
+  sending, the expected rates become measured ones, and a target that runs
+  out of work takes over the last file queued for the target that will
+  finish last, if it would have that file done sooner.
+* ``hash``: consistent hashing of the file name over a ring with
+  SHARD_VNODES points per target, so a name goes to the same target in
+  every batch and adding or dropping a target only moves the names it
+  owns. A file whose owner is gone goes to the next target on the ring,
+  and so does the queue of a slow target; an idle target only takes over
+  files from a slow one, and only those it is next on the ring for.
+
+A target is slow once its measured rate is SHARD_SLOW_FACTOR times below
+the median; in balanced mode its queue is then placed again by measured
+rates, so it keeps only what it would still finish in time. An idle target
+may also take over the file a slow one is still sending (in hash mode, if
+it is next on the ring for it), when sending it again from the start takes
+less than half the time the slow target still needs.
+
+Every file is sent as a relay with an empty chain, so the receiver reports
+once the whole file is written (receivers with the ``relay`` capability);
+a file only counts as delivered with that report. A target that fails is
+dropped for the rest of the batch; the file it was
+on and its queue are placed again among the others, the same way. The
+manifest (`manifest_path`, JSON, written after the batch even if it
+failed) lists every file with its size, the target it was assigned first,
+the target that has it and whether it arrived. ShardSender emits the same
+events as FileSender, with progress and rate over the whole batch.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+from .config import (AUTO_TARGET_DEFAULT_CAPACITY, SENDFILE_MIN_SLICE, SHARD_MIN_SAMPLE, SHARD_SLOW_FACTOR,
+                     SHARD_STRATEGIES, SHARD_VNODES)
+from .events import EventEmitter
+from .metrics import METRICS, PhaseTimer
+from .rate import RateEstimator, format_rate
+from .tracing import TRACE
+from .transfer import hop_label, open_send_connection, read_relay_report, send_error_message
+
+
+def _ring_point(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys onto labels, with `vnodes` points per label."""
+
+    def __init__(self, labels, vnodes=SHARD_VNODES):
+        points = sorted((_ring_point(f"{label}#{i}"), label) for label in set(labels) for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._labels = [label for _, label in points]
+        self._count = len(set(labels))
+
+    def owners(self, key):
+        """Every label in ring order from `key`: its owner first, then the ones that take over from it."""
+        owners = []
+        start = bisect.bisect(self._points, _ring_point(key))
+        for i in range(len(self._labels)):
+            label = self._labels[(start + i) % len(self._labels)]
+            if label not in owners:
+                owners.append(label)
+                if len(owners) == self._count:
+                    break
+        return owners
+
+
+class _Shard:
+    __slots__ = ('host', 'port', 'label', 'weight', 'flow', 'queue', 'queued', 'current', 'left', 'sent', 'busy',
+                 'since', 'files', 'failed', 'slow', 'abandon')
+
+    def __init__(self, host, port, weight):
+        self.host = host
+        self.port = port
+        self.label = hop_label(host, port)
+        self.weight = weight # expected bytes/s until it has been measured
+        self.flow = None
+        self.queue = deque()
+        self.queued = 0 # bytes in the queue
+        self.current = None # file being sent
+        self.left = 0 # bytes of it still to send
+        self.sent = 0
+        self.busy = 0.0 # seconds spent on finished files
+        self.since = None # start of the current file
+        self.files = 0 # files delivered
+        self.failed = None # message once the target has failed
+        self.slow = False
+        self.abandon = False # another target took the current file over
+
+    def backlog(self):
+        return self.queued + self.left
+
+    def rate(self, now):
+        """Measured bytes/s, or None until it has been sending for SHARD_MIN_SAMPLE seconds."""
+        busy = self.busy + (now - self.since if self.since is not None else 0)
+        return self.sent / busy if busy >= SHARD_MIN_SAMPLE else None
+
+    def expected_rate(self, now):
+        rate = self.rate(now)
+        return max(rate if rate is not None else self.weight, 1.0)
+
+
+class ShardSender(EventEmitter):
+    """Sends each file of a list to one of several `targets` ((host, port) pairs), all targets at once.
+
+    `weights` maps ``host:port`` to the bytes/s expected of that target;
+    only the balanced strategy uses them.
+    """
+
+    def __init__(self, targets, file_queue, strategy='balanced', weights=None, manifest_path=None,
+                 slow_factor=SHARD_SLOW_FACTOR, metrics=METRICS, shaper=None):
+        super().__init__()
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy '{strategy}'")
+        weights = weights or {}
+        self.shards = {} # 'host:port' -> _Shard
+        for host, port in targets:
+            shard = _Shard(host, int(port), AUTO_TARGET_DEFAULT_CAPACITY)
+            shard.weight = weights.get(shard.label, shard.weight)
+            self.shards[shard.label] = shard
+        self.file_queue = file_queue.copy()
+        self.strategy = strategy
+        self.manifest_path = manifest_path
+        self.slow_factor = slow_factor
+        self.metrics = metrics
+        self.shaper = shaper # with a Shaper, every target gets a flow of its own
+        self.ring = HashRing(list(self.shards))
+        self.placements = {} # path -> manifest entry
+        self.rate = RateEstimator()
+        self._sizes = {}
+        self._progress = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+        with self._changed:
+            self._changed.notify_all()
+
+    def run(self):
+        missing = [path for path in self.file_queue if not os.path.isfile(path)]
+        if missing:
+            self.emit('transfer_complete', False, f"File '{missing[0]}' not found.")
+            return
+        if not self.shards:
+            self.emit('transfer_complete', False, "No receivers to shard the files over.")
+            return
+        self._sizes = {path: os.path.getsize(path) for path in self.file_queue}
+        total = sum(self._sizes.values())
+        self.rate = RateEstimator(total)
+        order = list(self._sizes)
+        if self.strategy == 'balanced':
+            order.sort(key=lambda path: -self._sizes[path])
+        now = time.monotonic()
+        with self._lock:
+            for path in order:
+                shard = self._place(path, now)
+                self.placements[path] = {'name': os.path.basename(path), 'size': self._sizes[path],
+                                         'assigned': shard.label, 'target': shard.label, 'ok': False}
+                self._enqueue(shard, path)
+        self.emit('status_message', f"Sharding {len(order)} file(s), {total / (1024*1024):.2f} MB, over "
+                                    f"{len(self.shards)} receiver(s) ({self.strategy})")
+        for shard in self.shards.values():
+            self.emit('status_message', f"{shard.label}: {len(shard.queue)} file(s), "
+                                        f"{shard.queued / (1024*1024):.2f} MB")
+            shard.flow = self.shaper.flow(shard.host) if self.shaper else None
+
+        workers = [threading.Thread(target=self._work, args=(shard,), name=f'shard-{shard.label}', daemon=True)
+                   for shard in self.shards.values()]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        finally:
+            for shard in self.shards.values():
+                if shard.flow:
+                    shard.flow.close()
+            if self.manifest_path:
+                self._write_manifest()
+
+        if not self._is_running:
+            return
+        failed = {shard.label: shard.failed for shard in self.shards.values() if shard.failed}
+        details = "; ".join(f"{label}: {message}" for label, message in failed.items())
+        lost = [entry for entry in self.placements.values() if not entry['ok']]
+        if lost:
+            self.emit('transfer_complete', False,
+                      f"{len(lost)} of {len(self.placements)} file(s) could not be delivered: {details}")
+        elif failed:
+            self.emit('transfer_complete', True,
+                      f"All {len(self.placements)} files sharded; {len(failed)} receiver(s) failed and their "
+                      f"files went to the others: {details}")
+        else:
+            self.emit('transfer_complete', True,
+                      f"All {len(self.placements)} files sharded over {len(self.shards)} receiver(s)!")
+
+    def _enqueue(self, shard, path):
+        shard.queue.append(path)
+        shard.queued += self._sizes[path]
+
+    def _live(self):
+        return [shard for shard in self.shards.values() if shard.failed is None]
+
+    def _place(self, path, now):
+        """The target a file goes to, or None when every target has failed; call with the lock held."""
+        if self.strategy == 'hash':
+            for label in self.ring.owners(os.path.basename(path)):
+                if self.shards[label].failed is None:
+                    return self.shards[label]
+            return None
+        size = self._sizes[path]
+        live = self._live()
+        return min(live, key=lambda shard: (shard.backlog() + size) / shard.expected_rate(now)) if live else None
+
+    def _work(self, shard):
+        """Sender thread of one target: its own queue first, then what it can take over from others."""
+        while self._is_running:
+            notes = []
+            with self._changed:
+                path = self._next(shard, notes)
+                while path is None and self._is_running and any(
+                        other.current or other.queue for other in self._live() if other is not shard):
+                    self._changed.wait(0.5) # a failure may still hand us files, and a slow target work to take
+                    path = self._next(shard, notes)
+                if path is not None:
+                    shard.current = path
+                    shard.left = self._sizes[path]
+                    shard.since = time.monotonic()
+            for note in notes:
+                self.emit('status_message', note)
+            if path is None:
+                return
+
+            ok, message, bytes_sent = self._send(shard, path)
+            notes = []
+            with self._changed:
+                shard.busy += time.monotonic() - shard.since
+                shard.since = None
+                shard.current = None
+                shard.left = 0
+                if ok:
+                    shard.files += 1
+                    self.placements[path].update(target=shard.label, ok=True)
+                elif shard.abandon:
+                    shard.abandon = False
+                    self.rate.total += bytes_sent # sent again by the target that took it over
+                elif self._is_running:
+                    self.rate.total += bytes_sent # sent again to another target
+                    self._fail(shard, path, message, notes)
+                self._changed.notify_all()
+            for note in notes:
+                self.emit('status_message', note)
+            if shard.failed is not None:
+                return
+
+    def _next(self, shard, notes):
+        """The next file for `shard`, from its queue or taken over from another; call with the lock held."""
+        now = time.monotonic()
+        self._mark_slow(now, notes)
+        if shard.queue:
+            path = shard.queue.popleft()
+            shard.queued -= self._sizes[path]
+            return path
+        live = [other for other in self._live() if other.queue and other is not shard]
+        live.sort(key=lambda other: other.backlog() / other.expected_rate(now), reverse=True)
+        for victim in live:
+            if self.strategy == 'hash' and not victim.slow:
+                continue
+            finish = victim.backlog() / victim.expected_rate(now)
+            for path in reversed(victim.queue):
+                if self.strategy == 'hash' and self._successor(path, victim) is not shard:
+                    continue
+                if self._sizes[path] / shard.expected_rate(now) < finish:
+                    victim.queue.remove(path)
+                    victim.queued -= self._sizes[path]
+                    notes.append(f"{shard.label} takes {os.path.basename(path)} over from {victim.label}")
+                    return path
+                if self.strategy == 'balanced':
+                    break # only the file the victim would get to last
+        for victim in self._live():
+            path = victim.current
+            if victim is shard or not victim.slow or path is None or victim.abandon:
+                continue
+            if self.strategy == 'hash' and self._successor(path, victim) is not shard:
+                continue
+            # restarting from scratch has to beat the rest of the slow transfer by a wide margin
+            if 2 * self._sizes[path] / shard.expected_rate(now) < victim.left / victim.expected_rate(now):
+                victim.abandon = True
+                notes.append(f"{shard.label} takes {os.path.basename(path)} over from {victim.label}, "
+                             f"which is still sending it")
+                return path
+        return None
+
+    def _successor(self, path, shard):
+        """The live target after `shard` on the ring for this file."""
+        owners = self.ring.owners(os.path.basename(path))
+        for label in owners[owners.index(shard.label) + 1:]:
+            if self.shards[label].failed is None:
+                return self.shards[label]
+        return None
+
+    def _mark_slow(self, now, notes):
+        rates = {shard.label: shard.rate(now) for shard in self._live()}
+        rates = {label: rate for label, rate in rates.items() if rate is not None}
+        if len(rates) < 2:
+            return
+        median = statistics.median(rates.values())
+        for label, rate in rates.items():
+            shard = self.shards[label]
+            slow = rate * self.slow_factor < median
+            if slow and not shard.slow:
+                moved = self._rebalance(shard, now)
+                notes.append(f"{label} is slow: {format_rate(rate)} against a median of {format_rate(median)}" +
+                             (f"; {moved} queued file(s) moved to other receivers" if moved else ""))
+            shard.slow = slow
+
+    def _rebalance(self, shard, now):
+        """Place the queue of a target that became slow again; returns how many files moved."""
+        queued = list(shard.queue)
+        if self.strategy == 'balanced':
+            queued.sort(key=lambda path: -self._sizes[path])
+        shard.queue.clear()
+        shard.queued = 0
+        moved = 0
+        for path in queued:
+            if self.strategy == 'hash':
+                target = self._successor(path, shard) or shard
+            else:
+                target = self._place(path, now)
+            if target is not shard:
+                self.placements[path]['target'] = target.label
+                moved += 1
+            self._enqueue(target, path)
+        return moved
+
+    def _fail(self, shard, path, message, notes):
+        """Drop a failed target and place its files again; call with the lock held."""
+        shard.failed = message
+        orphans = [path] + list(shard.queue)
+        if self.strategy == 'balanced':
+            orphans.sort(key=lambda orphan: -self._sizes[orphan])
+        shard.queue.clear()
+        shard.queued = 0
+        now = time.monotonic()
+        moved = 0
+        for orphan in orphans:
+            target = self._place(orphan, now)
+            if target is None:
+                self.placements[orphan].update(target=None, error=message)
+                continue
+            self.placements[orphan]['target'] = target.label
+            self._enqueue(target, orphan)
+            moved += 1
+        notes.append(f"{shard.label} failed, skipping it. {message}" +
+                     (f" {moved} file(s) placed on the other receivers." if moved else ""))
+
+    def _send(self, shard, path):
+        """Send one file to one target; returns (success, error message, bytes sent)."""
+        filename = os.path.basename(path)
+        filesize = self._sizes[path]
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        bytes_sent = 0
+        success = False
+        try:
+            with open_send_connection(shard.host, shard.port, filename, filesize, timer, relay=[]) as s, \
+                    open(path, 'rb') as f:
+                timer.lap('read') # opening the file
+                while bytes_sent < filesize and self._is_running and not shard.abandon:
+                    count = min(SENDFILE_MIN_SLICE, filesize - bytes_sent)
+                    if shard.flow:
+                        count = min(count, shard.flow.quantum() or count)
+                        shard.flow.throttle(count)
+                        timer.lap('shape')
+                    sent = s.sendfile(f, bytes_sent, count)
+                    timer.lap('send', sent)
+                    if not sent:
+                        break
+                    bytes_sent += sent
+                    self._delivered(shard, sent)
+                    timer.lap('progress')
+                if shard.abandon:
+                    raise ConnectionAbortedError("Taken over by another receiver.")
+                if bytes_sent < filesize:
+                    raise ConnectionAbortedError("Transfer stopped.")
+                if not read_relay_report(s).get('ok'):
+                    raise ConnectionError("The receiver did not store the file.")
+                timer.lap('relay')
+            success = True
+            return True, None, bytes_sent
+        except Exception as e:
+            return False, send_error_message(e, shard.host, shard.port), bytes_sent
+        finally:
+            if 'connect' in timer.phases:
+                timer.lap('close')
+            self.metrics.record('send', shard.host, timer, success)
+            TRACE.complete('send_file', 'sender', trace_start,
+                           args={'file': filename, 'peer': shard.host, 'bytes': bytes_sent, 'ok': success})
+
+    def _delivered(self, shard, nbytes):
+        with self._lock:
+            shard.sent += nbytes
+            shard.left -= nbytes
+            sampled = self.rate.add(nbytes)
+            progress = self.rate.percent()
+            changed = progress != self._progress
+            self._progress = progress
+        if changed:
+            self.emit('progress_updated', progress)
+        if sampled:
+            self.emit('speed_updated', format_rate(self.rate.rate()))
+            self.emit('rate_updated', self.rate.snapshot())
+
+    def manifest(self):
+        """Where every file went, per file and per target."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'created': time.time(),
+                'strategy': self.strategy,
+                'targets': {shard.label: {'files': shard.files, 'bytes': shard.sent, 'rate': shard.rate(now),
+                                          'failed': shard.failed}
+                            for shard in self.shards.values()},
+                'files': [dict(path=os.path.abspath(path), **entry) for path, entry in self.placements.items()]
+            }
+
+    def _write_manifest(self):
+        temp_path = self.manifest_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest(), f, indent=1)
+            os.replace(temp_path, self.manifest_path)
+        except OSError as e:
+            self.emit('status_message', f"Could not write the shard manifest {self.manifest_path}: {e}")
+            return
+        self.emit('status_message', f"Shard manifest written to {self.manifest_path}")
@@ -0,0 +1,551 @@
+"""Swarm distribution: receivers fetch verified chunks from each other, rarest first.
+
+For sites where the receivers together have more bandwidth than the one
+source. The seed builds a manifest of the files: the SHA-256 of every
+SWARM_CHUNK_SIZE chunk. The swarm is named after the hash of the manifest
+itself, so any member can hand the manifest out and nobody can forge it.
+Every node then
+
+* advertises, per swarm, its chunk port and have-bitfield in its discovery
+  responses (``swarms`` in DISCOVERY_RESPONSE), and sends its current
+  bitfield along with every chunk request and every chunk it serves, so
+  views stay fresh between discovery rounds;
+* fetches missing chunks from any peer that has them, rarest first (fewest
+  holders in its view, random among equals, so nodes start on different
+  chunks), and checks each against the manifest before it is written,
+  counted or served on;
+* prefers other receivers over the seed. The seed in turn declines a chunk
+  it has uploaded (or is uploading) before while a receiver is known to hold
+  it or some chunk has not left the seed yet, naming the holders and
+  suggesting chunks nobody has, so it uploads each chunk about once. A
+  declined chunk is asked of the seed again, insistently, only after
+  SWARM_RETRY_AFTER seconds without another holder.
+
+Chunk protocol, one TCP connection per request: 4-byte length plus JSON
+``{'type': 'SWARM_CHUNK', 'swarm', 'chunk', 'port', 'have', 'insist'}`` and a
+JSON reply (``ok``, ``have``, ``seed``; ``reason``, ``holders`` and
+``suggest`` when declined) followed by the chunk. ``SWARM_MANIFEST`` returns the manifest.
+A peer that sends SWARM_MAX_STRIKES corrupt chunks or malformed replies is ignored.
+
+Events as FileReceiver: ``server_started``, ``status_message``,
+``progress_updated``, ``speed_updated``, ``rate_updated`` and
+``transfer_complete`` once every file is in.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from .config import (SWARM_CHUNK_SIZE, SWARM_DOWNLOADS, SWARM_LINGER, SWARM_MAX_STRIKES, SWARM_PEER_DOWNLOADS,
+                     SWARM_PORT, SWARM_RETRY_AFTER, SWARM_TIMEOUT, SWARM_UPLOAD_SLOTS)
+from .events import EventEmitter
+from .metrics import METRICS, PhaseTimer
+from .rate import RateEstimator, format_rate
+from .shaping import TokenBucket
+from .tracing import TRACE
+from .transfer import recv_exactly
+
+UPLOAD_SLICE = 256 * 1024 # bytes sent per token reservation when uploads are rate limited
+
+
+def manifest_id(manifest):
+    body = {key: manifest[key] for key in ('chunk_size', 'files', 'hashes')}
+    text = json.dumps(body, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:40]
+
+
+def build_manifest(paths, chunk_size=SWARM_CHUNK_SIZE):
+    """Chunk hashes of `paths`, in order; ``manifest['id']`` names the swarm."""
+    files = []
+    hashes = []
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            for _ in range(-(-size // chunk_size)):
+                hashes.append(hashlib.sha256(f.read(chunk_size)).hexdigest())
+        files.append({'name': os.path.basename(path), 'size': size})
+    manifest = {'chunk_size': chunk_size, 'files': files, 'hashes': hashes}
+    manifest['id'] = manifest_id(manifest)
+    return manifest
+
+
+def chunk_table(manifest):
+    """(file index, offset, length) of every chunk; chunks never span files."""
+    table = []
+    chunk_size = manifest['chunk_size']
+    for index, entry in enumerate(manifest['files']):
+        for offset in range(0, entry['size'], chunk_size):
+            table.append((index, offset, min(chunk_size, entry['size'] - offset)))
+    return table
+
+
+def pack_have(have, count):
+    """A have-bitfield (an int, bit i for chunk i) as base64 text."""
+    return base64.b64encode(have.to_bytes(-(-count // 8), 'little')).decode('ascii')
+
+
+def unpack_have(text):
+    return int.from_bytes(base64.b64decode(text or ''), 'little')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(len(data).to_bytes(4, 'big') + data)
+
+
+def recv_message(sock):
+    length = int.from_bytes(recv_exactly(sock, 4), 'big')
+    message = json.loads(recv_exactly(sock, length).decode('utf-8'))
+    if not isinstance(message, dict):
+        raise TypeError("message is not a JSON object")
+    return message
+
+
+def _check_chunk_reply(reply):
+    """Raise TypeError unless the fields of a SWARM_CHUNK reply have the types a node sends."""
+    suggest = reply.get('suggest', [])
+    holders = reply.get('holders', [])
+    if not isinstance(reply.get('have') or '', str) or not isinstance(suggest, list) or \
+            not all(isinstance(other, int) for other in suggest) or not isinstance(holders, list) or \
+            not all(isinstance(label, str) and label.rpartition(':')[2].isdigit() for label in holders):
+        raise TypeError("malformed chunk reply")
+
+
+class _Peer:
+    __slots__ = ('label', 'host', 'port', 'have', 'seed', 'active', 'strikes', 'retry_at')
+
+    def __init__(self, label):
+        host, _, port = label.rpartition(':')
+        self.label = label
+        self.host = host
+        self.port = int(port)
+        self.have = 0
+        self.seed = False
+        self.active = 0 # our downloads from it in flight
+        self.strikes = 0 # corrupt chunks and malformed replies it sent
+        self.retry_at = 0.0
+
+
+class SwarmNode(EventEmitter):
+    """One member of a swarm: serves the chunks it has and, unless it is the seed, fetches the rest.
+
+    A seed is made with `manifest` and the `paths` it describes; it serves
+    until stopped, or until `receivers` peers are known to be complete. Any
+    other node is made with the `swarm_id` and a `save_dir`; it finds the
+    manifest through discovery, fetches every chunk, and keeps serving until
+    no one has asked it for anything for `linger` seconds.
+
+    `registry` is the discovery PeerRegistry that carries the other nodes'
+    advertisements; `advertisement()` is what this node's
+    DiscoveryResponseServer should send.
+    """
+
+    def __init__(self, registry, swarm_id=None, manifest=None, paths=None, save_dir=None, host='0.0.0.0',
+                 port=SWARM_PORT, listen_socket=None, linger=SWARM_LINGER, receivers=0, upload_rate=0,
+                 metrics=METRICS):
+        super().__init__()
+        self.registry = registry
+        self.id = manifest['id'] if manifest else swarm_id
+        self.is_seed = paths is not None
+        self.paths = list(paths or [])
+        self.save_dir = save_dir
+        self.host = host
+        self.port = port
+        self.linger = linger
+        self.receivers = receivers
+        self.metrics = metrics
+        self.stats = {'downloaded': 0, 'from_seed': 0, 'uploaded': 0, 'declined': 0, 'corrupt': 0}
+        self.peers = {} # 'ip:port' -> _Peer
+        self.manifest = None
+        self.table = []
+        self.have = 0
+        self.rate = RateEstimator()
+        self._server = listen_socket
+        self._fds = []
+        self._availability = [] # holders per chunk in our view
+        self._missing = set()
+        self._inflight = set()
+        self._declined = {} # chunk -> when the seed declined it; ask it insistently after SWARM_RETRY_AFTER
+        self._suggested = set() # chunks the seed asked us to fetch from it
+        self._uploads = {} # chunk -> uploads started (the seed's bookkeeping)
+        self._fresh = set() # chunks the seed has not uploaded yet
+        self._upload_slots = threading.BoundedSemaphore(SWARM_UPLOAD_SLOTS)
+        self._upload_bucket = TokenBucket(upload_rate)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._last_request = time.monotonic()
+        self._progress = 0
+        self._is_running = True
+        if manifest:
+            self._set_manifest(manifest)
+
+    @property
+    def label(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def complete(self):
+        return self.manifest is not None and self.have == (1 << len(self.table)) - 1
+
+    def stop(self):
+        self._is_running = False
+        with self._lock:
+            self._changed.notify_all()
+
+    def advertisement(self):
+        """This node's entry for the ``swarms`` field of discovery responses."""
+        if self.manifest is None:
+            return {}
+        with self._lock:
+            have = pack_have(self.have, len(self.table))
+        return {self.id: {'port': self.port, 'have': have, 'seed': self.is_seed}}
+
+    def _set_manifest(self, manifest):
+        self.manifest = manifest
+        self.table = chunk_table(manifest)
+        with self._lock:
+            self._availability = [0] * len(self.table)
+            for peer in self.peers.values():
+                self._count(peer.have)
+            if self.is_seed:
+                self.have = (1 << len(self.table)) - 1
+                self._fresh = set(range(len(self.table)))
+            else:
+                self._missing = set(range(len(self.table)))
+
+    def _count(self, bits):
+        while bits:
+            low = bits & -bits
+            chunk = low.bit_length() - 1
+            if chunk < len(self._availability):
+                self._availability[chunk] += 1
+            bits ^= low
+
+    def _merge(self, label, have, seed=None):
+        """Fold what a peer is known to hold into the view; call with the lock held."""
+        peer = self.peers.get(label)
+        if peer is None:
+            peer = self.peers[label] = _Peer(label)
+        if seed is not None:
+            peer.seed = seed
+        new = have & ~peer.have
+        if new:
+            peer.have |= new
+            if self._availability:
+                self._count(new)
+            self._changed.notify_all()
+        return peer
+
+    def _refresh_view(self):
+        """Take in the bitfields the other nodes advertised through discovery."""
+        for device in self.registry.devices():
+            swarms = device.get('swarms')
+            entry = swarms.get(self.id) if isinstance(swarms, dict) else None
+            if not isinstance(entry, dict) or not isinstance(entry.get('port', SWARM_PORT), int):
+                continue # advertised by another node, so nothing about it is taken for granted
+            label = f"{device['ip']}:{entry.get('port', SWARM_PORT)}"
+            try:
+                have = unpack_have(entry.get('have'))
+            except (TypeError, ValueError):
+                continue
+            if label != self.label:
+                with self._lock:
+                    self._merge(label, have, bool(entry.get('seed')))
+
+    def run(self):
+        try:
+            if self._server is None:
+                self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._server.bind((self.host, self.port))
+                self._server.listen(32)
+            self.host, self.port = self._server.getsockname()[:2]
+        except OSError as e:
+            self.emit('server_started', False, f"Cannot serve swarm chunks on port {self.port}: {e}")
+            return
+        self.emit('server_started', True, f"Swarm {self.id} serving chunks on port {self.port}")
+        threading.Thread(target=self._serve, name='swarm-serve', daemon=True).start()
+
+        try:
+            if self.manifest is None:
+                self.emit('status_message', f"Looking for peers of swarm {self.id}...")
+                manifest = self._fetch_manifest()
+                if manifest is None:
+                    return
+                self._set_manifest(manifest)
+            self._open_files()
+            total = sum(entry['size'] for entry in self.manifest['files'])
+            self.rate = RateEstimator(0 if self.is_seed else total)
+            self.emit('status_message', f"Swarm {self.id}: {len(self.manifest['files'])} file(s), "
+                                        f"{total / (1024*1024):.2f} MB in {len(self.table)} chunks")
+            if not self.is_seed:
+                for i in range(SWARM_DOWNLOADS):
+                    threading.Thread(target=self._download, name=f'swarm-download-{i}', daemon=True).start()
+            self._supervise()
+        finally:
+            self._is_running = False
+            self._server.close()
+            with self._lock:
+                self._changed.notify_all()
+            for fd in self._fds:
+                os.close(fd)
+            self._fds = []
+
+    def _supervise(self):
+        finished = self.is_seed
+        while self._is_running:
+            self._refresh_view()
+            if not finished and self.complete:
+                finished = True
+                self._finish()
+                self._last_request = time.monotonic()
+            if finished and not self.is_seed and time.monotonic() - self._last_request >= self.linger:
+                break
+            if self.is_seed and self.receivers:
+                with self._lock:
+                    done = sum(1 for peer in self.peers.values() if peer.have == self.have and not peer.seed)
+                if done >= self.receivers:
+                    self.emit('status_message', f"{done} receiver(s) have the whole swarm.")
+                    break
+            with self._lock:
+                self._changed.wait(0.5)
+        if not finished:
+            self.emit('transfer_complete', False, f"Swarm {self.id} stopped with {len(self._missing)} chunk(s) missing.")
+
+    def _fetch_manifest(self):
+        while self._is_running:
+            self._refresh_view()
+            with self._lock:
+                peers = list(self.peers.values())
+            for peer in peers:
+                try:
+                    with socket.create_connection((peer.host, peer.port), timeout=SWARM_TIMEOUT) as s:
+                        send_message(s, {'type': 'SWARM_MANIFEST', 'swarm': self.id})
+                        reply = recv_message(s)
+                    manifest = reply.get('manifest')
+                    if reply.get('ok') and manifest_id(manifest) == self.id and \
+                            len(chunk_table(manifest)) == len(manifest['hashes']):
+                        return manifest
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+            time.sleep(0.5)
+        return None
+
+    def _open_files(self):
+        if self.is_seed:
+            self._fds = [os.open(path, os.O_RDONLY) for path in self.paths]
+            return
+        os.makedirs(self.save_dir, exist_ok=True)
+        for entry in self.manifest['files']:
+            path = os.path.join(self.save_dir, os.path.basename(entry['name']) or 'unnamed')
+            fd = os.open(path + '.part', os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(fd, entry['size'])
+            self._fds.append(fd)
+            self.paths.append(path)
+
+    def _finish(self):
+        for path in self.paths:
+            os.replace(path + '.part', path) # the descriptors stay valid for serving
+        stats = self.stats
+        self.emit('progress_updated', 100)
+        self.emit('transfer_complete', True,
+                  f"Swarm {self.id} complete: {len(self.paths)} file(s), {stats['downloaded']} chunks of which "
+                  f"{stats['from_seed']} from the seed, {stats['corrupt']} corrupt chunk(s) rejected")
+
+    def _serve(self):
+        self._server.settimeout(1)
+        while self._is_running:
+            try:
+                conn, addr = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn, addr), name='swarm-upload', daemon=True).start()
+
+    def _handle(self, conn, addr):
+        try:
+            with conn:
+                conn.settimeout(SWARM_TIMEOUT)
+                request = recv_message(conn)
+                if request.get('swarm') != self.id or self.manifest is None:
+                    send_message(conn, {'ok': False, 'reason': "unknown swarm"})
+                elif request.get('type') == 'SWARM_MANIFEST':
+                    send_message(conn, {'ok': True, 'manifest': self.manifest})
+                elif request.get('type') == 'SWARM_CHUNK':
+                    self._upload(conn, addr, request)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _upload(self, conn, addr, request):
+        chunk = int(request['chunk'])
+        self._last_request = time.monotonic()
+        with self._lock:
+            requester = None
+            if 'port' in request:
+                requester = self._merge(f"{addr[0]}:{request['port']}", unpack_have(request.get('have')), False)
+            reply = {'ok': False, 'have': pack_have(self.have, len(self.table)), 'seed': self.is_seed}
+            if not 0 <= chunk < len(self.table) or not self.have >> chunk & 1:
+                reply['reason'] = "missing"
+            elif self.is_seed and self._uploads.get(chunk) and not request.get('insist'):
+                holders = [peer.label for peer in self.peers.values()
+                           if peer.have >> chunk & 1 and not peer.seed and peer is not requester]
+                wanted = requester.have if requester else 0
+                fresh = [other for other in self._fresh if not wanted >> other & 1]
+                if holders or fresh:
+                    reply.update(reason="elsewhere", holders=holders[:4],
+                                 suggest=random.sample(fresh, min(len(fresh), 8)))
+                    self.stats['declined'] += 1
+            if 'reason' not in reply:
+                if self._upload_slots.acquire(blocking=False):
+                    self._uploads[chunk] = self._uploads.get(chunk, 0) + 1
+                    self._fresh.discard(chunk)
+                else:
+                    reply['reason'] = "busy"
+        if 'reason' in reply:
+            send_message(conn, reply)
+            return
+
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        ok = False
+        try:
+            index, offset, length = self.table[chunk]
+            data = os.pread(self._fds[index], length, offset)
+            timer.lap('read', length)
+            reply['ok'] = True
+            send_message(conn, reply)
+            view = memoryview(data)
+            step = UPLOAD_SLICE if self._upload_bucket.rate else length
+            for start in range(0, length, step):
+                piece = view[start:start + step]
+                delay = self._upload_bucket.reserve(len(piece))
+                if delay > 0:
+                    time.sleep(delay)
+                timer.lap('shape')
+                conn.sendall(piece)
+                timer.lap('send', len(piece))
+            ok = True
+        finally:
+            with self._lock:
+                if ok:
+                    self.stats['uploaded'] += 1
+                elif self.is_seed:
+                    self._uploads[chunk] -= 1
+                    if not self._uploads[chunk]:
+                        self._fresh.add(chunk)
+            self._upload_slots.release()
+            self.metrics.record('send', addr[0], timer, ok)
+            TRACE.complete('swarm_upload', 'swarm', trace_start, args={'chunk': chunk, 'peer': addr[0], 'ok': ok})
+
+    def _download(self):
+        while self._is_running and not self.complete:
+            with self._lock:
+                picked = self._pick()
+                if picked is None:
+                    self._changed.wait(0.5)
+                    continue
+                chunk, peer = picked
+                self._inflight.add(chunk)
+                peer.active += 1
+            try:
+                self._fetch(chunk, peer)
+            finally:
+                with self._lock:
+                    self._inflight.discard(chunk)
+                    peer.active -= 1
+                    self._changed.notify_all()
+
+    def _pick(self):
+        """The rarest missing chunk some usable peer holds, and that peer; call with the lock held."""
+        now = time.monotonic()
+        usable = [peer for peer in self.peers.values() if peer.strikes < SWARM_MAX_STRIKES
+                  and peer.retry_at <= now and peer.active < SWARM_PEER_DOWNLOADS]
+        if not usable:
+            return None
+        candidates = [chunk for chunk in self._missing if chunk not in self._inflight and self._availability[chunk]]
+        candidates.sort(key=lambda chunk: (self._availability[chunk], chunk not in self._suggested, random.random()))
+        for chunk in candidates:
+            waiting = now - self._declined.get(chunk, -SWARM_RETRY_AFTER) < SWARM_RETRY_AFTER
+            holders = [peer for peer in usable if peer.have >> chunk & 1 and not (waiting and peer.seed)]
+            if holders:
+                receivers = [peer for peer in holders if not peer.seed]
+                return chunk, min(receivers or holders, key=lambda peer: (peer.active, random.random()))
+        return None
+
+    def _fetch(self, chunk, peer):
+        index, offset, length = self.table[chunk]
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        ok = False
+        try:
+            with socket.create_connection((peer.host, peer.port), timeout=SWARM_TIMEOUT) as s:
+                timer.lap('connect')
+                with self._lock:
+                    have = pack_have(self.have, len(self.table))
+                    insist = chunk in self._declined
+                send_message(s, {'type': 'SWARM_CHUNK', 'swarm': self.id, 'chunk': chunk, 'port': self.port,
+                                 'have': have, 'insist': insist})
+                reply = recv_message(s)
+                _check_chunk_reply(reply)
+                timer.lap('handshake')
+                with self._lock:
+                    self._merge(peer.label, unpack_have(reply.get('have')), bool(reply.get('seed')))
+                    if not reply.get('ok'):
+                        if reply.get('reason') == "elsewhere":
+                            self._declined[chunk] = time.monotonic()
+                            self._suggested.update(other for other in reply.get('suggest', [])
+                                                   if 0 <= other < len(self.table))
+                            for label in reply.get('holders', []):
+                                if label != self.label:
+                                    self._merge(label, 1 << chunk)
+                        else:
+                            peer.retry_at = time.monotonic() + SWARM_RETRY_AFTER
+                        return
+                data = recv_exactly(s, length)
+                timer.lap('recv', length)
+            if hashlib.sha256(data).hexdigest() != self.manifest['hashes'][chunk]:
+                with self._lock:
+                    peer.strikes += 1
+                    self.stats['corrupt'] += 1
+                self.emit('status_message', f"Corrupt chunk {chunk} from {peer.label} rejected "
+                                            f"({peer.strikes}/{SWARM_MAX_STRIKES})")
+                return
+            timer.lap('verify')
+            os.pwrite(self._fds[index], data, offset)
+            timer.lap('write', length)
+            with self._lock:
+                self.have |= 1 << chunk
+                self._missing.discard(chunk)
+                self._suggested.discard(chunk)
+                self.stats['downloaded'] += 1
+                if peer.seed:
+                    self.stats['from_seed'] += 1
+                sampled = self.rate.add(length)
+                progress = self.rate.percent()
+                self._changed.notify_all()
+            if progress != self._progress:
+                self._progress = progress
+                self.emit('progress_updated', progress)
+            if sampled:
+                self.emit('speed_updated', format_rate(self.rate.rate()))
+                self.emit('rate_updated', self.rate.snapshot())
+            timer.lap('progress')
+            ok = True
+        except (TypeError, AttributeError, KeyError) as e:
+            with self._lock:
+                peer.strikes += 1
+            self.emit('status_message', f"Malformed reply for chunk {chunk} from {peer.label} "
+                                        f"({peer.strikes}/{SWARM_MAX_STRIKES}): {e}")
+        except (OSError, ValueError) as e:
+            with self._lock:
+                peer.retry_at = time.monotonic() + SWARM_RETRY_AFTER
+            self.emit('status_message', f"Chunk {chunk} from {peer.label} failed: {e}")
+        finally:
+            self.metrics.record('receive', peer.host, timer, ok)
+            TRACE.complete('swarm_chunk', 'swarm', trace_start, args={'chunk': chunk, 'peer': peer.label, 'ok': ok})
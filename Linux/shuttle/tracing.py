@@ -0,0 +1,113 @@
+"""Opt-in timeline tracing in Chrome trace-event format.
+
+Spans and instants from the sender, receiver, discovery and GUI threads go
+into one bounded in-memory ring; nothing touches the disk until `dump()`.
+Open the file in chrome://tracing or https://ui.perfetto.dev to see where a
+transfer spent its time, thread by thread. While tracing is off every call
+returns after a single attribute check.
+
+Turn it on with ``SHUTTLE_TRACE=1``, ``--trace FILE`` on ``shuttle send`` and
+``shuttle receive``, ``shuttle trace start`` against the daemon, or
+Ctrl+Shift+T in the GUI.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+from .config import TRACE_CAPACITY, TRACE_DIR, TRACE_ENABLED
+
+
+class TraceRing:
+    """The newest `capacity` trace events, timestamped with time.perf_counter()."""
+
+    def __init__(self, capacity=TRACE_CAPACITY, enabled=False):
+        self.enabled = enabled
+        self._events = collections.deque(maxlen=capacity)
+        self._thread_names = {} # ident -> name, captured while the thread is alive
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _record(self, phase, name, category, start, duration, args):
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._thread_names:
+                self._thread_names[ident] = threading.current_thread().name
+            self._events.append((phase, name, category, start, duration, ident, args))
+
+    def complete(self, name, category, start, end=None, args=None):
+        """A span that ran from perf_counter() value `start` until `end` (default: now)."""
+        if self.enabled:
+            if end is None:
+                end = time.perf_counter()
+            self._record('X', name, category, start, end - start, args)
+
+    def instant(self, name, category, args=None):
+        if self.enabled:
+            self._record('i', name, category, time.perf_counter(), 0, args)
+
+    def counter(self, name, category, values):
+        """A counter track, e.g. ``{'queued': 12}``; each key becomes one series."""
+        if self.enabled:
+            self._record('C', name, category, time.perf_counter(), 0, values)
+
+    @contextlib.contextmanager
+    def span(self, name, category, args=None):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, args=args)
+
+    def events(self):
+        """The ring as Chrome trace events, with thread-name metadata first."""
+        pid = os.getpid()
+        with self._lock:
+            records = list(self._events)
+            names = dict(self._thread_names)
+
+        events = [{'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': ident, 'args': {'name': name}}
+                  for ident, name in names.items()]
+        for phase, name, category, start, duration, ident, args in records:
+            event = {'ph': phase, 'name': name, 'cat': category, 'pid': pid, 'tid': ident,
+                     'ts': start * 1e6}
+            if phase == 'X':
+                event['dur'] = duration * 1e6
+            elif phase == 'i':
+                event['s'] = 't'
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def dump(self, path=None):
+        """Write the ring as Chrome trace JSON and return the path."""
+        if path is None:
+            path = os.path.join(TRACE_DIR, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+TRACE = TraceRing(enabled=TRACE_ENABLED) # the process-wide ring every component records into
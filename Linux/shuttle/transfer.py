@@ -0,0 +1,649 @@
+"""Qt-free file transfer engine: sender, receiver and the TCP capacity probe.
+
+Workers report through EventEmitter events rather than Qt signals:
+
+* FileSender: ``status_message(str)``, ``progress_updated(int)``,
+  ``speed_updated(str)``, ``rate_updated(dict)``, ``transfer_complete(bool, str)``
+* FileReceiver: the same plus ``server_started(bool, str)``
+
+A send can name a chain of further receivers (``relay`` in the metadata,
+``host:port`` strings, nearest first). Each receiver in it forwards every
+chunk to the next hop as soon as it has written it, so the whole chain is
+done about as soon as a single transfer would be. A hop that cannot be
+reached or breaks off is skipped: the hop before it replays what it already
+has to the one after and carries on. Once the file is complete each relaying
+receiver sends a report back upstream (length-prefixed JSON,
+``{'ok': bool, 'hops': [{'peer', 'ok', 'message'}, ...]}``) listing how
+every hop after it fared.
+
+Receivers only forward when they were started with `allow_relay`, and only
+to hosts it accepts; a chain that repeats a hop or leads back to the
+receiver itself is turned down too. A receiver that turns a chain down
+still keeps the file and lists the hops under ``declined`` in its report,
+so the one before it sends to them directly.
+
+Progress is byte-weighted over the whole batch for a sender and per file for
+a receiver (which sees one connection per file). Speed is the smoothed rate
+of a RateEstimator; ``rate_updated`` carries its snapshot (rate, ETA and
+sparkline history) about twice a second.
+
+Both time every transfer phase into a TransferMetrics table (see metrics.py).
+"""
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+from .config import (BUFFER_SIZE, CAPACITY_PROBE_BYTES, CAPACITY_PROBE_MAX_BYTES, RELAY_CHUNK_SIZE,
+                     RELAY_TIMEOUT, SENDFILE_MIN_SLICE, TRANSFER_MODES)
+from .events import EventEmitter
+from .metrics import METRICS, PhaseTimer
+from .net import get_local_ip
+from .rate import RateEstimator, format_rate
+from .tracing import TRACE
+
+class ThroughputMeter:
+    """Bytes per second over a short sliding window, kept in one-second buckets."""
+
+    def __init__(self, window=5):
+        self.window = window
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        second = int(time.monotonic())
+        with self._lock:
+            self._buckets[second] = self._buckets.get(second, 0) + nbytes
+            if len(self._buckets) > self.window + 1:
+                for key in [k for k in self._buckets if k <= second - self.window]:
+                    del self._buckets[key]
+
+    def rate(self):
+        now = int(time.monotonic())
+        with self._lock:
+            total = sum(n for second, n in self._buckets.items() if second > now - self.window)
+        return total / self.window
+
+class ReceiverNotReady(ConnectionError):
+    pass
+
+
+def send_error_message(error, host, port):
+    if isinstance(error, ReceiverNotReady):
+        return str(error)
+    if isinstance(error, ConnectionRefusedError):
+        return f"Connection to {host}:{port} refused. Is the receiver started?"
+    if isinstance(error, socket.timeout):
+        return "Connection timeout. Receiver not responding."
+    return f"Error while sending: {error}"
+
+
+def hop_label(host, port):
+    return f"{host}:{port}"
+
+
+def relay_policy(mode, registry=None):
+    """`allow_relay` for a FileReceiver in one of RELAY_MODES; 'peers' checks `registry`."""
+    if mode == 'any':
+        return lambda host: True
+    if mode == 'peers':
+        return lambda host: registry.get(host) is not None
+    return None
+
+
+def open_send_connection(host, port, filename, filesize, timer, timeout=10, relay=None):
+    """Connect to a receiver and announce one file; returns the socket once the receiver answers OK.
+
+    With `relay` (a list of ``host:port``, possibly empty) the receiver
+    forwards the file along that chain and sends a report after it.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.settimeout(timeout)
+        s.connect((host, port))
+        timer.lap('connect')
+        
+        metadata = {
+            'filename': filename,
+            'filesize': filesize
+        }
+        if relay is not None:
+            metadata['relay'] = relay
+        metadata = json.dumps(metadata).encode('utf-8')
+        
+        s.sendall(len(metadata).to_bytes(4, 'big'))
+        s.sendall(metadata)
+        
+        confirmation = s.recv(4)
+        timer.lap('handshake')
+        if confirmation != b'OK':
+            raise ReceiverNotReady("Receiver not ready.")
+    except BaseException:
+        s.close()
+        raise
+    return s
+
+
+def recv_exactly(s, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = s.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the peer.")
+        data += chunk
+    return bytes(data)
+
+
+def read_relay_report(s, hops=0):
+    """The report a relaying receiver sends once it and its downstream hops are done.
+
+    `hops` is the length of the chain that receiver was given. Every hop gets
+    RELAY_TIMEOUT of its own, so when one stalls, the hop just above it times
+    out first and reports the stalled one, not its own healthy next hop.
+    """
+    s.settimeout(RELAY_TIMEOUT * (hops + 1))
+    length = int.from_bytes(recv_exactly(s, 4), 'big')
+    return json.loads(recv_exactly(s, length).decode('utf-8'))
+
+
+class _RelayLink:
+    """Forwards a file that is being received to the next reachable hop of its chain."""
+
+    def __init__(self, chain, filename, filesize, local_file, timer, status):
+        self.chain = list(chain) # hops not tried yet, nearest first
+        self.filename = filename
+        self.filesize = filesize
+        self.local_file = local_file
+        self.timer = timer
+        self.status = status
+        self.hops = [] # what became of each hop after this one
+        self.peer = None
+        self.sock = None
+
+    def connect(self, offset):
+        """Open the nearest hop that answers and replay the first `offset` bytes of the file to it."""
+        while self.chain and self.sock is None:
+            self.peer = self.chain.pop(0)
+            host, _, port = self.peer.rpartition(':')
+            try:
+                self.sock = open_send_connection(host, int(port), self.filename, self.filesize, self.timer,
+                                                 timeout=RELAY_TIMEOUT, relay=self.chain)
+                if offset:
+                    self.local_file.flush()
+                    with open(self.local_file.name, 'rb') as f:
+                        self.sock.sendfile(f, 0, offset)
+                    self.timer.lap('relay', offset)
+                self.status(f"Relaying '{self.filename}' to {self.peer}")
+            except Exception as e:
+                self._fail(send_error_message(e, host, port))
+
+    def forward(self, chunk, offset):
+        """Pass on `chunk`, which ends at `offset` of the file."""
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendall(chunk)
+        except OSError as e:
+            self._fail(send_error_message(e, *self.peer.rsplit(':', 1)))
+            self.connect(offset)
+        self.timer.lap('relay', len(chunk))
+
+    def finish(self):
+        """Wait for the downstream report; returns the hop list for the report upstream."""
+        while self.sock is not None:
+            try:
+                report = read_relay_report(self.sock, len(self.chain)) # the chain it was given
+            except (OSError, ValueError) as e:
+                self._fail(f"No report after the file: {e}")
+                self.connect(self.filesize)
+                continue
+            self.sock.close()
+            self.sock = None
+            self.hops.append({'peer': self.peer, 'ok': bool(report.get('ok')), 'message': report.get('message', '')})
+            self.hops.extend(report.get('hops', []))
+            if report.get('declined'):
+                self.status(f"{self.peer} does not relay ({report.get('message')}), sending on directly")
+                self.connect(self.filesize) # the rest of the chain, which it was given and turned down
+        self.timer.lap('relay')
+        return self.hops
+
+    def abort(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _fail(self, message):
+        self.abort()
+        self.hops.append({'peer': self.peer, 'ok': False, 'message': message})
+        self.status(f"Relay hop {self.peer} failed, skipping it: {message}")
+
+class FileSender(EventEmitter):
+    """Sends a list of files, one connection per file.
+
+    `mode` is 'buffered' (read into a `buffer_size` buffer, then sendall) or
+    'sendfile' (kernel zero-copy via socket.sendfile, in `buffer_size` or
+    larger slices so progress is still reported). With a shaping `flow`
+    every chunk waits for its tokens first, and sendfile slices shrink to
+    the flow's quantum so the pacing stays smooth.
+
+    With `relay`, a list of (host, port), the receiver forwards every file
+    along that chain. Hops that fail are reported and skipped for the rest
+    of the batch; if the first receiver fails, the next one takes its place.
+
+    `sources` maps entries of `file_queue` to open descriptors that are read
+    instead of opening the path (the daemon sends files its clients opened).
+    """
+
+    def __init__(self, host, port, file_queue, buffer_size=BUFFER_SIZE, mode='buffered', metrics=METRICS,
+                 flow=None, relay=None, sources=None):
+        super().__init__()
+        if mode not in TRANSFER_MODES:
+            raise ValueError(f"Unknown transfer mode '{mode}'")
+        self.host = host
+        self.port = port
+        self.file_queue = file_queue.copy()
+        self.buffer_size = buffer_size
+        self.mode = mode
+        self.metrics = metrics
+        self.flow = flow # shaping.Flow, or None to send unshaped
+        self.relay = list(relay or [])
+        self.failed = {} # hop label -> message, in relay mode
+        self.sources = dict(sources or {}) # path -> descriptor; the caller keeps ownership
+        self.rate = RateEstimator()
+        self._progress = 0
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def _exists(self, filepath):
+        return filepath in self.sources or os.path.isfile(filepath)
+
+    def _size(self, filepath):
+        fd = self.sources.get(filepath)
+        return os.fstat(fd).st_size if fd is not None else os.path.getsize(filepath)
+
+    def _open(self, filepath):
+        fd = self.sources.get(filepath)
+        if fd is None:
+            return open(filepath, 'rb')
+        f = os.fdopen(os.dup(fd), 'rb')
+        f.seek(0) # the duplicate shares the offset of an earlier attempt
+        return f
+
+    def run(self):
+        self.emit('status_message', "Starting file transfer...")
+        self.rate = RateEstimator(sum(self._size(path) for path in self.file_queue if self._exists(path)))
+        
+        for i, filepath in enumerate(self.file_queue):
+            if not self._is_running:
+                break
+                
+            self.emit('status_message', f"Sending file {i+1}/{len(self.file_queue)}: {os.path.basename(filepath)}")
+            success, message = self._send_single_file(filepath)
+            
+            if not success:
+                self.emit('transfer_complete', False, message)
+                return
+        
+        if not self._is_running:
+            return
+        if self.failed:
+            details = "; ".join(f"{peer}: {message}" for peer, message in self.failed.items())
+            self.emit('transfer_complete', False,
+                      f"{len(self.failed)} of {len(self.relay) + 1} receiver(s) in the chain failed: {details}")
+        elif self.relay:
+            self.emit('transfer_complete', True, f"All files relayed to {len(self.relay) + 1} receiver(s)!")
+        else:
+            self.emit('transfer_complete', True, "All files sent successfully!")
+
+    def _send_single_file(self, filepath):
+        if not self._exists(filepath):
+            return False, f"File '{filepath}' not found."
+        if not self.relay:
+            return self._send_to(self.host, self.port, filepath)[:2]
+
+        chain = [hop for hop in [(self.host, self.port)] + self.relay if hop_label(*hop) not in self.failed]
+        delivered = None
+        reached = set()
+        while chain:
+            (host, port), chain = chain[0], chain[1:]
+            success, message, report = self._send_to(host, port, filepath, [hop_label(*hop) for hop in chain])
+            if success:
+                delivered = message
+                reached.add((host, port))
+                declined = set()
+                if report:
+                    hops = [{'peer': hop_label(host, port), 'ok': report.get('ok'), 'message': report.get('message')}]
+                    for hop in hops + report.get('hops', []):
+                        if not hop['ok']:
+                            self._hop_failed(hop['peer'], hop['message'] or "Incomplete transfer")
+                    declined = set(report.get('declined') or [])
+                if declined:
+                    self.emit('status_message', f"{hop_label(host, port)} does not relay ({report.get('message')}), "
+                                                f"sending on directly")
+                chain = [hop for hop in chain if hop_label(*hop) in declined and hop not in reached]
+                continue
+            if not self._is_running:
+                return False, message
+            self._hop_failed(hop_label(host, port), message)
+        if delivered is not None:
+            return True, delivered
+        return False, "Every receiver in the chain has failed."
+
+    def _hop_failed(self, peer, message):
+        if peer not in self.failed:
+            self.failed[peer] = message
+            self.emit('status_message', f"{peer} failed, skipping it: {message}")
+
+    def _send_to(self, host, port, filepath, relay=None):
+        """Send one file to one receiver; returns (success, message, relay report or None)."""
+        filename = os.path.basename(filepath)
+        filesize = self._size(filepath)
+        timer = PhaseTimer()
+        success = False
+        bytes_sent = 0
+        trace_start = time.perf_counter()
+        
+        try:
+            with open_send_connection(host, port, filename, filesize, timer,
+                                      timeout=10 if relay is None else RELAY_TIMEOUT, relay=relay) as s:
+                slice_size = max(self.buffer_size, SENDFILE_MIN_SLICE)
+                
+                with self._open(filepath) as f:
+                    while bytes_sent < filesize and self._is_running:
+                        if self.mode == 'sendfile':
+                            count = min(slice_size, filesize - bytes_sent)
+                            if self.flow:
+                                count = min(count, self.flow.quantum() or count)
+                                self.flow.throttle(count)
+                                timer.lap('shape')
+                            sent = s.sendfile(f, bytes_sent, count)
+                            timer.lap('send', sent)
+                            if not sent:
+                                break
+                            bytes_sent += sent
+                        else:
+                            chunk = f.read(self.buffer_size)
+                            timer.lap('read', len(chunk))
+                            if not chunk:
+                                break
+                            if self.flow:
+                                self.flow.throttle(len(chunk))
+                                timer.lap('shape')
+                            
+                            s.sendall(chunk)
+                            timer.lap('send', len(chunk))
+                            bytes_sent += len(chunk)
+                            sent = len(chunk)
+                        
+                        sampled = self.rate.add(sent)
+                        progress = self.rate.percent()
+                        if progress != self._progress:
+                            self._progress = progress
+                            self.emit('progress_updated', progress)
+                        if sampled:
+                            self.emit('speed_updated', format_rate(self.rate.rate()))
+                            self.emit('rate_updated', self.rate.snapshot())
+                        timer.lap('progress')
+
+                report = None
+                if relay is not None and bytes_sent == filesize:
+                    report = read_relay_report(s, len(relay))
+                    timer.lap('relay')
+                success = True
+                return True, f"File '{filename}' sent successfully!", report
+
+        except Exception as e:
+            if relay is not None:
+                self.rate.total += bytes_sent # sent again to the next hop
+            return False, send_error_message(e, host, port), None
+        finally:
+            if 'connect' in timer.phases:
+                timer.lap('close')
+            self.metrics.record('send', host, timer, success)
+            TRACE.complete('send_file', 'sender', trace_start,
+                           args={'file': filename, 'peer': host, 'bytes': bytes_sent, 'ok': success})
+
+class FileReceiver(EventEmitter):
+    """Receives files into `save_dir`, one connection at a time.
+
+    `allow_relay(host)` says whether a relay chain may name `host`; without
+    it the receiver keeps what it is sent and forwards nothing.
+    """
+
+    def __init__(self, host, port, save_dir, listen_socket=None, buffer_size=BUFFER_SIZE, metrics=METRICS,
+                 allow_relay=None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.save_dir = save_dir
+        self.buffer_size = buffer_size
+        self.metrics = metrics
+        self.allow_relay = allow_relay
+        self._is_running = False
+        self._server_socket = listen_socket
+        self.active_transfers = 0
+        self.inbound = ThroughputMeter()
+
+    def load(self):
+        """Live load figures advertised through discovery."""
+        try:
+            free_bytes = shutil.disk_usage(self.save_dir).free
+        except OSError:
+            free_bytes = None
+        return {
+            'active_transfers': self.active_transfers,
+            'inbound_bps': self.inbound.rate(),
+            'free_bytes': free_bytes
+        }
+
+    def run(self):
+        os.makedirs(self.save_dir, exist_ok=True)
+        self._is_running = True
+
+        try:
+            if self._server_socket is None:
+                self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._server_socket.bind((self.host, self.port))
+                self._server_socket.listen(5)
+            
+            local_ip = get_local_ip()
+            self.emit('server_started', True, f"Server started on {local_ip}:{self.port}")
+            self.emit('status_message', f"Waiting for connections on {local_ip}:{self.port}...")
+
+            while self._is_running:
+                try:
+                    self._server_socket.settimeout(1)
+                    conn, addr = self._server_socket.accept()
+                    self.emit('status_message', f"Connection from {addr[0]} accepted.")
+                    self._handle_client(conn, addr)
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    if self._is_running:
+                        self.emit('status_message', f"Error accepting connection: {e}")
+
+        except Exception as e:
+            self.emit('server_started', False, f"Error starting server: {e}")
+        finally:
+            if self._server_socket:
+                self._server_socket.close()
+            self.emit('status_message', "Receiver server stopped.")
+            self.emit('progress_updated', 0)
+            self.emit('speed_updated', "0.00 MB/s")
+
+    def _handle_client(self, conn, addr):
+        timer = PhaseTimer()
+        trace_start = time.perf_counter()
+        try:
+            with conn:
+                conn.settimeout(30)
+                
+                metadata_length = int.from_bytes(conn.recv(4), 'big')
+                metadata_bytes = conn.recv(metadata_length)
+                metadata = json.loads(metadata_bytes.decode('utf-8'))
+                
+                if metadata.get('type') == 'CAPACITY_PROBE':
+                    self._handle_capacity_probe(conn, addr, metadata)
+                    return
+                
+                filename = metadata['filename']
+                filesize = metadata['filesize']
+                relay = metadata.get('relay') # None unless the sender asked for a report
+                hops = []
+                refusal = self._check_relay(relay, conn) if relay else None
+                if refusal:
+                    self.emit('status_message', f"Not relaying '{filename}': {refusal}")
+                
+                filepath = os.path.join(self.save_dir, filename)
+                
+                conn.sendall(b'OK')
+                timer.lap('handshake')
+                
+                self.emit('status_message', f"Receiving file: {filename} ({filesize / (1024*1024):.2f} MB)")
+                
+                bytes_received = 0
+                rate = RateEstimator(filesize)
+                last_progress = 0
+                self.active_transfers += 1
+                timer.lap('progress')
+                
+                try:
+                    with open(filepath, 'wb') as f:
+                        timer.lap('write') # opening the destination file
+                        link = None
+                        chunk_size = self.buffer_size
+                        if relay and not refusal:
+                            chunk_size = max(chunk_size, RELAY_CHUNK_SIZE) # a send per chunk on top of the write
+                            link = _RelayLink(relay, filename, filesize, f, timer,
+                                              lambda message: self.emit('status_message', message))
+                            link.connect(0)
+                        while bytes_received < filesize and self._is_running:
+                            remaining = min(chunk_size, filesize - bytes_received)
+                            chunk = conn.recv(remaining)
+                            timer.lap('recv', len(chunk))
+                            
+                            if not chunk:
+                                break
+                                
+                            f.write(chunk)
+                            timer.lap('write', len(chunk))
+                            bytes_received += len(chunk)
+                            self.inbound.add(len(chunk))
+                            if link:
+                                link.forward(chunk, bytes_received)
+                            
+                            sampled = rate.add(len(chunk))
+                            progress = rate.percent()
+                            if progress != last_progress:
+                                last_progress = progress
+                                self.emit('progress_updated', progress)
+                            if sampled:
+                                self.emit('speed_updated', format_rate(rate.rate()))
+                                self.emit('rate_updated', rate.snapshot())
+                            timer.lap('progress')
+                        if link:
+                            if bytes_received == filesize:
+                                hops = link.finish()
+                            else:
+                                link.abort()
+                finally:
+                    self.active_transfers -= 1
+                    timer.lap('close')
+                    self.metrics.record('receive', addr[0], timer, bytes_received == filesize)
+                    TRACE.complete('receive_file', 'receiver', trace_start,
+                                   args={'file': filename, 'peer': addr[0], 'bytes': bytes_received})
+
+                if relay is not None and bytes_received == filesize:
+                    report = {'ok': True, 'hops': hops}
+                    if refusal:
+                        report.update(message=refusal, declined=relay if isinstance(relay, list) else [])
+                    report = json.dumps(report).encode('utf-8')
+                    conn.sendall(len(report).to_bytes(4, 'big') + report)
+                if bytes_received == filesize:
+                    self.emit('transfer_complete', True, f"File '{filename}' received successfully!")
+                else:
+                    self.emit('transfer_complete', False, f"Incomplete transfer of '{filename}'")
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+
+        except Exception as e:
+            self.emit('transfer_complete', False, f"Error while receiving: {e}")
+        finally:
+            self.emit('progress_updated', 0)
+            self.emit('speed_updated', "0.00 MB/s")
+
+    def _check_relay(self, chain, conn):
+        """Why this receiver will not forward along `chain`, or None if it will."""
+        if self.allow_relay is None:
+            return "relaying is off here"
+        if not isinstance(chain, list) or not all(isinstance(hop, str) for hop in chain):
+            return "malformed relay chain"
+        hops = []
+        for hop in chain:
+            host, _, port = hop.rpartition(':')
+            if not host or not port.isdigit() or not 0 < int(port) < 65536:
+                return f"malformed relay hop '{hop}'"
+            hops.append((host.lower(), int(port)))
+        if len(set(hops)) != len(hops):
+            return "the relay chain repeats a hop"
+        local_ip, local_port = conn.getsockname()[:2]
+        own = {local_ip, get_local_ip(), self.host, 'localhost', socket.gethostname().lower()}
+        for host, port in hops:
+            if port == local_port and (host in own or host.startswith('127.')):
+                return "the relay chain leads back to this receiver"
+            if not self.allow_relay(host):
+                return f"{host} is not a peer this receiver relays to"
+        return None
+
+    def _handle_capacity_probe(self, conn, addr, metadata):
+        size = int(metadata.get('size', 0))
+        if not 0 < size <= CAPACITY_PROBE_MAX_BYTES:
+            conn.sendall(b'NO')
+            return
+
+        conn.sendall(b'OK')
+        remaining = size
+        buffer = bytearray(1024 * 1024)
+        while remaining > 0:
+            received = conn.recv_into(buffer, min(len(buffer), remaining))
+            if not received:
+                return
+            remaining -= received
+        conn.sendall(b'DONE')
+        self.emit('status_message', f"Answered capacity probe from {addr[0]}")
+
+    def stop(self):
+        self._is_running = False
+        if self._server_socket:
+            try:
+                self._server_socket.close()
+            except:
+                pass
+
+def probe_capacity(host, port, size=CAPACITY_PROBE_BYTES, timeout=10):
+    """Push `size` throwaway bytes to a receiver and return the measured bytes/second."""
+    payload = memoryview(bytes(min(size, 1024 * 1024)))
+    with socket.create_connection((host, port), timeout=timeout) as s:
+        metadata = json.dumps({'type': 'CAPACITY_PROBE', 'size': size}).encode('utf-8')
+        s.sendall(len(metadata).to_bytes(4, 'big'))
+        s.sendall(metadata)
+        if s.recv(4) != b'OK':
+            raise ConnectionError("Receiver does not support capacity probes.")
+
+        start_time = time.monotonic()
+        remaining = size
+        while remaining > 0:
+            chunk = payload[:min(len(payload), remaining)]
+            s.sendall(chunk)
+            remaining -= len(chunk)
+        if s.recv(4) != b'DONE':
+            raise ConnectionError("Capacity probe was not acknowledged.")
+        elapsed = time.monotonic() - start_time
+
+    return size / elapsed if elapsed > 0 else float('inf')
@@ -0,0 +1,170 @@
+"""Event-loop lag and stall watchdog.
+
+The loop under watch calls `beat()` from a repeating timer every `interval`
+seconds. How late each beat arrives is the loop's lag: the time its timers,
+queued signals and repaints waited behind whatever was running on the loop
+thread. A watchdog thread notices when beats stop for longer than
+`stall_threshold` and reports the loop thread's Python stack while the
+stall is still in progress, so the log shows what is blocking rather than
+what happened to run next.
+
+Signals crossing into the loop are counted when they are queued (on the
+emitting thread) and when the loop delivers them; the difference is the
+backlog waiting behind a stall.
+
+The numbers go out through the transfer telemetry: `start()` registers the
+watchdog with METRICS (Prometheus text and the JSON snapshot), and with
+tracing on every beat adds to an ``event_loop`` counter track.
+"""
+
+import bisect
+import sys
+import threading
+import time
+import traceback
+
+from .config import LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD
+from .metrics import METRICS
+from .tracing import TRACE
+
+
+class EventLoopWatchdog:
+    """Lag histogram, stalls and signal backlog of one event loop."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # lag, seconds
+
+    def __init__(self, name='gui', interval=LOOP_LAG_INTERVAL, stall_threshold=LOOP_STALL_THRESHOLD,
+                 on_stall=None, metrics=METRICS):
+        self.name = name
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.on_stall = on_stall # called with a message from the watchdog thread
+        self.metrics = metrics
+        self.lag_counts = [0] * (len(self.BUCKETS) + 1) # the last slot is +Inf
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.queued = 0
+        self.delivered = 0
+        self.backlog_max = 0
+        self._loop_ident = None
+        self._last_beat = None
+        self._stall_reported = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def backlog(self):
+        return self.queued - self.delivered
+
+    def start(self):
+        """Call on the loop thread just before its timer starts calling `beat()`."""
+        self._loop_ident = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name=f'{self.name}-watchdog', daemon=True)
+        self._thread.start()
+        if self.metrics:
+            self.metrics.register(self)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(2)
+        if self.metrics:
+            self.metrics.unregister(self)
+
+    def beat(self):
+        now = time.perf_counter()
+        with self._lock:
+            lag = max(0.0, now - self._last_beat - self.interval)
+            self._last_beat = now
+            self.lag_counts[bisect.bisect_left(self.BUCKETS, lag)] += 1
+            self.lag_sum += lag
+            self.lag_max = max(self.lag_max, lag)
+            if lag >= self.stall_threshold:
+                self.stalls += 1
+                self.stall_seconds += lag
+            reported, self._stall_reported = self._stall_reported, False
+            backlog = self.queued - self.delivered
+        TRACE.counter('event_loop', 'gui', {'lag_ms': lag * 1000, 'backlog': backlog})
+        if reported and self.on_stall:
+            self.on_stall(f"Event loop '{self.name}' recovered after a {lag:.2f} s stall")
+
+    def signal_queued(self, *args):
+        """Count a signal emitted towards the loop; call on the emitting thread."""
+        with self._lock:
+            self.queued += 1
+            self.backlog_max = max(self.backlog_max, self.queued - self.delivered)
+
+    def signal_delivered(self, *args):
+        """Count a signal the loop has dispatched; call on the loop thread."""
+        with self._lock:
+            self.delivered += 1
+
+    def _watch(self):
+        poll = min(self.interval, self.stall_threshold / 4)
+        while not self._stopped.wait(poll):
+            with self._lock:
+                late = time.perf_counter() - self._last_beat - self.interval
+                if late < self.stall_threshold or self._stall_reported:
+                    continue
+                self._stall_reported = True
+                backlog = self.queued - self.delivered
+            frame = sys._current_frames().get(self._loop_ident)
+            stack = ''.join(traceback.format_stack(frame)).rstrip() if frame else "(thread has exited)"
+            TRACE.instant('event_loop_stall', 'gui', {'late_ms': late * 1000, 'backlog': backlog})
+            if self.on_stall:
+                self.on_stall(f"Event loop '{self.name}' stalled for {late:.2f} s with {backlog} "
+                              f"signal(s) waiting, in:\n{stack}")
+
+    def snapshot(self):
+        with self._lock:
+            beats = sum(self.lag_counts)
+            return {
+                'beats': beats,
+                'lag_mean_s': self.lag_sum / beats if beats else 0.0,
+                'lag_max_s': self.lag_max,
+                'lag_buckets': dict(zip([str(b) for b in self.BUCKETS] + ['+Inf'], self.lag_counts)),
+                'stalls': self.stalls,
+                'stall_seconds': self.stall_seconds,
+                'signals_queued': self.queued,
+                'signals_delivered': self.delivered,
+                'signal_backlog': self.queued - self.delivered,
+                'signal_backlog_max': self.backlog_max
+            }
+
+    def render(self):
+        """Prometheus lines for this loop, labelled ``loop="<name>"``."""
+        with self._lock:
+            counts = list(self.lag_counts)
+            lag_sum, lag_max = self.lag_sum, self.lag_max
+            stalls, stall_seconds = self.stalls, self.stall_seconds
+            queued, delivered, backlog_max = self.queued, self.delivered, self.backlog_max
+
+        label = f'loop="{self.name}"'
+        lines = ["# HELP shuttle_event_loop_lag_seconds How late event-loop heartbeats fire.",
+                 "# TYPE shuttle_event_loop_lag_seconds histogram"]
+        cumulative = 0
+        for bound, count in zip([str(b) for b in self.BUCKETS] + ['+Inf'], counts):
+            cumulative += count
+            lines.append(f'shuttle_event_loop_lag_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f"shuttle_event_loop_lag_seconds_sum{{{label}}} {lag_sum}")
+        lines.append(f"shuttle_event_loop_lag_seconds_count{{{label}}} {cumulative}")
+        for name, kind, help_text, value in (
+            ('shuttle_event_loop_lag_max_seconds', 'gauge', "Worst heartbeat lag since start.", lag_max),
+            ('shuttle_event_loop_stalls_total', 'counter', "Heartbeats later than the stall threshold.", stalls),
+            ('shuttle_event_loop_stall_seconds_total', 'counter', "Time lost to stalls.", stall_seconds),
+            ('shuttle_event_loop_signals_queued_total', 'counter', "Signals queued to the loop.", queued),
+            ('shuttle_event_loop_signals_delivered_total', 'counter', "Signals the loop dispatched.", delivered),
+            ('shuttle_event_loop_signal_backlog', 'gauge', "Signals queued but not yet dispatched.",
+             queued - delivered),
+            ('shuttle_event_loop_signal_backlog_max', 'gauge', "Largest signal backlog since start.", backlog_max)
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{{{label}}} {value}")
+        return lines
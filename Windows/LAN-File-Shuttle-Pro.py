@@ -4,6 +4,8 @@ import os
 import threading
 import time
 import json
+import select
+import ipaddress
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLineEdit, QLabel, QFileDialog,
                              QProgressBar, QTextEdit, QMessageBox, QGroupBox,
@@ -17,6 +19,13 @@ BUFFER_SIZE = 4096
 RECEIVE_DIR = 'received_files'
 DISCOVERY_PORT = 50000
 DISCOVERY_INTERVAL = 3
+# Set SHUTTLE_SWEEP_CIDR (e.g. '10.20.0.0/22') to sweep more than the local /24
+DISCOVERY_SWEEP_CIDR = os.environ.get('SHUTTLE_SWEEP_CIDR')
+DISCOVERY_MODE = 'sweep'
+DISCOVERY_SWEEP_RATE = 2000 # unicast probes per second
+DISCOVERY_SWEEP_SLICE = 256 # unknown addresses re-probed per round after the first full sweep
+DISCOVERY_SWEEP_MAX_MISSES = 3 # rounds without a reply before a known host is forgotten
+DISCOVERY_SWEEP_MAX_PREFIX = 16 # widest range a sweep takes: a /16 is 65534 probes, about 33 s at the sweep rate
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -235,15 +244,157 @@ class FileReceiver(QObject):
             except:
                 pass
 
+class SubnetSweeper:
+    """Unicast discovery over a whole CIDR range for networks that filter broadcast.
+
+    The first round probes every host address; a sweep that is interrupted
+    picks it up where it stopped. Later rounds only re-probe hosts that
+    answered recently plus a rotating slice of the rest of the range.
+    """
+
+    def __init__(self, cidr, rate=DISCOVERY_SWEEP_RATE, slice_size=DISCOVERY_SWEEP_SLICE,
+                 max_misses=DISCOVERY_SWEEP_MAX_MISSES):
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.version != 4:
+            raise ValueError("only IPv4 ranges can be swept")
+        if network.prefixlen < DISCOVERY_SWEEP_MAX_PREFIX:
+            raise ValueError(f"larger than a /{DISCOVERY_SWEEP_MAX_PREFIX}")
+        if network.num_addresses > 2:
+            # Skip the network and broadcast addresses
+            self._first = int(network.network_address) + 1
+            self._count = network.num_addresses - 2
+        else:
+            self._first = int(network.network_address)
+            self._count = network.num_addresses
+        self.network = network
+        self.rate = rate
+        self.slice_size = slice_size
+        self.max_misses = max_misses
+        self._known = {} # ip -> rounds since the last reply
+        self._cursor = 0
+        self._swept_once = False
+
+    @property
+    def known_hosts(self):
+        return list(self._known)
+
+    def mark_responsive(self, ip):
+        if ip in self._known or self._contains(ip):
+            self._known[ip] = 0
+
+    def _contains(self, ip):
+        try:
+            return 0 <= int(ipaddress.IPv4Address(ip)) - self._first < self._count
+        except ValueError:
+            return False
+
+    def _address(self, index):
+        return str(ipaddress.IPv4Address(self._first + index))
+
+    def _first_round(self):
+        while self._cursor < self._count:
+            yield self._address(self._cursor)
+            self._cursor += 1 # only once the address was taken, so an interrupted sweep resumes there
+        self._cursor = 0
+        self._swept_once = True
+
+    def targets(self):
+        """Addresses to probe this round, as an iterator; the first round is generated as it goes."""
+        if not self._swept_once:
+            return self._first_round()
+
+        for ip in list(self._known):
+            self._known[ip] += 1
+            if self._known[ip] > self.max_misses:
+                del self._known[ip]
+
+        targets = list(self._known)
+        remaining = min(self.slice_size, self._count)
+        while remaining > 0:
+            ip = self._address(self._cursor)
+            self._cursor = (self._cursor + 1) % self._count
+            remaining -= 1
+            if ip not in self._known:
+                targets.append(ip)
+        return iter(targets)
+
+    def sweep(self, sock, message, port, on_reply, should_stop=None):
+        """Send `message` to every target at most `rate` per second.
+
+        `sock` must be non-blocking. Replies that arrive while the sweep is
+        running are handed to `on_reply(data, addr)` as they come in. The
+        sweep ends early once `should_stop()` is true; it is asked between
+        batches.
+        """
+        targets = self.targets()
+        target = next(targets, None)
+        start = time.monotonic()
+        sent = 0
+
+        while target is not None and not (should_stop and should_stop()):
+            allowed = int((time.monotonic() - start) * self.rate) + 1
+            while sent < allowed and target is not None:
+                try:
+                    sock.sendto(message, (target, port))
+                except BlockingIOError:
+                    select.select([], [sock], [], 0.05)
+                    break
+                except OSError:
+                    pass # unreachable hosts and the like
+                sent += 1
+                target = next(targets, None)
+
+            wait = (sent + 1) / self.rate - (time.monotonic() - start)
+            drain_datagrams(sock, on_reply, max(0.0, wait))
+
+        return sent
+
+def drain_datagrams(sock, on_reply, timeout):
+    """Hand every datagram that arrives on `sock` within `timeout` seconds to `on_reply`."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        readable, _, _ = select.select([sock], [], [], max(0.0, remaining))
+        if readable:
+            while True:
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except (BlockingIOError, socket.timeout):
+                    break
+                except OSError:
+                    break
+                on_reply(data, addr)
+        if remaining <= 0:
+            return
+
 class DeviceDiscovery(QObject):
     device_found = pyqtSignal(str, str, bool)
     status_update = pyqtSignal(str)
     
-    def __init__(self):
+    def __init__(self, mode=DISCOVERY_MODE, sweep_cidr=DISCOVERY_SWEEP_CIDR):
         super().__init__()
         self._is_running = False
         self._discovered_devices = {}
         self._last_seen = {}
+        self.mode = mode
+        self.sweep_cidr = sweep_cidr
+        self._sweeper = None
+
+    def _handle_reply(self, data, addr):
+        try:
+            reply = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return
+        if reply.get('type') != 'DISCOVERY_RESPONSE':
+            return
+
+        ip = addr[0]
+        if self._sweeper:
+            self._sweeper.mark_responsive(ip)
+        if ip != get_local_ip():
+            self._last_seen[ip] = time.time()
+            self.device_found.emit(ip, reply.get('sender_hostname', 'Unknown'),
+                                   reply.get('is_receiving', False))
 
     def run(self):
         self._is_running = True
@@ -251,7 +402,15 @@ class DeviceDiscovery(QObject):
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.settimeout(1)
+        sock.setblocking(False)
+
+        if self.mode == 'sweep':
+            cidr = self.sweep_cidr or f"{get_local_ip()}/24"
+            try:
+                self._sweeper = SubnetSweeper(cidr)
+                self.status_update.emit(f"Sweeping {self._sweeper.network} ({self._sweeper.rate} probes/s)")
+            except ValueError as e:
+                self.status_update.emit(f"Invalid sweep range '{cidr}': {e}. Falling back to broadcast.")
 
         while self._is_running:
             try:
@@ -266,14 +425,14 @@ class DeviceDiscovery(QObject):
                 }
                 
                 message = json.dumps(discovery_data).encode('utf-8')
+                round_start = time.monotonic()
                 
-                network_base = '.'.join(local_ip.split('.')[:-1]) + '.'
-                for i in range(1, 255):
-                    target_ip = network_base + str(i)
-                    try:
-                        sock.sendto(message, (target_ip, DISCOVERY_PORT))
-                    except:
-                        pass
+                if self._sweeper:
+                    self._sweeper.sweep(sock, message, DISCOVERY_PORT, self._handle_reply,
+                                        lambda: not self._is_running)
+                else:
+                    # Send broadcast to the local network
+                    sock.sendto(message, ('<broadcast>', DISCOVERY_PORT))
 
                 current_time = time.time()
                 for ip in list(self._last_seen.keys()):
@@ -282,7 +441,9 @@ class DeviceDiscovery(QObject):
                         if ip in self._discovered_devices:
                             del self._discovered_devices[ip]
 
-                time.sleep(DISCOVERY_INTERVAL)
+                # Collect replies until the next round is due
+                remaining = DISCOVERY_INTERVAL - (time.monotonic() - round_start)
+                drain_datagrams(sock, self._handle_reply, max(0.0, remaining))
 
             except Exception as e:
                 self.status_update.emit(f"Discovery Error: {e}")
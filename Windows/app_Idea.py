@@ -41,24 +41,30 @@ class FileSender(QObject):
         self.port = port
         self._is_running = True
         self.file_queue = []
+        self._queue_changed = threading.Condition()
         self._current_file_path = None
         self._current_file_size = 0
         self._bytes_sent = 0
 
     def add_file(self, filepath):
-        self.file_queue.append(filepath)
+        with self._queue_changed:
+            self.file_queue.append(filepath)
+            self._queue_changed.notify()
 
     def stop(self):
-        self._is_running = False
+        with self._queue_changed:
+            self._is_running = False
+            self._queue_changed.notify()
 
     def run(self):
         self.status_message.emit("Sende-Worker gestartet. Warte auf Dateien...")
-        while self._is_running:
-            if not self.file_queue:
-                time.sleep(0.1)
-                continue
-
-            filepath = self.file_queue.pop(0)
+        while True:
+            with self._queue_changed:
+                while self._is_running and not self.file_queue:
+                    self._queue_changed.wait()
+                if not self._is_running:
+                    break
+                filepath = self.file_queue.pop(0)
             self._current_file_path = filepath
 
             if not os.path.exists(self._current_file_path):